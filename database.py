@@ -0,0 +1,145 @@
+"""
+Фабрика подключения к базе PriceParser.
+
+Движок выбирается настройкой DB_ENGINE: SQLite (по умолчанию) или
+PostgreSQL с пулом подключений для развёртывания в несколько процессов
+(веб-приложение, бот и воркеры PIT отдельно).
+
+Бот, планировщик, потоки run_in_executor и веб-приложение работают с одной
+базой, поэтому каждое подключение SQLite настраивается одинаково:
+
+- journal_mode=WAL - читатели не блокируют писателя и наоборот;
+- synchronous=NORMAL - в режиме WAL синхронизация только на контрольных точках;
+- cache_size, mmap_size - кэш страниц и отображение файла в память;
+- busy_timeout - ожидание блокировки вместо немедленного "database is locked";
+- temp_store=MEMORY - временные таблицы и сортировки в памяти.
+
+peewee держит отдельное подключение для каждого потока. Потоки пула
+(run_in_executor) оборачивают работу с базой в thread_connection, чтобы
+подключение закрывалось после задачи, а не висело до конца жизни потока.
+"""
+
+import functools
+import sqlite3
+from contextlib import contextmanager
+
+from peewee import SqliteDatabase
+
+import config
+
+ENGINES = ("sqlite", "postgres")
+
+# UPSERT (ON CONFLICT) появился в SQLite 3.24, оконные функции - в 3.25
+MIN_SQLITE_VERSION = (3, 25, 0)
+
+
+def sqlite_pragmas():
+    """PRAGMA, которые выполняются на каждом новом подключении SQLite."""
+    return {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -config.SQLITE_CACHE_SIZE_KB,  # отрицательное значение - в КиБ
+        "mmap_size": config.SQLITE_MMAP_SIZE,
+        "busy_timeout": config.SQLITE_BUSY_TIMEOUT_MS,
+        "temp_store": "memory",
+    }
+
+
+def check_sqlite_version():
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        required = ".".join(map(str, MIN_SQLITE_VERSION))
+        raise RuntimeError(
+            f"Нужен SQLite {required} или новее (ON CONFLICT и оконные функции), "
+            f"установлен {sqlite3.sqlite_version}"
+        )
+
+
+def make_sqlite_database(path):
+    """Создаёт базу SQLite с настройками производительности."""
+    check_sqlite_version()
+    return SqliteDatabase(
+        path,
+        pragmas=sqlite_pragmas(),
+        timeout=config.SQLITE_BUSY_TIMEOUT_MS / 1000,
+    )
+
+
+def make_postgres_database(url):
+    """Создаёт пул подключений PostgreSQL по URL (нужен psycopg2)."""
+    if not url:
+        raise RuntimeError("Для DB_ENGINE=postgres укажите DATABASE_URL")
+    from playhouse.db_url import parse
+    from playhouse.pool import PooledPostgresqlExtDatabase
+
+    params = parse(url)
+    return PooledPostgresqlExtDatabase(
+        params.pop("database"),
+        max_connections=config.DB_POOL_SIZE,
+        stale_timeout=config.DB_POOL_STALE_TIMEOUT,
+        **params,
+    )
+
+
+def make_database(path=None):
+    """
+    База по настройке DB_ENGINE: SQLite в файле path (по умолчанию
+    DATABASE_PATH) или пул PostgreSQL по DATABASE_URL.
+    """
+    if config.DB_ENGINE not in ENGINES:
+        raise ValueError(f"Неизвестный DB_ENGINE: {config.DB_ENGINE}")
+    if config.DB_ENGINE == "postgres":
+        return make_postgres_database(config.DATABASE_URL)
+    return make_sqlite_database(path or config.DATABASE_PATH)
+
+
+def max_query_variables(database):
+    """
+    Сколько параметров можно передать в один запрос: SQLite до 3.32
+    принимает не больше 999, новые версии и PostgreSQL - 32766.
+    """
+    if is_sqlite(database) and sqlite3.sqlite_version_info < (3, 32, 0):
+        return 999
+    return 32766
+
+
+def is_sqlite(database):
+    """True для SQLite: PRAGMA и SQL, которых нет в PostgreSQL, только для неё."""
+    return isinstance(database, SqliteDatabase)
+
+
+def init_database(database, path):
+    """Переключает уже созданную базу SQLite (например, models.db) на другой файл."""
+    database.init(
+        path,
+        pragmas=sqlite_pragmas(),
+        timeout=config.SQLITE_BUSY_TIMEOUT_MS / 1000,
+    )
+    return database
+
+
+@contextmanager
+def thread_connection(database):
+    """
+    Подключение текущего потока на время блока. Если поток уже был
+    подключён (например, внутри транзакции), подключение не закрывается.
+    """
+    opened = database.connect(reuse_if_open=True)
+    try:
+        yield database
+    finally:
+        if opened:
+            database.close()
+
+
+def with_connection(database):
+    """Декоратор: функция выполняется в thread_connection(database)."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with thread_connection(database):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
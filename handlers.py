@@ -5,12 +5,18 @@ import logging
 from aiogram import Dispatcher, types
 from aiogram.dispatcher import FSMContext
 
-from models import Subscription
+from config import DB_BULK_TIMEOUT
 from services.basket_handlers import register_basket_handlers
 from services.history import get_price_history, plot_price_history
 from services.parser import scrape_prices
 from services.pit_handlers import register_pit_handlers
-from utils import get_latest_prices, get_previous_prices, save_prices
+from services.repository import (
+    price_snapshot,
+    run_db,
+    set_subscription,
+    toggle_notify_only_on_change,
+)
+from utils import save_prices
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,7 +33,7 @@ async def start(message: types.Message, state: FSMContext):
 async def subscribe(message: types.Message, state: FSMContext):
     await state.finish()
     user_id = message.from_user.id
-    Subscription.replace(user_id=user_id, subscribed=True).execute()
+    await run_db(set_subscription, user_id, True)
     logger.info(f"User {user_id} subscribed")
     await message.reply("You are now subscribed to hourly price reports.")
 
@@ -35,7 +41,7 @@ async def subscribe(message: types.Message, state: FSMContext):
 async def unsubscribe(message: types.Message, state: FSMContext):
     await state.finish()
     user_id = message.from_user.id
-    Subscription.replace(user_id=user_id, subscribed=False).execute()
+    await run_db(set_subscription, user_id, False)
     logger.info(f"User {user_id} unsubscribed")
     await message.reply("You have unsubscribed from price reports.")
 
@@ -88,16 +94,16 @@ async def report(message: types.Message, state: FSMContext):
 
     prices = await scrape_prices()
     if prices:
-        save_prices(prices)
-        latest = get_latest_prices()
-        previous = get_previous_prices()
+        await run_db(save_prices, prices, timeout=DB_BULK_TIMEOUT)
+        # {name: (latest, previous)} из снимка, дополненного при сохранении
+        snapshot = (await price_snapshot()).prices
 
         categories = {}
         for name, data_price in prices.items():
             category = data_price.get("category", "uncategorized")
             if category not in categories:
                 categories[category] = []
-            old_price = previous.get(name)
+            _, old_price = snapshot.get(name, (None, None))
             new_price = data_price["price"]
             if old_price is None:
                 change = "🆕"
@@ -136,9 +142,9 @@ async def report_changes_command(message: types.Message, state: FSMContext):
 
     prices = await scrape_prices()
     if prices:
-        save_prices(prices)
-        latest = get_latest_prices()
-        previous = get_previous_prices()
+        await run_db(save_prices, prices, timeout=DB_BULK_TIMEOUT)
+        # {name: (latest, previous)} из снимка, дополненного при сохранении
+        snapshot = (await price_snapshot()).prices
 
         categories = {}
         for name, data_price in prices.items():
@@ -146,7 +152,7 @@ async def report_changes_command(message: types.Message, state: FSMContext):
             if category not in categories:
                 categories[category] = []
 
-            old_price = previous.get(name)
+            _, old_price = snapshot.get(name, (None, None))
             new_price = data_price["price"]
 
             # Только изменения (включая новые)
@@ -184,7 +190,7 @@ async def report_changes_command(message: types.Message, state: FSMContext):
 
 async def history_command(message: types.Message):
     # Получаем историю за 7 дней
-    history = get_price_history(days=7)
+    history = await run_db(get_price_history, days=7)
     if not history:
         await message.reply("No price history available for the last 7 days.")
         return
@@ -200,10 +206,8 @@ async def history_command(message: types.Message):
 async def notify_change_toggle(message: types.Message):
     print(f"[DEBUG] /notifychange triggered by user {message.from_user.id}")
     user_id = message.from_user.id
-    sub, created = Subscription.get_or_create(user_id=user_id)
-    sub.notify_only_on_change = not sub.notify_only_on_change
-    sub.save()
-    status = "enabled" if sub.notify_only_on_change else "disabled"
+    notify_only_on_change = await run_db(toggle_notify_only_on_change, user_id)
+    status = "enabled" if notify_only_on_change else "disabled"
     await message.reply(
         f"Notify only on price changes is now *{status}*.", parse_mode="Markdown"
     )
@@ -22,12 +22,15 @@ import schedule
 from aiogram import Bot, Dispatcher
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 
-from config import BOT_TOKEN
+from config import BOT_TOKEN, DB_BULK_TIMEOUT
 from handlers import register_handlers
 from services.notifier import notify_subscribers
 from services.parser import scrape_prices
 from services.pit_db import save_pit_results
 from services.pit_parser import run_pit_parsing
+from services.repository import run_db
+from services.retention import run_retention
+from utils import save_prices
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -49,6 +52,11 @@ async def main():
         lambda: asyncio.create_task(pit_parse_and_save())
     )
 
+    # Сворачиваем устаревшие наблюдения цен ежедневно в 03:00
+    schedule.every().day.at("03:00").do(
+        lambda: asyncio.create_task(run_retention_job())
+    )
+
     # Run scheduler in background
     async def run_scheduler():
         while True:
@@ -62,6 +70,8 @@ async def main():
 async def scrape_and_notify(bot):
     try:
         prices = await scrape_prices()
+        if prices:
+            await run_db(save_prices, prices, timeout=DB_BULK_TIMEOUT)
         await notify_subscribers(bot, prices)
     except Exception as e:
         logger.error(f"Error in scrape_and_notify: {str(e)}")
@@ -75,7 +85,7 @@ async def pit_parse_and_save():
         logger.info("Starting PIT parsing...")
         results = await run_pit_parsing()
         if results:
-            stats = save_pit_results(results)
+            stats = await run_db(save_pit_results, results, timeout=DB_BULK_TIMEOUT)
             logger.info(f"PIT parsing completed: {stats}")
         else:
             logger.warning("PIT parsing returned no results")
@@ -83,5 +93,15 @@ async def pit_parse_and_save():
         logger.error(f"Error in PIT parsing: {str(e)}")
 
 
+async def run_retention_job():
+    """Свёртка и удаление старых наблюдений в отдельном потоке."""
+    try:
+        loop = asyncio.get_event_loop()
+        stats = await loop.run_in_executor(None, run_retention)
+        logger.info(f"Retention completed: {stats}")
+    except Exception as e:
+        logger.error(f"Error in retention job: {str(e)}")
+
+
 if __name__ == "__main__":
     asyncio.run(main())
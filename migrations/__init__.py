@@ -0,0 +1,95 @@
+"""
+Версионные миграции схемы базы PriceParser.
+
+Каждая миграция - модуль mNNNN_<имя>.py с функцией upgrade(database, migrator).
+Применённые версии записываются в таблицу schema_version, повторный запуск
+пропускает их. Операции внутри миграций идемпотентны: колонка или индекс
+добавляются, только если их ещё нет, поэтому миграции безопасно применять
+к базам, созданным разными версиями init_db.
+
+Таблицы, которых в базе ещё нет, миграции не трогают - их целиком создаёт
+init_db через create_tables уже со всеми колонками и индексами.
+
+    python -m migrations           # применить к config.DATABASE_PATH
+    python -m migrations --status
+"""
+
+import importlib
+import logging
+from datetime import datetime
+
+from peewee import CharField, DateTimeField, IntegerField, Model
+from playhouse.migrate import SchemaMigrator, make_index_name, migrate
+
+logger = logging.getLogger(__name__)
+
+# Миграции по порядку версий
+MIGRATIONS = [
+    (1, "m0001_product_columns"),
+    (2, "m0002_currency_columns"),
+    (3, "m0003_indexes"),
+    (4, "m0004_fold_products"),
+    (5, "m0005_history_timestamp_index"),
+    (6, "m0006_history_last_seen"),
+    (7, "m0007_scrape_runs"),
+]
+
+
+class SchemaVersion(Model):
+    """Применённая миграция. Модель привязывается к базе при запуске."""
+
+    version = IntegerField(primary_key=True)
+    name = CharField()
+    applied_at = DateTimeField(default=datetime.now)
+
+    class Meta:
+        table_name = "schema_version"
+
+
+def add_column(database, migrator, table, column, field):
+    """Добавляет колонку, если таблица есть, а колонки нет. Возвращает True при добавлении."""
+    if not database.table_exists(table):
+        return False
+    if column in {c.name for c in database.get_columns(table)}:
+        return False
+    migrate(migrator.add_column(table, column, field))
+    logger.info(f"Добавлена колонка {table}.{column}")
+    return True
+
+
+def add_index(database, migrator, table, columns, unique=False):
+    """Создаёт индекс с именем в стиле peewee (product_name_timestamp), если его нет."""
+    if not database.table_exists(table):
+        return False
+    name = make_index_name(table, columns)
+    if name in {index.name for index in database.get_indexes(table)}:
+        return False
+    migrate(migrator.add_index(table, columns, unique))
+    logger.info(f"Создан индекс {name}")
+    return True
+
+
+def applied_versions(database):
+    with database.bind_ctx([SchemaVersion]):
+        if not SchemaVersion.table_exists():
+            return set()
+        return {row.version for row in SchemaVersion.select(SchemaVersion.version)}
+
+
+def run_migrations(database):
+    """Применяет к базе недостающие миграции. Возвращает список применённых версий."""
+    migrator = SchemaMigrator.from_database(database)
+    applied = []
+    with database.bind_ctx([SchemaVersion]):
+        SchemaVersion.create_table(safe=True)
+        done = applied_versions(database)
+        for version, name in MIGRATIONS:
+            if version in done:
+                continue
+            module = importlib.import_module(f"{__name__}.{name}")
+            logger.info(f"Применяется миграция {version}: {name}")
+            with database.atomic():
+                module.upgrade(database, migrator)
+                SchemaVersion.create(version=version, name=name)
+            applied.append(version)
+    return applied
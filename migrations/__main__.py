@@ -0,0 +1,22 @@
+import argparse
+import logging
+
+from migrations import MIGRATIONS, applied_versions, run_migrations
+from models import db
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Миграции схемы базы PriceParser")
+    parser.add_argument("--status", action="store_true", help="только показать версии")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    db.connect()
+    try:
+        if not args.status:
+            applied = run_migrations(db)
+            print(f"Применено миграций: {len(applied)}")
+        done = applied_versions(db)
+        for version, name in MIGRATIONS:
+            print(f"{version:04d} {name}: {'применена' if version in done else 'нет'}")
+    finally:
+        db.close()
@@ -0,0 +1,35 @@
+"""Поля интеграции с PIT в Product и настройка уведомлений в Subscription."""
+
+from peewee import SQL, BooleanField, CharField, FloatField
+
+from migrations import add_column
+
+
+def upgrade(database, migrator):
+    # Значение по умолчанию задаётся в самой колонке: ADD COLUMN с DEFAULT
+    # не переписывает таблицу, в отличие от добавления NOT NULL после UPDATE
+    add_column(
+        database,
+        migrator,
+        "product",
+        "category",
+        CharField(null=True, constraints=[SQL("DEFAULT 'uncategorized'")]),
+    )
+    add_column(
+        database,
+        migrator,
+        "product",
+        "store",
+        CharField(null=True, constraints=[SQL("DEFAULT 'unknown'")]),
+    )
+    add_column(database, migrator, "product", "unit_size", FloatField(null=True))
+    add_column(database, migrator, "product", "unit_type", CharField(null=True))
+    add_column(database, migrator, "product", "price_per_unit", FloatField(null=True))
+    add_column(database, migrator, "product", "external_id", CharField(null=True))
+    add_column(
+        database,
+        migrator,
+        "subscription",
+        "notify_only_on_change",
+        BooleanField(null=True, constraints=[SQL("DEFAULT FALSE")]),
+    )
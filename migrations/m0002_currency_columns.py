@@ -0,0 +1,13 @@
+"""Валюта и цена за единицу в базовой валюте в Product и PriceHistory."""
+
+from peewee import CharField, FloatField
+
+from migrations import add_column
+
+
+def upgrade(database, migrator):
+    for table in ("product", "pricehistory"):
+        add_column(database, migrator, table, "currency", CharField(null=True))
+        add_column(
+            database, migrator, table, "base_price_per_unit", FloatField(null=True)
+        )
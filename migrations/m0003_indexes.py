@@ -0,0 +1,44 @@
+"""
+Индексы горячих запросов: последние цены по названию, история по времени,
+фильтр по категории, поиск товара PIT и корзины пользователя.
+"""
+
+import logging
+
+from migrations import add_index
+
+logger = logging.getLogger(__name__)
+
+INDEXES = [
+    ("product", ("name", "timestamp"), False),
+    ("product", ("category", "name"), False),
+    ("product", ("timestamp",), False),
+    ("product", ("store", "name", "unit_size", "unit_type"), False),
+    ("product", ("external_id",), True),
+    ("pricehistory", ("product_id", "timestamp"), False),
+    ("basket", ("user_id", "created_at"), False),
+    ("basketitem", ("basket_id", "product_id"), False),
+]
+
+
+def clear_duplicate_external_ids(database):
+    """
+    Уникальный индекс не создать, пока external_id повторяется. Значение
+    остаётся у самой ранней строки, у остальных сбрасывается в NULL:
+    товары PIT всё равно находятся по store + name + unit_size + unit_type.
+    """
+    cursor = database.execute_sql(
+        "UPDATE product SET external_id = NULL "
+        "WHERE external_id IS NOT NULL AND id NOT IN ("
+        "SELECT MIN(id) FROM product WHERE external_id IS NOT NULL "
+        "GROUP BY external_id)"
+    )
+    if cursor.rowcount:
+        logger.warning(f"Сброшено повторяющихся external_id: {cursor.rowcount}")
+
+
+def upgrade(database, migrator):
+    if database.table_exists("product"):
+        clear_duplicate_external_ids(database)
+    for table, columns, unique in INDEXES:
+        add_index(database, migrator, table, columns, unique)
@@ -0,0 +1,126 @@
+"""
+Product становится каталогом: раньше save_prices добавлял строку Product на
+каждый товар при каждом парсинге. Строки с одинаковым ключом
+store + name + unit_size + unit_type сворачиваются в одну - самую свежую,
+а их цены переносятся наблюдениями в PriceHistory. Ссылки из PriceHistory,
+BasketItem и LatestPrice переводятся на оставшуюся строку, LatestPrice
+заполняется последним наблюдением каждого товара.
+"""
+
+import logging
+from datetime import datetime
+
+from peewee import CharField, DateTimeField, FloatField, ForeignKeyField, Model
+
+logger = logging.getLogger(__name__)
+
+
+# Таблицы в том виде, в каком они были на этой версии схемы: колонки,
+# добавленные следующими миграциями (last_seen, run_id), здесь не создаются
+class Product(Model):
+    class Meta:
+        table_name = "product"
+
+
+class PriceHistory(Model):
+    product = ForeignKeyField(Product, backref="price_history")
+    price = FloatField()
+    unit_size = FloatField(null=True)
+    unit_type = CharField(null=True)
+    price_per_unit = FloatField(null=True)
+    currency = CharField(null=True)
+    base_price_per_unit = FloatField(null=True)
+    timestamp = DateTimeField(default=datetime.now)
+
+    class Meta:
+        table_name = "pricehistory"
+        indexes = ((("product", "timestamp"), False),)
+
+
+class LatestPrice(Model):
+    product = ForeignKeyField(
+        Product, primary_key=True, backref="latest_price", on_delete="CASCADE"
+    )
+    price = FloatField()
+    price_per_unit = FloatField(null=True)
+    observed_at = DateTimeField(default=datetime.now)
+
+    class Meta:
+        table_name = "latestprice"
+
+
+# Соответствие старых id товаров строке каталога (самой свежей в группе)
+FOLD_TABLE = """
+    CREATE TEMPORARY TABLE product_fold AS
+    SELECT id AS old_id,
+           FIRST_VALUE(id) OVER (
+               PARTITION BY store, name, unit_size, unit_type
+               ORDER BY "timestamp" DESC, id DESC
+           ) AS new_id
+    FROM product
+"""
+
+# Строка Product без истории была наблюдением цены scrapeme
+OBSERVATIONS = """
+    INSERT INTO pricehistory (product_id, price, "timestamp")
+    SELECT f.new_id, p.price, p."timestamp"
+    FROM product p
+    JOIN product_fold f ON f.old_id = p.id
+    WHERE NOT EXISTS (SELECT 1 FROM pricehistory h WHERE h.product_id = p.id)
+"""
+
+REMAP = """
+    UPDATE {table} SET product_id = (
+        SELECT new_id FROM product_fold WHERE old_id = {table}.product_id
+    )
+    WHERE product_id IN (SELECT old_id FROM product_fold WHERE old_id <> new_id)
+"""
+
+FOLDED = "SELECT old_id FROM product_fold WHERE old_id <> new_id"
+
+# Последнее наблюдение товаров, у которых ещё нет строки LatestPrice
+LATEST = """
+    INSERT INTO latestprice (product_id, price, price_per_unit, observed_at)
+    SELECT product_id, price, price_per_unit, "timestamp"
+    FROM (
+        SELECT product_id, price, {price_per_unit} AS price_per_unit, "timestamp",
+               ROW_NUMBER() OVER (
+                   PARTITION BY product_id ORDER BY "timestamp" DESC, id DESC
+               ) AS position
+        FROM pricehistory
+    ) ranked
+    WHERE position = 1 AND NOT EXISTS (
+        SELECT 1 FROM latestprice l WHERE l.product_id = ranked.product_id
+    )
+"""
+
+
+def upgrade(database, migrator):
+    if not database.table_exists("product"):
+        return
+    # Старые базы (prices.db) создавались без истории и последних цен
+    with database.bind_ctx([Product, PriceHistory, LatestPrice]):
+        PriceHistory.create_table(safe=True)
+        LatestPrice.create_table(safe=True)
+
+    database.execute_sql(FOLD_TABLE)
+    try:
+        database.execute_sql(OBSERVATIONS)
+        for table in ("pricehistory", "basketitem"):
+            if database.table_exists(table):
+                database.execute_sql(REMAP.format(table=table))
+        # Последняя цена товара каталога берётся из его истории
+        database.execute_sql(f"DELETE FROM latestprice WHERE product_id IN ({FOLDED})")
+        cursor = database.execute_sql(f"DELETE FROM product WHERE id IN ({FOLDED})")
+        if cursor.rowcount:
+            logger.info(f"Свёрнуто строк Product в каталог: {cursor.rowcount}")
+        # В ранних таблицах истории (без PIT) цены за единицу не было
+        history_columns = {c.name for c in database.get_columns("pricehistory")}
+        price_per_unit = (
+            "price_per_unit" if "price_per_unit" in history_columns else "NULL"
+        )
+        cursor = database.execute_sql(LATEST.format(price_per_unit=price_per_unit))
+        if cursor.rowcount:
+            logger.info(f"Заполнено строк LatestPrice: {cursor.rowcount}")
+    finally:
+        database.execute_sql("DROP TABLE product_fold")
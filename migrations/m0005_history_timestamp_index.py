@@ -0,0 +1,7 @@
+"""Индекс по времени наблюдения: выборка истории за период и свёртка по часам."""
+
+from migrations import add_index
+
+
+def upgrade(database, migrator):
+    add_index(database, migrator, "pricehistory", ("timestamp",))
@@ -0,0 +1,11 @@
+"""Время последнего подтверждения цены для хранения только изменений."""
+
+from peewee import DateTimeField
+
+from migrations import add_column
+
+
+def upgrade(database, migrator):
+    add_column(
+        database, migrator, "pricehistory", "last_seen", DateTimeField(null=True)
+    )
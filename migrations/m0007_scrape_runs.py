@@ -0,0 +1,41 @@
+"""Ссылка наблюдения цены на запуск парсинга (ScrapeRun), который его записал."""
+
+from datetime import datetime
+
+from peewee import CharField, DateTimeField, ForeignKeyField, IntegerField, Model
+
+from migrations import add_column, add_index
+
+
+# Таблица scraperun в том виде, в каком она была на этой версии схемы
+class ScrapeRun(Model):
+    source = CharField(default="scrapeme")
+    started_at = DateTimeField(default=datetime.now, index=True)
+    products = IntegerField(default=0)
+    observations = IntegerField(default=0)
+
+    class Meta:
+        table_name = "scraperun"
+
+
+def upgrade(database, migrator):
+    if not database.table_exists("pricehistory"):
+        return
+    # init_db создаёт таблицы уже после миграций, а REFERENCES scraperun
+    # требует существующей таблицы (PostgreSQL)
+    with database.bind_ctx([ScrapeRun]):
+        ScrapeRun.create_table(safe=True)
+    add_column(
+        database,
+        migrator,
+        "pricehistory",
+        "run_id",
+        ForeignKeyField(
+            ScrapeRun,
+            null=True,
+            index=False,
+            field=ScrapeRun.id,
+            on_delete="SET NULL",
+        ),
+    )
+    add_index(database, migrator, "pricehistory", ("run_id",))
@@ -3,18 +3,19 @@ from datetime import datetime
 from peewee import (
     BooleanField,
     CharField,
+    DateField,
     DateTimeField,
     FloatField,
     ForeignKeyField,
     IntegerField,
     Model,
-    SqliteDatabase,
     TextField,
 )
 
-from config import DATABASE_PATH
+from database import make_database
 
-db = SqliteDatabase(DATABASE_PATH)
+# SQLite или пул PostgreSQL - по настройке DB_ENGINE
+db = make_database()
 
 
 class BaseModel(Model):
@@ -26,13 +27,27 @@ class Product(BaseModel):
     name = CharField()
     price = FloatField()
     category = CharField(default="uncategorized")
-    timestamp = DateTimeField(default=datetime.now)
+    timestamp = DateTimeField(default=datetime.now, index=True)
     # Новые поля для интеграции с PIT
     store = CharField(default="unknown")  # магазин (например, "Auchan")
     unit_size = FloatField(null=True)  # размер упаковки (например, 1.0)
     unit_type = CharField(null=True)  # единица измерения ("л", "кг", "шт")
     price_per_unit = FloatField(null=True)  # цена за единицу измерения
-    external_id = CharField(null=True)  # внешний идентификатор из PIT
+    # внешний идентификатор из PIT, ключ upsert (NULL у товаров scrapeme)
+    external_id = CharField(null=True, unique=True)
+    currency = CharField(null=True)  # код валюты цены ("USD", "RUB")
+    # цена за единицу в базовой валюте (config.BASE_CURRENCY) на момент записи
+    base_price_per_unit = FloatField(null=True)
+
+    class Meta:
+        indexes = (
+            # последняя цена по названию и история товара
+            (("name", "timestamp"), False),
+            # фильтр по категории с сортировкой по названию
+            (("category", "name"), False),
+            # поиск товара PIT по естественному ключу
+            (("store", "name", "unit_size", "unit_type"), False),
+        )
 
 
 class Subscription(BaseModel):
@@ -41,6 +56,15 @@ class Subscription(BaseModel):
     notify_only_on_change = BooleanField(default=False)  # новая опция
 
 
+class ScrapeRun(BaseModel):
+    """Запуск парсинга: все его наблюдения записаны с одним временем."""
+
+    source = CharField(default="scrapeme")
+    started_at = DateTimeField(default=datetime.now, index=True)
+    products = IntegerField(default=0)  # товаров в результате парсинга
+    observations = IntegerField(default=0)  # новых наблюдений цены
+
+
 class PriceHistory(BaseModel):
     """История изменения цен для товаров."""
 
@@ -49,7 +73,105 @@ class PriceHistory(BaseModel):
     unit_size = FloatField(null=True)
     unit_type = CharField(null=True)
     price_per_unit = FloatField(null=True)
-    timestamp = DateTimeField(default=datetime.now)
+    currency = CharField(null=True)
+    base_price_per_unit = FloatField(null=True)
+    timestamp = DateTimeField(default=datetime.now, index=True)
+    # последний парсинг, на котором цена была той же (наблюдение длится до него)
+    last_seen = DateTimeField(null=True)
+    # запуск парсинга, записавший наблюдение (NULL у записей до ScrapeRun и PIT)
+    run = ForeignKeyField(
+        ScrapeRun, null=True, backref="price_history", on_delete="SET NULL"
+    )
+
+    class Meta:
+        indexes = ((("product", "timestamp"), False),)
+
+
+class LatestPrice(BaseModel):
+    """Последняя известная цена товара: одна строка на товар, ключ - product_id."""
+
+    product = ForeignKeyField(
+        Product, primary_key=True, backref="latest_price", on_delete="CASCADE"
+    )
+    price = FloatField()
+    price_per_unit = FloatField(null=True)
+    observed_at = DateTimeField(default=datetime.now)  # когда цена записана в историю
+
+
+class PriceRollup(BaseModel):
+    """
+    Агрегат наблюдений цены товара за интервал (см. services/retention.py).
+    Сама таблица не создаётся, используются наследники по уровням хранения.
+    """
+
+    product = ForeignKeyField(Product, on_delete="CASCADE")
+    bucket = DateTimeField()  # начало интервала
+    open = FloatField()  # первая цена интервала
+    close = FloatField()  # последняя цена интервала
+    min_price = FloatField()
+    max_price = FloatField()
+    samples = IntegerField()  # число свёрнутых наблюдений
+    last_at = DateTimeField()  # время последнего наблюдения
+
+    class Meta:
+        indexes = ((("product", "bucket"), True),)
+
+
+class HourlyPriceRollup(PriceRollup):
+    """Почасовые агрегаты наблюдений старше RAW_RETENTION_DAYS."""
+
+
+class DailyPriceRollup(PriceRollup):
+    """Суточные агрегаты, хранятся бессрочно."""
+
+
+class CurrencyRate(BaseModel):
+    """Курс валюты к базовой валюте на дату."""
+
+    currency = CharField()
+    date = DateField()
+    rate = FloatField()  # сколько единиц базовой валюты стоит 1 единица currency
+
+    class Meta:
+        indexes = ((("currency", "date"), True),)
+
+
+class StoreConfig(BaseModel):
+    """Конфигурация парсинга PIT для пары магазин + продукт (бывший store_config.txt)."""
+
+    store = CharField()
+    country = CharField(null=True)
+    product = CharField(index=True)
+    currency_map = TextField(default="{}")  # JSON: {"$": "USD"}
+    active = BooleanField(default=True)
+    updated_at = DateTimeField(default=datetime.now)
+
+    class Meta:
+        # Уникальный индекс также обслуживает поиск по магазину
+        indexes = ((("store", "product"), True),)
+
+
+class StoreTemplate(BaseModel):
+    """Строка шаблона TITLE или PRICE конфигурации магазина."""
+
+    config = ForeignKeyField(StoreConfig, backref="templates", on_delete="CASCADE")
+    kind = CharField()  # "TITLE" или "PRICE"
+    position = IntegerField(default=0)  # порядок строк в шаблоне
+    line = TextField()
+
+    class Meta:
+        indexes = ((("config", "kind", "position"), True),)
+
+
+class StoreUrl(BaseModel):
+    """URL страницы листинга для варианта (cheapest, most_expensive)."""
+
+    config = ForeignKeyField(StoreConfig, backref="urls", on_delete="CASCADE")
+    variant = CharField()
+    url = TextField()
+
+    class Meta:
+        indexes = ((("config", "variant"), True),)
 
 
 class Basket(BaseModel):
@@ -59,6 +181,9 @@ class Basket(BaseModel):
     name = CharField(default="Моя корзина")
     created_at = DateTimeField(default=datetime.now)
 
+    class Meta:
+        indexes = ((("user_id", "created_at"), False),)
+
 
 class BasketItem(BaseModel):
     """Элемент корзины."""
@@ -67,10 +192,35 @@ class BasketItem(BaseModel):
     product = ForeignKeyField(Product, backref="basket_items")
     quantity = FloatField(default=1.0)  # количество упаковок
 
+    class Meta:
+        indexes = ((("basket", "product"), False),)
+
 
 def init_db():
+    """
+    Приводит схему базы к актуальной: миграции дополняют существующие
+    таблицы, create_tables создаёт недостающие.
+    """
+    from migrations import run_migrations
+
     db.connect()
+    run_migrations(db)
     db.create_tables(
-        [Product, Subscription, PriceHistory, Basket, BasketItem], safe=True
+        [
+            Product,
+            Subscription,
+            ScrapeRun,
+            PriceHistory,
+            LatestPrice,
+            HourlyPriceRollup,
+            DailyPriceRollup,
+            CurrencyRate,
+            StoreConfig,
+            StoreTemplate,
+            StoreUrl,
+            Basket,
+            BasketItem,
+        ],
+        safe=True,
     )
     db.close()
@@ -0,0 +1,364 @@
+"""
+Колоночная выгрузка истории цен для офлайн-аналитики.
+
+Пишет набор файлов, разбитый по месяцу и магазину в стиле Hive
+(month=2025-01/store=Walmart/part-00000.parquet), который pandas, pyarrow,
+DuckDB и Spark читают как одну таблицу с фильтрацией по партициям.
+
+Формат - Parquet со словарным кодированием строковых колонок и типизированными
+float/date колонками. pyarrow - необязательная зависимость: без него
+выгружаются csv.gz файлы той же структуры, а типы колонок записываются
+в _schema.json в корне набора.
+
+Сырая история PriceHistory хранится только RAW_RETENTION_DAYS (см.
+services/retention.py), более старые цены есть в почасовых и суточных
+агрегатах - они выгружаются отдельными наборами hourly и daily.
+
+    python -m services.analytics_export history analytics/history
+    python -m services.analytics_export daily analytics/daily
+    python -m services.analytics_export pit analytics/pit --since 2025-01
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import sqlite3
+from datetime import date, datetime
+from urllib.parse import quote
+
+from config import ANALYTICS_EXPORT_DIR, PIT_DATABASE_PATH
+from models import DailyPriceRollup, HourlyPriceRollup, PriceHistory, Product
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("parquet", "csv")
+
+# Сколько строк одной партиции держать в памяти перед записью part-файла
+PART_ROWS = 100_000
+
+# Типы колонок: category - строка со словарным кодированием
+HISTORY_COLUMNS = [
+    ("product_id", "int"),
+    ("name", "category"),
+    ("store", "category"),
+    ("category", "category"),
+    ("price", "float"),
+    ("unit_size", "float"),
+    ("unit_type", "category"),
+    ("price_per_unit", "float"),
+    ("currency", "category"),
+    ("base_price_per_unit", "float"),
+    ("date", "date"),
+    ("timestamp", "timestamp"),
+]
+
+# Агрегаты уровней хранения: одна строка на товар и начало интервала (bucket)
+ROLLUP_COLUMNS = [
+    ("product_id", "int"),
+    ("name", "category"),
+    ("store", "category"),
+    ("category", "category"),
+    ("currency", "category"),
+    ("open", "float"),
+    ("close", "float"),
+    ("min_price", "float"),
+    ("max_price", "float"),
+    ("samples", "int"),
+    ("date", "date"),
+    ("bucket", "timestamp"),
+    ("last_at", "timestamp"),
+]
+
+ROLLUP_MODELS = {"hourly": HourlyPriceRollup, "daily": DailyPriceRollup}
+
+PIT_COLUMNS = [
+    ("store", "category"),
+    ("country", "category"),
+    ("product_type", "category"),
+    ("variant", "category"),
+    ("full_name", "string"),
+    ("price", "float"),
+    ("currency", "category"),
+    ("package_size", "float"),
+    ("package_unit", "category"),
+    ("price_per_unit", "float"),
+    ("inflation_rate", "float"),
+    ("date", "date"),
+]
+
+PIT_QUERY = """
+    SELECT s.name, s.country, pt.name, ps.variant, ps.full_name,
+           ps.price_number, ps.price_currency, ps.package_size_number,
+           ps.package_unit, ps.price_per_unit_number, ps.inflation_rate, ps.date
+    FROM PriceSample ps
+    JOIN Store s ON ps.store_id = s.store_id
+    JOIN ProductType pt ON ps.product_type_id = pt.product_type_id
+    WHERE ps.date >= ?
+    ORDER BY s.name, ps.date
+"""
+
+
+def load_pyarrow():
+    """Возвращает (pyarrow, pyarrow.parquet) или None, если pyarrow не установлен."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow, pyarrow.parquet
+
+
+def month_start(since):
+    """Начало месяца для since ("2025-01", "2025-01-15", date) или None."""
+    if not since:
+        return None
+    if isinstance(since, str):
+        since = datetime.strptime(since[:7], "%Y-%m")
+    return date(since.year, since.month, 1)
+
+
+def iter_history_rows(since=None):
+    """
+    Строки PriceHistory с данными товара, по магазину и времени,
+    чтобы каждая партиция (месяц, магазин) шла одним куском.
+    """
+    query = (
+        PriceHistory.select(
+            Product.id,
+            Product.name,
+            Product.store,
+            Product.category,
+            PriceHistory.price,
+            PriceHistory.unit_size,
+            PriceHistory.unit_type,
+            PriceHistory.price_per_unit,
+            PriceHistory.currency,
+            PriceHistory.base_price_per_unit,
+            PriceHistory.timestamp,
+        )
+        .join(Product)
+        .order_by(Product.store, PriceHistory.timestamp)
+    )
+    since = month_start(since)
+    if since:
+        query = query.where(PriceHistory.timestamp >= since)
+    for row in query.tuples().iterator():
+        timestamp = row[-1]
+        yield row[:-1] + (timestamp.date(), timestamp)
+
+
+def iter_rollup_rows(model, since=None):
+    """Строки агрегатов model с данными товара, по магазину и началу интервала."""
+    query = (
+        model.select(
+            Product.id,
+            Product.name,
+            Product.store,
+            Product.category,
+            Product.currency,
+            model.open,
+            model.close,
+            model.min_price,
+            model.max_price,
+            model.samples,
+            model.bucket,
+            model.last_at,
+        )
+        .join(Product)
+        .order_by(Product.store, model.bucket)
+    )
+    since = month_start(since)
+    if since:
+        query = query.where(model.bucket >= since)
+    for row in query.tuples().iterator():
+        bucket = row[-2]
+        yield row[:-2] + (bucket.date(), bucket, row[-1])
+
+
+def iter_pit_rows(database_file=PIT_DATABASE_PATH, since=None):
+    """Строки PriceSample базы PIT с названиями магазина и типа товара."""
+    since = month_start(since)
+    conn = sqlite3.connect(database_file)
+    try:
+        cursor = conn.execute(PIT_QUERY, (since.isoformat() if since else "",))
+        for row in cursor:
+            yield row[:-1] + (datetime.strptime(row[-1], "%Y-%m-%d").date(),)
+    finally:
+        conn.close()
+
+
+def partition_path(output_dir, month, store):
+    """Каталог партиции; имя магазина экранируется как в Hive."""
+    return os.path.join(
+        output_dir, f"month={month}", f"store={quote(store or 'unknown', safe='')}"
+    )
+
+
+def write_parquet_part(path, columns, rows, arrow):
+    pyarrow, parquet = arrow
+    types = {
+        "int": pyarrow.int64(),
+        "float": pyarrow.float64(),
+        "string": pyarrow.string(),
+        "category": pyarrow.string(),
+        "date": pyarrow.date32(),
+        "timestamp": pyarrow.timestamp("s"),
+    }
+    arrays = []
+    for index, (name, kind) in enumerate(columns):
+        array = pyarrow.array([row[index] for row in rows], type=types[kind])
+        if kind == "category":
+            array = array.dictionary_encode()
+        arrays.append(array)
+    table = pyarrow.Table.from_arrays(arrays, names=[name for name, _ in columns])
+    parquet.write_table(table, path, compression="zstd")
+
+
+def write_csv_part(path, columns, rows):
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, _ in columns])
+        writer.writerows(rows)
+
+
+def export_dataset(rows, columns, output_dir, fmt=None):
+    """
+    Пишет строки (упорядоченные по магазину и времени) в партиции
+    month=YYYY-MM/store=NAME. Партиция перезаписывается целиком.
+    Возвращает статистику: files, rows, partitions.
+    """
+    arrow = load_pyarrow()
+    fmt = fmt or ("parquet" if arrow else "csv")
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    if fmt == "parquet" and arrow is None:
+        raise RuntimeError("Для выгрузки в Parquet установите pyarrow")
+
+    extension = "parquet" if fmt == "parquet" else "csv.gz"
+    names = [name for name, _ in columns]
+    store_index = names.index("store")
+    date_index = names.index("date")
+    # Магазин - колонка партиции, в самих файлах его нет (как принято в Hive)
+    file_columns = [column for column in columns if column[0] != "store"]
+
+    stats = {"files": 0, "rows": 0, "partitions": 0}
+    current_key = None
+    buffer = []
+    part = 0
+
+    def flush():
+        nonlocal buffer, part
+        if not buffer:
+            return
+        path = partition_path(output_dir, *current_key)
+        file_path = os.path.join(path, f"part-{part:05d}.{extension}")
+        if fmt == "parquet":
+            write_parquet_part(file_path, file_columns, buffer, arrow)
+        else:
+            write_csv_part(file_path, file_columns, buffer)
+        stats["files"] += 1
+        stats["rows"] += len(buffer)
+        buffer = []
+        part += 1
+
+    for row in rows:
+        key = (row[date_index].strftime("%Y-%m"), row[store_index])
+        if key != current_key:
+            flush()
+            current_key = key
+            part = 0
+            stats["partitions"] += 1
+            # Старые part-файлы партиции заменяются новой выгрузкой
+            path = partition_path(output_dir, *key)
+            os.makedirs(path, exist_ok=True)
+            for name in os.listdir(path):
+                if name.startswith("part-"):
+                    os.remove(os.path.join(path, name))
+        buffer.append(row[:store_index] + row[store_index + 1 :])
+        if len(buffer) >= PART_ROWS:
+            flush()
+    flush()
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "_schema.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "format": fmt,
+                "partitioning": ["month", "store"],
+                "columns": dict(file_columns),
+            },
+            f,
+            indent=2,
+        )
+
+    logger.info(
+        f"Выгружено {stats['rows']} строк в {stats['files']} файлов "
+        f"({stats['partitions']} партиций) в {output_dir}"
+    )
+    return stats
+
+
+def export_price_history(output_dir=None, fmt=None, since=None):
+    """Выгружает PriceHistory PriceParser в колоночный набор."""
+    output_dir = output_dir or os.path.join(ANALYTICS_EXPORT_DIR, "history")
+    return export_dataset(iter_history_rows(since), HISTORY_COLUMNS, output_dir, fmt)
+
+
+def export_price_rollups(granularity, output_dir=None, fmt=None, since=None):
+    """Выгружает агрегаты уровня granularity (hourly, daily) в колоночный набор."""
+    model = ROLLUP_MODELS[granularity]
+    output_dir = output_dir or os.path.join(ANALYTICS_EXPORT_DIR, granularity)
+    return export_dataset(
+        iter_rollup_rows(model, since), ROLLUP_COLUMNS, output_dir, fmt
+    )
+
+
+def export_pit_samples(
+    output_dir=None, database_file=PIT_DATABASE_PATH, fmt=None, since=None
+):
+    """Выгружает PriceSample базы PIT в колоночный набор."""
+    output_dir = output_dir or os.path.join(ANALYTICS_EXPORT_DIR, "pit")
+    return export_dataset(
+        iter_pit_rows(database_file, since), PIT_COLUMNS, output_dir, fmt
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Колоночная выгрузка истории цен")
+    parser.add_argument(
+        "source",
+        choices=("history", *ROLLUP_MODELS, "pit"),
+        help="history - сырые наблюдения (только за RAW_RETENTION_DAYS), "
+        "hourly/daily - агрегаты более старых цен, pit - PriceSample базы PIT",
+    )
+    parser.add_argument("output_dir", nargs="?")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument(
+        "--since", help="перевыгрузить месяцы начиная с YYYY-MM (по умолчанию все)"
+    )
+    parser.add_argument("--pit-db", default=PIT_DATABASE_PATH)
+    args = parser.parse_args(argv)
+
+    if args.source == "history":
+        stats = export_price_history(args.output_dir, args.format, args.since)
+    elif args.source in ROLLUP_MODELS:
+        stats = export_price_rollups(
+            args.source, args.output_dir, args.format, args.since
+        )
+    else:
+        stats = export_pit_samples(
+            args.output_dir, args.pit_db, args.format, args.since
+        )
+    print(
+        f"Выгружено строк: {stats['rows']}, файлов: {stats['files']}, "
+        f"партиций: {stats['partitions']}"
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
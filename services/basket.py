@@ -2,7 +2,7 @@
 Модуль для работы с корзиной покупок.
 """
 
-from peewee import DoesNotExist
+from peewee import JOIN, DoesNotExist, fn
 
 from models import Basket, BasketItem, Product
 
@@ -22,6 +22,28 @@ def get_user_baskets(user_id):
     )
 
 
+def get_user_basket_summaries(user_id):
+    """
+    Корзины пользователя с числом позиций (item_count) и общей стоимостью
+    (total) по текущим ценам - одним запросом.
+    """
+    baskets = list(
+        Basket.select(
+            Basket,
+            fn.COUNT(BasketItem.id).alias("item_count"),
+            fn.SUM(Product.price * BasketItem.quantity).alias("total"),
+        )
+        .join(BasketItem, JOIN.LEFT_OUTER)
+        .join(Product, JOIN.LEFT_OUTER)
+        .where(Basket.user_id == user_id)
+        .group_by(Basket.id)
+        .order_by(Basket.created_at.desc())
+    )
+    for basket in baskets:
+        basket.total = float(basket.total or 0.0)
+    return baskets
+
+
 def get_basket(basket_id):
     """Получить корзину по ID."""
     try:
@@ -57,6 +79,16 @@ def add_to_basket(basket_id, product_id, quantity=1.0):
         return item
 
 
+def get_basket_item(item_id):
+    """Позиция корзины вместе с корзиной или None."""
+    return (
+        BasketItem.select(BasketItem, Basket)
+        .join(Basket)
+        .where(BasketItem.id == item_id)
+        .get_or_none()
+    )
+
+
 def remove_from_basket(item_id):
     """Удалить позицию из корзины по ID элемента."""
     try:
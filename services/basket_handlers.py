@@ -8,17 +8,19 @@ from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.utils.exceptions import MessageTextIsEmpty
 
-from models import Basket, BasketItem, Product
+from models import Product
 from services.basket import (
     add_to_basket,
     calculate_basket_total,
     create_basket,
     delete_basket,
     get_basket,
+    get_basket_item,
     get_basket_items,
-    get_user_baskets,
+    get_user_basket_summaries,
     remove_from_basket,
 )
+from services.repository import run_db
 
 logger = logging.getLogger(__name__)
 
@@ -30,7 +32,8 @@ async def mybaskets_command(message: types.Message, state: FSMContext):
     await state.finish()
     user_id = message.from_user.id
     try:
-        baskets = get_user_baskets(user_id)
+        # Количество товаров и общая стоимость считаются тем же запросом
+        baskets = await run_db(get_user_basket_summaries, user_id)
         if not baskets:
             await message.reply(
                 "У вас пока нет корзин. Создайте новую командой /create_basket."
@@ -39,12 +42,9 @@ async def mybaskets_command(message: types.Message, state: FSMContext):
 
         lines = ["*Ваши корзины:*"]
         for basket in baskets:
-            # Подсчитаем количество товаров и общую стоимость
-            item_count = BasketItem.select().where(BasketItem.basket == basket).count()
-            total = calculate_basket_total(basket.id)
             lines.append(
                 f"• #{basket.id} **{basket.name}** "
-                f"(товаров: {item_count}, сумма: {total:.2f} ₽)\n"
+                f"(товаров: {basket.item_count}, сумма: {basket.total:.2f} ₽)\n"
                 f"  Создана: {basket.created_at.strftime('%d.%m.%Y %H:%M')}"
             )
 
@@ -65,7 +65,7 @@ async def create_basket_command(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
 
     try:
-        basket = create_basket(user_id, name)
+        basket = await run_db(create_basket, user_id, name)
         await message.reply(
             f"Корзина **{basket.name}** создана!\n"
             f"ID: `{basket.id}`\n"
@@ -91,7 +91,7 @@ async def delete_basket_command(message: types.Message, state: FSMContext):
         basket_id = int(args)
         user_id = message.from_user.id
         # Проверяем, что корзина принадлежит пользователю
-        basket = get_basket(basket_id)
+        basket = await run_db(get_basket, basket_id)
         if not basket:
             await message.reply("Корзина с указанным ID не найдена.")
             return
@@ -99,7 +99,7 @@ async def delete_basket_command(message: types.Message, state: FSMContext):
             await message.reply("Вы не можете удалить чужую корзину.")
             return
 
-        success = delete_basket(basket_id)
+        success = await run_db(delete_basket, basket_id)
         if success:
             await message.reply(f"Корзина #{basket_id} удалена.")
         else:
@@ -125,7 +125,7 @@ async def basket_command(message: types.Message, state: FSMContext):
     try:
         basket_id = int(args)
         user_id = message.from_user.id
-        basket = get_basket(basket_id)
+        basket = await run_db(get_basket, basket_id)
         if not basket:
             await message.reply("Корзина с указанным ID не найдена.")
             return
@@ -133,14 +133,14 @@ async def basket_command(message: types.Message, state: FSMContext):
             await message.reply("Вы не можете просматривать чужую корзину.")
             return
 
-        items = get_basket_items(basket_id)
+        items = await run_db(get_basket_items, basket_id)
         if not items:
             await message.reply(
                 f"Корзина **{basket.name}** пуста.", parse_mode="Markdown"
             )
             return
 
-        total = calculate_basket_total(basket_id)
+        total = await run_db(calculate_basket_total, basket_id)
 
         lines = [f"*{basket.name}* (ID: {basket.id})"]
         for item in items:
@@ -188,7 +188,7 @@ async def add_to_basket_command(message: types.Message, state: FSMContext):
         quantity = float(parts[2]) if len(parts) > 2 else 1.0
 
         user_id = message.from_user.id
-        basket = get_basket(basket_id)
+        basket = await run_db(get_basket, basket_id)
         if not basket:
             await message.reply("Корзина с указанным ID не найдена.")
             return
@@ -196,8 +196,8 @@ async def add_to_basket_command(message: types.Message, state: FSMContext):
             await message.reply("Вы не можете добавлять товары в чужую корзину.")
             return
 
-        item = add_to_basket(basket_id, product_id, quantity)
-        product = Product.get_by_id(product_id)
+        item = await run_db(add_to_basket, basket_id, product_id, quantity)
+        product = await run_db(Product.get_by_id, product_id)
 
         await message.reply(
             f"Товар **{product.name}** добавлен в корзину **{basket.name}**.\n"
@@ -230,7 +230,7 @@ async def remove_from_basket_command(message: types.Message, state: FSMContext):
     try:
         item_id = int(args)
         # Проверяем, что элемент принадлежит корзине пользователя
-        item = BasketItem.get_or_none(BasketItem.id == item_id)
+        item = await run_db(get_basket_item, item_id)
         if not item:
             await message.reply("Элемент с указанным ID не найден.")
             return
@@ -239,7 +239,7 @@ async def remove_from_basket_command(message: types.Message, state: FSMContext):
             await message.reply("Вы не можете удалять элементы из чужой корзины.")
             return
 
-        success = remove_from_basket(item_id)
+        success = await run_db(remove_from_basket, item_id)
         if success:
             await message.reply(f"Позиция #{item_id} удалена из корзины.")
         else:
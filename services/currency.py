@@ -0,0 +1,174 @@
+"""
+Конвертация валют для сравнения цен разных магазинов.
+
+Курсы хранятся в таблице CurrencyRate с историей по датам и загружаются
+из локального CSV-файла (config.CURRENCY_RATES_PATH). Для быстрых
+пересчётов курсы держатся в памяти и перечитываются из таблицы раз в
+CURRENCY_RATES_TTL секунд, поиск курса на дату - бинарный поиск.
+"""
+
+import csv
+import logging
+import threading
+import time
+from bisect import bisect_right
+from datetime import date, datetime
+
+from peewee import EXCLUDED
+
+from config import BASE_CURRENCY, CURRENCY_RATES_PATH, CURRENCY_RATES_TTL
+from models import CurrencyRate, db
+
+logger = logging.getLogger(__name__)
+
+# Обозначения валют из store_config.txt и ценников -> коды ISO 4217
+CURRENCY_ALIASES = {
+    "ГРН": "UAH",
+    "₴": "UAH",
+    "₽": "RUB",
+    "РУБ": "RUB",
+    "€": "EUR",
+    "₸": "KZT",
+    "KČ": "CZK",
+    "KSHS": "KES",
+}
+
+
+def normalize_currency(currency):
+    """Приводит обозначение валюты к коду ISO ("грн" -> "UAH")."""
+    if not currency:
+        return ""
+    code = currency.strip().upper()
+    return CURRENCY_ALIASES.get(code, code)
+
+
+def _as_date(value):
+    if value is None:
+        return date.today()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+class CurrencyConverter:
+    """
+    Пересчёт сумм в базовую валюту по курсам с историей.
+    Курс на дату - последний известный курс не позже этой даты.
+    Курсы перечитываются из таблицы, если загружены больше
+    CURRENCY_RATES_TTL секунд назад.
+    """
+
+    def __init__(self, base_currency=BASE_CURRENCY):
+        self.base_currency = normalize_currency(base_currency)
+        self._rates = {}  # currency -> (список дат, список курсов)
+        self._loaded_at = None  # time.monotonic() последней загрузки
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Загружает все курсы из таблицы CurrencyRate в память."""
+        rates = {}
+        query = CurrencyRate.select().order_by(CurrencyRate.currency, CurrencyRate.date)
+        for row in query:
+            dates, values = rates.setdefault(row.currency, ([], []))
+            dates.append(row.date)
+            values.append(row.rate)
+        # Подменяем словарь целиком, чтобы читатели не видели его частично
+        self._rates = rates
+        self._loaded_at = time.monotonic()
+        if rates:
+            logger.info(f"Загружены курсы для {len(rates)} валют")
+        else:
+            logger.warning(
+                "Таблица CurrencyRate пуста, цены в других валютах не пересчитываются"
+                " (python -m services.currency)"
+            )
+
+    def _is_stale(self):
+        loaded_at = self._loaded_at
+        return loaded_at is None or time.monotonic() - loaded_at > CURRENCY_RATES_TTL
+
+    def _ensure_loaded(self):
+        if self._is_stale():
+            with self._lock:
+                if self._is_stale():
+                    self.load()
+
+    def rate(self, currency, on_date=None):
+        """Курс валюты к базовой на дату или None, если курс неизвестен."""
+        code = normalize_currency(currency)
+        if code == self.base_currency:
+            return 1.0
+        self._ensure_loaded()
+        history = self._rates.get(code)
+        if not history:
+            return None
+        dates, values = history
+        index = bisect_right(dates, _as_date(on_date))
+        if index == 0:
+            return None
+        return values[index - 1]
+
+    def convert(self, amount, currency, on_date=None):
+        """Переводит сумму в базовую валюту, None - если нет суммы или курса."""
+        if amount is None:
+            return None
+        rate = self.rate(currency, on_date)
+        if rate is None:
+            return None
+        return round(amount * rate, 2)
+
+    def convert_many(self, amounts, currencies, on_date=None):
+        """
+        Пакетная конвертация: amounts и currencies - списки одной длины.
+        Курс каждой валюты ищется один раз на весь пакет.
+        """
+        rates = {}
+        converted = []
+        for amount, currency in zip(amounts, currencies):
+            if currency not in rates:
+                rates[currency] = self.rate(currency, on_date)
+            rate = rates[currency]
+            if amount is None or rate is None:
+                converted.append(None)
+            else:
+                converted.append(round(amount * rate, 2))
+        return converted
+
+
+converter = CurrencyConverter()
+
+
+def load_rates_file(path=CURRENCY_RATES_PATH):
+    """
+    Импортирует курсы из CSV-файла (date,currency,rate) в таблицу CurrencyRate
+    и обновляет кэш. rate - стоимость 1 единицы валюты в базовой валюте.
+    Строки, начинающиеся с '#', пропускаются. Возвращает число курсов.
+    """
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        lines = (line for line in f if line.strip() and not line.startswith("#"))
+        for record in csv.DictReader(lines):
+            rows.append(
+                {
+                    "currency": normalize_currency(record["currency"]),
+                    "date": datetime.strptime(record["date"], "%Y-%m-%d").date(),
+                    "rate": float(record["rate"]),
+                }
+            )
+
+    with db.atomic():
+        for start in range(0, len(rows), 100):
+            CurrencyRate.insert_many(rows[start : start + 100]).on_conflict(
+                conflict_target=[CurrencyRate.currency, CurrencyRate.date],
+                update={CurrencyRate.rate: EXCLUDED.rate},
+            ).execute()
+
+    converter.load()
+    logger.info(f"Импортировано {len(rows)} курсов из {path}")
+    return len(rows)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    count = load_rates_file()
+    print(f"Импортировано курсов: {count}")
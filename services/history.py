@@ -5,22 +5,15 @@ from datetime import datetime, timedelta
 
 import matplotlib.pyplot as plt
 
-from models import Product
+from services.retention import history_points
 
 
 def get_price_history(product_name=None, days=7):
+    # Старые периоды читаются из почасовых и суточных агрегатов (см. retention)
     since = datetime.now() - timedelta(days=days)
-    query = Product.select().where(Product.timestamp >= since)
-    if product_name:
-        query = query.where(Product.name == product_name)
-    query = query.order_by(Product.timestamp)
-
     return [
-        {
-            "timestamp": record.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-            "price": record.price,
-        }
-        for record in query
+        {"timestamp": timestamp.strftime("%Y-%m-%d %H:%M:%S"), "price": price}
+        for timestamp, price in history_points(since, product_name)
     ]
 
 
@@ -1,41 +1,47 @@
 # ~/PriceParser/services/notifier.py
 
-from models import Subscription  # Импортируем модель Subscription
+import logging
+
+from services.repository import get_active_subscriptions, price_snapshot, run_db
+
+logger = logging.getLogger(__name__)
 
 
 async def notify_subscribers(bot, prices):
+    """
+    Рассылает подписчикам отчёт по уже сохранённым ценам prices
+    (результат scrape_prices): полный или только изменения.
+    """
     if not prices:
         return
-    latest = get_latest_prices()
-    previous = get_previous_prices()
+    # {name: (latest, previous)} из снимка цен в памяти
+    snapshot = (await price_snapshot()).prices
 
     # Подготовим полные отчёты с изменениями для каждого продукта
     full_report_lines = []
     changed_report_lines = []
 
-    for name, price in prices.items():
-        change = ""
-        if name in previous and previous[name] != price:
-            delta = price - previous[name]
-            direction = "up" if delta > 0 else "down"
-            change = f" ({direction} ${abs(delta):.2f})"
-            changed_report_lines.append(f"Product: {name}, Price: ${price:.2f}{change}")
-        else:
-            # Если цена не изменилась или нет в previous — в full_report, но не в changed_report
-            full_report_lines.append(f"Product: {name}, Price: ${price:.2f}{change}")
-
-        # Добавляем в полный отчёт всё подряд, включая изменённые
-        if change:
-            full_report_lines.append(f"Product: {name}, Price: ${price:.2f}{change}")
-        elif name not in previous:
+    for name, data in prices.items():
+        price, previous = snapshot.get(name, (data["price"], None))
+        if previous is None:
             # новый товар
             full_report_lines.append(f"Product: {name}, Price: ${price:.2f} (new)")
+        elif previous != price:
+            delta = price - previous
+            direction = "up" if delta > 0 else "down"
+            line = (
+                f"Product: {name}, Price: ${price:.2f} ({direction} ${abs(delta):.2f})"
+            )
+            changed_report_lines.append(line)
+            full_report_lines.append(line)
+        else:
+            full_report_lines.append(f"Product: {name}, Price: ${price:.2f}")
 
     full_report_text = "\n".join(full_report_lines)
     changed_report_text = "\n".join(changed_report_lines)
 
     # Телеграм уведомления
-    for sub in Subscription.select().where(Subscription.subscribed == True):
+    for sub in await run_db(get_active_subscriptions):
         user_id = sub.user_id
         try:
             if sub.notify_only_on_change:
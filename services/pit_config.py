@@ -0,0 +1,328 @@
+"""
+Реестр конфигураций магазинов PIT (store_config.txt).
+
+Разобранные и проверенные конфигурации кэшируются: файл перечитывается только
+при изменении mtime/размера, а разбирается заново только если изменилось
+его содержимое (sha256). Правки файла подхватываются при следующем обращении
+без перезапуска бота. Шаблоны TITLE/PRICE разбираются один раз при загрузке,
+поиск конфигураций магазина - по словарю.
+
+Конфигурации также можно хранить в таблицах StoreConfig, StoreTemplate и
+StoreUrl (импорт из текстового файла - import_config_file). Если таблицы
+заполнены, load_configs выбирает магазины и продукты SQL-запросом, иначе
+используется файл.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from peewee import prefetch
+
+from database import with_connection
+from models import StoreConfig, StoreTemplate, StoreUrl, db
+from services.pit_integration import store_productscraper
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = Path(__file__).parent / "pit_integration" / "store_config.txt"
+
+
+def validate_config(entry, path=CONFIG_PATH):
+    """
+    Проверяет одну конфигурацию магазина.
+    Возвращает список ошибок вида "store_config.txt:24: Walmart / Bread: ...".
+    """
+    name = f"{entry.get('STORE') or '?'} / {entry.get('PRODUCT') or '?'}"
+    prefix = f"{Path(path).name}:{entry.get('LINE', '?')}: {name}"
+    errors = []
+    for key in ("STORE", "COUNTRY", "PRODUCT"):
+        if not entry.get(key):
+            errors.append(f"{prefix}: не указано поле {key}")
+    for key in ("TITLE", "PRICE"):
+        template = entry.get(key) or []
+        if not any("FFF" in line for line in template):
+            errors.append(f"{prefix}: в шаблоне {key} нет метки FFF")
+    urls = {variant: url for variant, url in entry.get("URLS", {}).items() if url}
+    if not urls:
+        errors.append(f"{prefix}: не указан ни один URL")
+    for variant, url in urls.items():
+        if not url.startswith(("http://", "https://")):
+            errors.append(f"{prefix}: некорректный URL для {variant}: {url}")
+    if not entry.get("CURRENCY_MAP"):
+        errors.append(f"{prefix}: пустой CURRENCY_MAP")
+    return errors
+
+
+def compile_config(entry):
+    """Добавляет к конфигурации разобранные шаблоны TITLE_TEMPLATE и PRICE_TEMPLATE."""
+    compiled = dict(entry)
+    compiled["TITLE_TEMPLATE"] = store_productscraper.parse_template(entry["TITLE"])
+    compiled["PRICE_TEMPLATE"] = store_productscraper.parse_template(entry["PRICE"])
+    return compiled
+
+
+class StoreConfigRegistry:
+    """
+    Кэш конфигураций магазинов с горячей перезагрузкой.
+    Некорректные записи пропускаются, ошибки с номерами строк доступны в errors.
+    Если при перезагрузке запись не удалось разобрать, остаются конфигурации,
+    загруженные последними.
+    """
+
+    def __init__(self, path=CONFIG_PATH):
+        self.path = Path(path)
+        self.configs = []
+        self.by_store = {}  # магазин -> список конфигураций (по продуктам)
+        self.errors = []
+        self.version = 0  # увеличивается при каждой перезагрузке
+        self._signature = None  # (mtime_ns, size)
+        self._digest = None
+        self._lock = threading.Lock()
+
+    def _reload_if_changed(self):
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return
+        with self._lock:
+            if signature == self._signature:
+                return
+            with open(self.path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            if digest != self._digest:
+                self._load()
+                self._digest = digest
+            self._signature = signature
+
+    def _load(self):
+        parse_errors = []
+        entries = store_productscraper.parse_config(str(self.path), parse_errors)
+        errors = [f"{self.path.name}:{e.line}: {e.message}" for e in parse_errors]
+        if errors and self.version:
+            # Файл, скорее всего, правят прямо сейчас: остаются конфигурации,
+            # загруженные последними, до следующего изменения файла
+            for error in errors:
+                logger.warning(f"Ошибка разбора конфигурации магазина: {error}")
+            self.errors = errors
+            logger.warning(
+                f"{self.path.name} не перезагружен, используются конфигурации"
+                f" версии {self.version}"
+            )
+            return
+
+        configs, by_store = [], {}
+        for entry in entries:
+            entry_errors = validate_config(entry, self.path)
+            if entry_errors:
+                errors.extend(entry_errors)
+                continue
+            config = compile_config(entry)
+            configs.append(config)
+            by_store.setdefault(config["STORE"], []).append(config)
+
+        for error in errors:
+            logger.warning(f"Ошибка конфигурации магазина: {error}")
+        # Подменяем ссылки целиком, читатели видят либо старую, либо новую версию
+        self.configs, self.by_store, self.errors = configs, by_store, errors
+        self.version += 1
+        logger.info(
+            f"Загружено {len(configs)} конфигураций магазинов из {self.path.name}"
+            f" (версия {self.version}, ошибок: {len(errors)})"
+        )
+
+    def get_configs(self):
+        """Актуальный список корректных конфигураций."""
+        self._reload_if_changed()
+        return self.configs
+
+    def for_store(self, store):
+        """Конфигурации магазина (по всем продуктам) или пустой список."""
+        self._reload_if_changed()
+        return self.by_store.get(store, [])
+
+    def stores(self):
+        self._reload_if_changed()
+        return list(self.by_store)
+
+    def invalidate(self):
+        """Сбрасывает кэш, следующий вызов перечитает файл."""
+        with self._lock:
+            self._signature = None
+            self._digest = None
+
+
+config_registry = StoreConfigRegistry()
+
+
+def import_config_file(path=CONFIG_PATH):
+    """
+    Импортирует store_config.txt в таблицы StoreConfig/StoreTemplate/StoreUrl.
+    Существующие пары магазин + продукт обновляются, шаблоны и URL заменяются,
+    пары, которых больше нет в файле, отключаются (active = False).
+    Некорректные записи пропускаются. Возвращает (импортировано, ошибки).
+    """
+    imported = 0
+    parse_errors = []
+    entries = store_productscraper.parse_config(str(path), parse_errors)
+    errors = [f"{Path(path).name}:{e.line}: {e.message}" for e in parse_errors]
+    with db.atomic():
+        for entry in entries:
+            entry_errors = validate_config(entry, path)
+            if entry_errors:
+                errors.extend(entry_errors)
+                continue
+
+            config, created = StoreConfig.get_or_create(
+                store=entry["STORE"], product=entry["PRODUCT"]
+            )
+            config.country = entry["COUNTRY"]
+            config.currency_map = json.dumps(entry["CURRENCY_MAP"], ensure_ascii=False)
+            config.active = True
+            config.updated_at = datetime.now()
+            config.save()
+
+            if not created:
+                StoreTemplate.delete().where(StoreTemplate.config == config).execute()
+                StoreUrl.delete().where(StoreUrl.config == config).execute()
+            templates = [
+                {"config": config, "kind": kind, "position": position, "line": line}
+                for kind in ("TITLE", "PRICE")
+                for position, line in enumerate(entry[kind])
+            ]
+            StoreTemplate.insert_many(templates).execute()
+            urls = [
+                {"config": config, "variant": variant, "url": url}
+                for variant, url in entry["URLS"].items()
+                if url
+            ]
+            StoreUrl.insert_many(urls).execute()
+            imported += 1
+
+        if parse_errors:
+            # Неразобранные записи могли описывать существующие пары,
+            # поэтому без полного списка из файла ничего не отключаем
+            logger.warning(
+                f"{Path(path).name} разобран с ошибками, удалённые из файла"
+                " конфигурации не отключены"
+            )
+        else:
+            # Некорректные, но разобранные записи остаются в файле: их прежняя
+            # версия в БД продолжает работать
+            in_file = {(entry["STORE"], entry["PRODUCT"]) for entry in entries}
+            removed = [
+                config.id
+                for config in StoreConfig.select().where(
+                    StoreConfig.active == True  # noqa: E712
+                )
+                if (config.store, config.product) not in in_file
+            ]
+            if removed:
+                StoreConfig.update(active=False, updated_at=datetime.now()).where(
+                    StoreConfig.id.in_(removed)
+                ).execute()
+                logger.info(
+                    f"Отключено {len(removed)} конфигураций, удалённых из файла"
+                )
+
+    for error in errors:
+        logger.warning(f"Запись не импортирована: {error}")
+    logger.info(f"Импортировано {imported} конфигураций магазинов из {Path(path).name}")
+    return imported, errors
+
+
+# Разобранные шаблоны конфигураций из БД: (id, updated_at) -> (TITLE, PRICE)
+COMPILED_CACHE_SIZE = 4096
+_compiled_templates = {}
+
+
+def _config_from_row(row):
+    """Собирает словарь конфигурации в формате parse_config из строк таблиц."""
+    templates = {"TITLE": [], "PRICE": []}
+    for template in sorted(row.templates, key=lambda t: t.position):
+        templates[template.kind].append(template.line)
+    config = {
+        "STORE": row.store,
+        "COUNTRY": row.country,
+        "PRODUCT": row.product,
+        "TITLE": templates["TITLE"],
+        "PRICE": templates["PRICE"],
+        "CURRENCY_MAP": json.loads(row.currency_map),
+        "URLS": {url.variant: url.url for url in row.urls},
+    }
+    key = (row.id, row.updated_at)
+    if key not in _compiled_templates:
+        if len(_compiled_templates) > COMPILED_CACHE_SIZE:
+            # Устаревшие версии шаблонов после правок просто отбрасываем
+            _compiled_templates.clear()
+        compiled = compile_config(config)
+        _compiled_templates[key] = (
+            compiled["TITLE_TEMPLATE"],
+            compiled["PRICE_TEMPLATE"],
+        )
+    config["TITLE_TEMPLATE"], config["PRICE_TEMPLATE"] = _compiled_templates[key]
+    return config
+
+
+def has_db_configs():
+    """True, если конфигурации магазинов хранятся в БД."""
+    return StoreConfig.table_exists() and StoreConfig.select().exists()
+
+
+def load_db_configs(store_filter=None, product_filter=None):
+    """
+    Активные конфигурации из БД, отфильтрованные по магазинам и продуктам
+    в SQL. Шаблоны и URL загружаются двумя запросами на всю выборку.
+    """
+    query = StoreConfig.select().where(StoreConfig.active == True)  # noqa: E712
+    if store_filter:
+        query = query.where(StoreConfig.store.in_(list(store_filter)))
+    if product_filter:
+        query = query.where(StoreConfig.product.in_(list(product_filter)))
+    query = query.order_by(StoreConfig.id)
+    rows = prefetch(query, StoreTemplate, StoreUrl)
+    return [_config_from_row(row) for row in rows]
+
+
+@with_connection(db)
+def load_configs(store_filter=None, product_filter=None):
+    """
+    Конфигурации магазинов для парсинга: из БД, если она заполнена,
+    иначе из store_config.txt через реестр.
+    """
+    if has_db_configs():
+        return load_db_configs(store_filter, product_filter)
+
+    if store_filter:
+        configs = [
+            config
+            for store in dict.fromkeys(store_filter)
+            for config in config_registry.for_store(store)
+        ]
+    else:
+        configs = config_registry.get_configs()
+    if product_filter:
+        products = set(product_filter)
+        configs = [config for config in configs if config["PRODUCT"] in products]
+    return configs
+
+
+if __name__ == "__main__":
+    # Проверка store_config.txt: python -m services.pit_config
+    # Импорт в БД: python -m services.pit_config --import
+    logging.basicConfig(level=logging.INFO)
+    if "--import" in sys.argv:
+        imported, errors = import_config_file()
+        print(f"Импортировано конфигураций: {imported}, ошибок: {len(errors)}")
+        sys.exit()
+    configs = config_registry.get_configs()
+    for error in config_registry.errors:
+        print(error)
+    print(
+        f"Корректных конфигураций: {len(configs)}, ошибок: {len(config_registry.errors)}"
+    )
@@ -6,7 +6,12 @@
 import logging
 from datetime import datetime
 
-from models import PriceHistory, Product
+from peewee import EXCLUDED, Select, chunked, fn
+
+from database import max_query_variables
+from models import LatestPrice, PriceHistory, Product, db
+from services.currency import converter, normalize_currency
+from services.snapshot import price_cache
 
 logger = logging.getLogger(__name__)
 
@@ -19,10 +24,23 @@ def generate_external_id(store, product_name, unit_size, unit_type):
     return hashlib.md5(key).hexdigest()
 
 
+def product_key_condition(store, name, unit_size, unit_type):
+    """Условие поиска товара по естественному ключу (NULL сравнивается как IS NULL)."""
+    condition = (Product.store == store) & (Product.name == name)
+    for field, value in (
+        (Product.unit_size, unit_size),
+        (Product.unit_type, unit_type),
+    ):
+        condition &= field.is_null() if value is None else field == value
+    return condition
+
+
 def get_or_create_product(item):
     """
     Находит существующий товар или создаёт новый.
-    Критерии поиска: store + name + unit_size + unit_type.
+    Критерии поиска: store + name + unit_size + unit_type (индекс).
+    Создание - INSERT ... ON CONFLICT (external_id) DO NOTHING, поэтому
+    параллельные запуски не создают дубликатов.
     Возвращает кортеж (product, created).
     """
     store = item["store"]
@@ -31,73 +49,261 @@ def get_or_create_product(item):
     unit_type = item["unit_type"]
 
     # Поиск по комбинации полей
-    query = Product.select().where(
-        (Product.store == store)
-        & (Product.name == name)
-        & (Product.unit_size == unit_size)
-        & (Product.unit_type == unit_type)
+    product = (
+        Product.select()
+        .where(product_key_condition(store, name, unit_size, unit_type))
+        .order_by(Product.id)
+        .first()
     )
-
-    product = query.first()
-    created = False
-
     if product:
         logger.debug(f"Найден существующий товар: {product.id} {store} {name}")
-        return product, created
-    else:
-        # Создаём новый товар
-        product = Product(
-            name=name,
-            price=item["price"],
-            category="pit",  # специальная категория для товаров из PIT
-            store=store,
-            unit_size=unit_size,
-            unit_type=unit_type,
-            price_per_unit=item["price_per_unit"],
-            external_id=item.get("external_id")
-            or generate_external_id(store, name, unit_size, unit_type),
-        )
-        product.save()
-        created = True
+        return product, False
+
+    external_id = item.get("external_id") or generate_external_id(
+        store, name, unit_size, unit_type
+    )
+    query = Product.insert(
+        name=name,
+        price=item["price"],
+        category="pit",  # специальная категория для товаров из PIT
+        store=store,
+        unit_size=unit_size,
+        unit_type=unit_type,
+        price_per_unit=item["price_per_unit"],
+        currency=item.get("currency"),
+        base_price_per_unit=item.get("base_price_per_unit"),
+        external_id=external_id,
+    ).on_conflict_ignore()
+    # rowcount 0 - товар с таким external_id уже создал другой процесс
+    created = db.execute(query).rowcount == 1
+    product = Product.get(Product.external_id == external_id)
+    if created:
         logger.info(f"Создан новый товар: {product.id} {store} {name}")
-        return product, created
+    return product, created
 
 
 def add_price_history(product, item):
     """
     Добавляет запись в историю цен для товара, если цена изменилась.
+    Последняя цена берётся из LatestPrice по первичному ключу и обновляется
+    в той же транзакции, что и история.
     Возвращает True, если запись добавлена, иначе False.
     """
-    # Получаем последнюю запись истории для этого товара
-    last_history = (
-        PriceHistory.select()
-        .where(PriceHistory.product == product)
-        .order_by(PriceHistory.timestamp.desc())
-        .first()
-    )
+    last_price = latest_prices([product.id]).get(product.id)
 
-    # Если последней записи нет или цена отличается, добавляем новую
-    if not last_history or last_history.price != item["price"]:
-        PriceHistory.create(
-            product=product,
-            price=item["price"],
-            unit_size=item["unit_size"],
-            unit_type=item["unit_type"],
-            price_per_unit=item["price_per_unit"],
-            timestamp=datetime.now(),
-        )
+    # Если последней цены нет или она отличается, добавляем новую запись
+    if last_price is None or last_price != item["price"]:
+        timestamp = datetime.now()
+        with db.atomic():
+            PriceHistory.create(
+                product=product,
+                price=item["price"],
+                unit_size=item["unit_size"],
+                unit_type=item["unit_type"],
+                price_per_unit=item["price_per_unit"],
+                currency=item.get("currency"),
+                base_price_per_unit=item.get("base_price_per_unit"),
+                timestamp=timestamp,
+                last_seen=timestamp,
+            )
+            record_latest_prices(
+                [
+                    {
+                        "product": product.id,
+                        "price": item["price"],
+                        "price_per_unit": item["price_per_unit"],
+                        "observed_at": timestamp,
+                    }
+                ]
+            )
         logger.debug(f"Добавлена запись истории цен для товара {product.id}")
         return True
     else:
+        touch_observations([product.id], datetime.now())
         logger.debug(
             f"Цена не изменилась для товара {product.id}, история не добавляется"
         )
         return False
 
 
+# Размер пакета для IN (...) и insert_many (ограничение числа параметров SQLite)
+BATCH_SIZE = 500
+
+
+def insert_chunks(rows):
+    """
+    Делит строки (словари) для insert_many на пакеты до BATCH_SIZE строк,
+    в каждом из которых параметров не больше, чем принимает база.
+    """
+    if not rows:
+        return []
+    size = max(1, min(BATCH_SIZE, max_query_variables(db) // len(rows[0])))
+    return chunked(rows, size)
+
+
+# Поля результата, без которых запись не сохраняется
+REQUIRED_FIELDS = (
+    "store",
+    "product_name",
+    "price",
+    "unit_size",
+    "unit_type",
+    "price_per_unit",
+)
+
+# Поля товара, которые обновляются при изменении цены
+PRICE_FIELDS = [
+    Product.price,
+    Product.price_per_unit,
+    Product.currency,
+    Product.base_price_per_unit,
+]
+
+
+def product_key(store, name, unit_size, unit_type):
+    """Ключ сопоставления товара: store + name + unit_size + unit_type."""
+    return (store, name, unit_size, unit_type)
+
+
+def fetch_products_by_external_id(external_ids):
+    """Товары по external_id (уникальный индекс): {external_id: Product}."""
+    found = {}
+    external_ids = list(external_ids)
+    for start in range(0, len(external_ids), BATCH_SIZE):
+        chunk = external_ids[start : start + BATCH_SIZE]
+        for product in Product.select().where(Product.external_id.in_(chunk)):
+            found[product.external_id] = product
+    return found
+
+
+def fetch_products_by_key(keys):
+    """
+    Находит существующие товары по ключам product_key одним запросом на пакет.
+    Возвращает словарь {ключ: Product}.
+    """
+    found = {}
+    keys = list(keys)
+    # Два списка IN (магазины и названия) - до двух параметров на ключ
+    size = max(1, min(BATCH_SIZE, max_query_variables(db) // 2))
+    for start in range(0, len(keys), size):
+        chunk = set(keys[start : start + size])
+        query = (
+            Product.select()
+            .where(
+                Product.store.in_({key[0] for key in chunk})
+                & Product.name.in_({key[1] for key in chunk})
+            )
+            .order_by(Product.id)
+        )
+        for product in query:
+            key = product_key(
+                product.store, product.name, product.unit_size, product.unit_type
+            )
+            if key in chunk and key not in found:
+                found[key] = product
+    return found
+
+
+def latest_history_prices(product_ids):
+    """Последняя цена из истории для каждого товара: {product_id: price}."""
+    prices = {}
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        ranked = (
+            PriceHistory.select(
+                PriceHistory.product.alias("product_id"),
+                PriceHistory.price.alias("price"),
+                fn.ROW_NUMBER()
+                .over(
+                    partition_by=[PriceHistory.product],
+                    order_by=[PriceHistory.timestamp.desc(), PriceHistory.id.desc()],
+                )
+                .alias("position"),
+            )
+            .where(PriceHistory.product.in_(product_ids[start : start + BATCH_SIZE]))
+            .alias("ranked")
+        )
+        query = (
+            Select([ranked], [ranked.c.product_id, ranked.c.price])
+            .where(ranked.c.position == 1)
+            .bind(db)
+        )
+        prices.update(query.tuples())
+    return prices
+
+
+def read_latest_prices(product_ids):
+    """Цены из LatestPrice по первичному ключу: {product_id: price}."""
+    product_ids = list(product_ids)
+    prices = {}
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        query = LatestPrice.select(LatestPrice.product, LatestPrice.price).where(
+            LatestPrice.product.in_(product_ids[start : start + BATCH_SIZE])
+        )
+        prices.update(query.tuples())
+    return prices
+
+
+def latest_prices(product_ids):
+    """
+    Последняя цена каждого товара: {product_id: price}.
+    Читается из LatestPrice по первичному ключу; товары без строки LatestPrice
+    (история записана до появления таблицы) берутся из PriceHistory.
+    """
+    product_ids = list(product_ids)
+    prices = read_latest_prices(product_ids)
+    missing = [product_id for product_id in product_ids if product_id not in prices]
+    if missing:
+        prices.update(latest_history_prices(missing))
+    return prices
+
+
+def record_latest_prices(rows):
+    """
+    Записывает последние цены (словари product, price, price_per_unit,
+    observed_at) через INSERT ... ON CONFLICT (product_id) DO UPDATE.
+    """
+    for chunk in insert_chunks(rows):
+        LatestPrice.insert_many(chunk).on_conflict(
+            conflict_target=[LatestPrice.product],
+            update={
+                LatestPrice.price: EXCLUDED.price,
+                LatestPrice.price_per_unit: EXCLUDED.price_per_unit,
+                LatestPrice.observed_at: EXCLUDED.observed_at,
+            },
+        ).execute()
+
+
+def touch_observations(product_ids, seen_at):
+    """
+    Продлевает текущие наблюдения товаров, цена которых не изменилась:
+    last_seen строки истории, на которую указывает LatestPrice, = seen_at.
+    """
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        current = (
+            PriceHistory.select(PriceHistory.id)
+            .join(
+                LatestPrice,
+                on=(
+                    (LatestPrice.product == PriceHistory.product)
+                    & (LatestPrice.observed_at == PriceHistory.timestamp)
+                ),
+            )
+            .where(LatestPrice.product.in_(product_ids[start : start + BATCH_SIZE]))
+        )
+        PriceHistory.update(last_seen=seen_at).where(
+            PriceHistory.id.in_(current)
+        ).execute()
+
+
 def save_pit_results(results):
     """
     Сохраняет результаты парсинга PIT в базу данных PP.
+    Все записи сохраняются пакетно в одной транзакции: один запрос на поиск
+    существующих товаров, insert_many для новых товаров и истории,
+    пакетный UPDATE для изменившихся цен. Последние цены для сравнения
+    читаются из LatestPrice и обновляются в той же транзакции.
     Аргумент:
         results (list): список словарей, возвращаемый pit_parser.run_pit_parsing()
     Возвращает:
@@ -111,40 +317,45 @@ def save_pit_results(results):
         "errors": 0,
     }
 
-    for item in results:
-        try:
-            # Получаем или создаём товар
-            product, created = get_or_create_product(item)
-            if created:
-                stats["products_created"] += 1
-            else:
-                stats["products_updated"] += 1
-
-            # Если товар существовал, проверяем, изменилась ли цена
-            if not created:
-                old_price = product.price
-                old_price_per_unit = product.price_per_unit
-
-                # Обновляем цену и цену за единицу
-                if (
-                    old_price != item["price"]
-                    or old_price_per_unit != item["price_per_unit"]
-                ):
-                    product.price = item["price"]
-                    product.price_per_unit = item["price_per_unit"]
-                    product.save()
-                    logger.info(
-                        f"Обновлена цена товара {product.id}: {old_price} -> {item['price']}"
-                    )
-
-            # Добавляем запись в историю
-            history_added = add_price_history(product, item)
-            if history_added:
-                stats["history_added"] += 1
-
-        except Exception as e:
-            logger.error(f"Ошибка сохранения товара {item.get('product_name')}: {e}")
+    # Цены за единицу в базовой валюте считаются одним пакетом при записи,
+    # чтобы сравнение магазинов сортировалось прямо в SQL
+    base_prices = converter.convert_many(
+        [item.get("price_per_unit") or None for item in results],
+        [item.get("currency") for item in results],
+    )
+
+    # Проверяем записи заранее: некорректные не должны откатывать весь пакет
+    prepared = []
+    for item, base_price_per_unit in zip(results, base_prices):
+        missing = [field for field in REQUIRED_FIELDS if field not in item]
+        if missing:
+            logger.error(
+                f"Ошибка сохранения товара {item.get('product_name')}: "
+                f"нет полей {', '.join(missing)}"
+            )
             stats["errors"] += 1
+            continue
+        item = dict(
+            item,
+            currency=normalize_currency(item.get("currency")) or None,
+            base_price_per_unit=base_price_per_unit,
+        )
+        key = product_key(
+            item["store"], item["product_name"], item["unit_size"], item["unit_type"]
+        )
+        prepared.append((key, item))
+
+    try:
+        with price_cache.ingest():
+            with db.atomic():
+                counts = _save_prepared(prepared)
+            # Повторы товара в пакете проще учесть, перечитав снимок из базы
+            price_cache.invalidate()
+        stats.update(counts)
+    except Exception as e:
+        # Транзакция откатана целиком, ни одна запись не сохранена
+        logger.error(f"Ошибка пакетного сохранения результатов PIT: {e}")
+        stats["errors"] += len(prepared)
 
     logger.info(
         f"Сохранение завершено: обработано {stats['total_processed']} записей, "
@@ -154,6 +365,118 @@ def save_pit_results(results):
     return stats
 
 
+def _save_prepared(prepared):
+    """Пакетная запись проверенных результатов, вызывается внутри транзакции."""
+    counts = {"products_created": 0, "products_updated": 0, "history_added": 0}
+    products = fetch_products_by_key({key for key, _ in prepared})
+    last_prices = {}
+    known_prices = latest_prices(product.id for product in products.values())
+    for key, product in products.items():
+        if product.id in known_prices:
+            last_prices[key] = known_prices[product.id]
+
+    new_rows = {}  # ключ -> поля нового товара
+    changed = {}  # id -> изменённый существующий товар
+    history = []  # (ключ, запись) для новых строк истории
+    unchanged = set()  # id товаров, у которых продлевается текущее наблюдение
+
+    for key, item in prepared:
+        product = products.get(key)
+        if product is None and key not in new_rows:
+            new_rows[key] = {
+                "name": item["product_name"],
+                "price": item["price"],
+                "category": "pit",  # специальная категория для товаров из PIT
+                "store": item["store"],
+                "unit_size": item["unit_size"],
+                "unit_type": item["unit_type"],
+                "price_per_unit": item["price_per_unit"],
+                "currency": item["currency"],
+                "base_price_per_unit": item["base_price_per_unit"],
+                "external_id": item.get("external_id") or generate_external_id(*key),
+            }
+            counts["products_created"] += 1
+        elif product is None:
+            # Повтор нового товара в том же пакете обновляет ещё не вставленную строку
+            counts["products_updated"] += 1
+            new_rows[key].update(
+                {field.name: item[field.name] for field in PRICE_FIELDS}
+            )
+        else:
+            counts["products_updated"] += 1
+            if (
+                product.price != item["price"]
+                or product.price_per_unit != item["price_per_unit"]
+                or product.base_price_per_unit != item["base_price_per_unit"]
+            ):
+                logger.info(
+                    f"Обновлена цена товара {product.id}: "
+                    f"{product.price} -> {item['price']}"
+                )
+                for field in PRICE_FIELDS:
+                    setattr(product, field.name, item[field.name])
+                changed[product.id] = product
+
+        # История добавляется, если цены ещё нет или она изменилась
+        if key not in last_prices or last_prices[key] != item["price"]:
+            history.append((key, item))
+            last_prices[key] = item["price"]
+            counts["history_added"] += 1
+            if product is not None:
+                unchanged.discard(product.id)
+        elif product is not None:
+            unchanged.add(product.id)
+
+    # Товар, созданный параллельным запуском, не дублируется: конфликт по
+    # external_id обновляет его цену
+    rows = list(new_rows.values())
+    for chunk in insert_chunks(rows):
+        Product.insert_many(chunk).on_conflict(
+            conflict_target=[Product.external_id],
+            update={field: getattr(EXCLUDED, field.name) for field in PRICE_FIELDS},
+        ).execute()
+    if new_rows:
+        by_external_id = fetch_products_by_external_id(
+            row["external_id"] for row in rows
+        )
+        for key, row in new_rows.items():
+            products[key] = by_external_id[row["external_id"]]
+    if changed:
+        Product.bulk_update(list(changed.values()), PRICE_FIELDS, batch_size=100)
+
+    timestamp = datetime.now()
+    history_rows = [
+        {
+            "product": products[key].id,
+            "price": item["price"],
+            "unit_size": item["unit_size"],
+            "unit_type": item["unit_type"],
+            "price_per_unit": item["price_per_unit"],
+            "currency": item["currency"],
+            "base_price_per_unit": item["base_price_per_unit"],
+            "timestamp": timestamp,
+            "last_seen": timestamp,
+        }
+        for key, item in history
+    ]
+    for chunk in insert_chunks(history_rows):
+        PriceHistory.insert_many(chunk).execute()
+    # Повтор товара в пакете перекрывает строку: в LatestPrice попадёт последняя цена
+    latest_rows = {
+        row["product"]: {
+            "product": row["product"],
+            "price": row["price"],
+            "price_per_unit": row["price_per_unit"],
+            "observed_at": timestamp,
+        }
+        for row in history_rows
+    }
+    record_latest_prices(list(latest_rows.values()))
+    if unchanged:
+        touch_observations(unchanged, timestamp)
+    return counts
+
+
 def get_pit_products(store=None, product_name=None):
     """
     Возвращает список товаров, полученных через PIT.
@@ -7,9 +7,11 @@ import logging
 from aiogram import types
 from aiogram.dispatcher import FSMContext
 
-from models import PriceHistory, Product
+from config import BASE_CURRENCY, DB_BULK_TIMEOUT
+from services.pit_config import load_configs
 from services.pit_db import get_pit_products, save_pit_results
 from services.pit_parser import run_pit_parsing
+from services.repository import compare_unit_prices, get_pit_product_details, run_db
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +26,7 @@ async def pit_products_command(message: types.Message, state: FSMContext):
     store_filter = args.strip() if args else None
 
     try:
-        products = get_pit_products(store=store_filter)
+        products = await run_db(get_pit_products, store=store_filter)
         if not products:
             await message.reply(
                 "Товары PIT не найдены."
@@ -66,22 +68,14 @@ async def price_per_unit_command(message: types.Message, state: FSMContext):
 
     try:
         product_id = int(args)
-        product = Product.get_or_none(
-            Product.id == product_id, Product.category == "pit"
-        )
-        if not product:
+        # Товар и история цен
+        details = await run_db(get_pit_product_details, product_id)
+        if not details:
             await message.reply(
                 "Товар с указанным ID не найден или не является товаром PIT."
             )
             return
-
-        # Получаем историю цен
-        history = (
-            PriceHistory.select()
-            .where(PriceHistory.product == product)
-            .order_by(PriceHistory.timestamp.desc())
-            .limit(5)
-        )
+        product, history = details
 
         lines = [
             f"*{product.name}*",
@@ -120,24 +114,34 @@ async def compare_units_command(message: types.Message, state: FSMContext):
         return
 
     try:
-        products = (
-            Product.select()
-            .where((Product.category == "pit") & (Product.name.contains(args)))
-            .order_by(Product.price_per_unit)
-        )
+        # Сравнимые отсортированы по цене за единицу в базовой валюте
+        ranked, without_rate = await run_db(compare_unit_prices, args)
 
-        if not products:
+        if not ranked and not without_rate:
             await message.reply(f"Товары с названием, содержащим '{args}', не найдены.")
             return
 
-        lines = [f"*Сравнение цен за единицу: '{args}'*"]
-        for p in products:
+        def describe(p):
             unit_info = (
                 f" ({p.unit_size}{p.unit_type})" if p.unit_size and p.unit_type else ""
             )
-            lines.append(
-                f"• {p.store}: {p.price:.2f} ₽{unit_info} → {p.price_per_unit or '?'} ₽/{p.unit_type or 'ед.'}"
+            currency = p.currency or "₽"
+            return (
+                f"{p.store}: {p.price:.2f} {currency}{unit_info} → "
+                f"{p.price_per_unit or '?'} {currency}/{p.unit_type or 'ед.'}"
+            )
+
+        lines = [f"*Сравнение цен за единицу: '{args}'*"]
+        for position, p in enumerate(ranked, 1):
+            base_info = (
+                f" (≈ {p.base_price_per_unit:.2f} {BASE_CURRENCY})"
+                if p.currency != BASE_CURRENCY
+                else ""
             )
+            lines.append(f"{position}. {describe(p)}{base_info}")
+        if without_rate:
+            lines.append(f"\n_Нет курса к {BASE_CURRENCY}, не сравниваются:_")
+            lines.extend(f"• {describe(p)}" for p in without_rate)
 
         await message.reply("\n".join(lines), parse_mode="Markdown")
 
@@ -149,6 +153,7 @@ async def compare_units_command(message: types.Message, state: FSMContext):
 async def run_pit_now_command(message: types.Message, state: FSMContext):
     """
     Команда /run_pit_now - запускает немедленный парсинг PIT (только для администраторов).
+    Можно ограничить одним магазином: /run_pit_now [store]
     """
     await state.finish()
     # Простая проверка на администратора (можно расширить)
@@ -157,11 +162,18 @@ async def run_pit_now_command(message: types.Message, state: FSMContext):
         await message.reply("У вас нет прав для выполнения этой команды.")
         return
 
+    args = message.get_args()
+    store = args.strip() if args else None
+    # Тот же источник, что и у парсинга: БД, если конфигурации импортированы
+    if store and not await run_db(load_configs, [store]):
+        await message.reply(f"Магазин '{store}' не найден в конфигурации PIT.")
+        return
+
     try:
         await message.reply("Запуск парсинга PIT...")
-        results = await run_pit_parsing()
+        results = await run_pit_parsing(store_filter=[store] if store else None)
         if results:
-            stats = save_pit_results(results)
+            stats = await run_db(save_pit_results, results, timeout=DB_BULK_TIMEOUT)
             await message.reply(
                 f"Парсинг завершен!\n"
                 f"Обработано: {stats['total_processed']}\n"
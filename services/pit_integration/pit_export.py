@@ -0,0 +1,210 @@
+"""
+Streaming export of PriceSample rows to NDJSON or JSON.
+
+Rows are read from the cursor and written one at a time, so memory use
+does not depend on the database size. NDJSON output can be extended with
+only the new samples (--since), and any output can be gzip compressed.
+Rows are read in date order from the idx_pricesample_date index.
+
+--since last continues after the sample_id of the last exported record.
+sample_id is AUTOINCREMENT, so samples written later for an already
+exported date (a second run on the same day, a backfill) are still picked
+up, in the order they were written.
+
+    python pit_export.py product_inflation.db prices.ndjson.gz --since last
+"""
+
+import argparse
+import gzip
+import json
+import os
+
+try:
+    from .store_productscraper import DATABASE_FILE, connect_database, get_identity_map
+except ImportError:  # run as a script: python pit_export.py
+    from store_productscraper import DATABASE_FILE, connect_database, get_identity_map
+
+FORMATS = ("ndjson", "json")
+# Bytes read at a time when looking for the last exported record
+TAIL_BLOCK_SIZE = 64 * 1024
+
+EXPORT_QUERY = """
+    SELECT sample_id, date, variant, product_type_id, store_id,
+           price_per_unit_string
+    FROM PriceSample
+    WHERE date > ?
+    ORDER BY date, sample_id
+"""
+
+# Continues an export after the last exported sample_id
+EXPORT_AFTER_QUERY = """
+    SELECT sample_id, date, variant, product_type_id, store_id,
+           price_per_unit_string
+    FROM PriceSample
+    WHERE sample_id > ?
+    ORDER BY sample_id
+"""
+
+
+def iter_samples(conn, identity_map, since=None, after_id=None):
+    """Yield export records for samples dated after since (all if None)
+
+    With after_id only samples written after that sample_id are exported.
+    """
+    if after_id is not None:
+        cursor = conn.execute(EXPORT_AFTER_QUERY, (after_id,))
+    else:
+        cursor = conn.execute(EXPORT_QUERY, (since or "",))
+    for sample_id, date, variant, product_type_id, store_id, price_per_unit in cursor:
+        store_name, store_country = identity_map.store(store_id)
+        yield {
+            "sample_id": sample_id,
+            "date": date,
+            "variant": variant,
+            "product_type_name": identity_map.product_type_name(product_type_id),
+            "store_name": store_name,
+            "store_country": store_country,
+            "price_per_unit_string": price_per_unit,
+        }
+
+
+def is_compressed(path, compress=None):
+    return path.endswith(".gz") if compress is None else compress
+
+
+def open_output(path, mode="w", compress=None):
+    """Open a text output, gzip compressed for *.gz paths or compress=True"""
+    if is_compressed(path, compress):
+        # Appending adds a new gzip member, readers see one continuous stream
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _last_line_plain(path):
+    """Last non-empty line, read backwards from the end in blocks"""
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        tail = b""
+        while end > 0:
+            start = max(0, end - TAIL_BLOCK_SIZE)
+            f.seek(start)
+            tail = f.read(end - start) + tail
+            end = start
+            stripped = tail.rstrip()
+            newline = stripped.rfind(b"\n")
+            if newline != -1:
+                return stripped[newline + 1 :]
+    return tail.strip() or None
+
+
+def _last_line_gzip(path):
+    """Last non-empty line of a gzip file, keeping only the current line
+
+    gzip streams can not be read backwards, so the file is decompressed in
+    blocks without splitting it into lines.
+    """
+    tail = b""
+    with gzip.open(path, "rb") as f:
+        for block in iter(lambda: f.read(TAIL_BLOCK_SIZE), b""):
+            tail = tail + block
+            newline = tail.rstrip().rfind(b"\n")
+            if newline != -1:
+                tail = tail[newline + 1 :]
+    return tail.strip() or None
+
+
+def last_exported_record(path, compress=None):
+    """Last record of an existing NDJSON export, None if there is none"""
+    if not os.path.exists(path):
+        return None
+    if is_compressed(path, compress):
+        last_line = _last_line_gzip(path)
+    else:
+        last_line = _last_line_plain(path)
+    return json.loads(last_line) if last_line else None
+
+
+def last_exported_date(path, compress=None):
+    """Date of the last record in an existing NDJSON export, None if empty"""
+    record = last_exported_record(path, compress)
+    return record["date"] if record else None
+
+
+def export_samples(
+    database_file=DATABASE_FILE,
+    output_path=None,
+    fmt="ndjson",
+    since=None,
+    compress=None,
+):
+    """Export samples dated after since, returns the number of records.
+
+    NDJSON output is appended to when since is given (since="last" continues
+    after the last exported sample_id), otherwise the file is rewritten.
+    JSON output is always rewritten as one compact array, so it can not be
+    combined with since.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if since and fmt == "json":
+        raise ValueError("--since is only supported for ndjson output")
+    after_id = None
+    if since == "last":
+        record = last_exported_record(output_path, compress) or {}
+        # Exports written before records carried sample_id continue by date
+        after_id = record.get("sample_id")
+        since = record.get("date") if after_id is None else None
+
+    conn = connect_database(database_file)
+    identity_map = get_identity_map(database_file)
+    identity_map.load(conn)
+
+    count = 0
+    mode = "a" if fmt == "ndjson" and (since or after_id is not None) else "w"
+    try:
+        with open_output(output_path, mode, compress) as f:
+            if fmt == "json":
+                f.write("[")
+            for record in iter_samples(conn, identity_map, since, after_id):
+                line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+                if fmt == "ndjson":
+                    f.write(line + "\n")
+                else:
+                    f.write(("," if count else "") + line)
+                count += 1
+            if fmt == "json":
+                f.write("]\n")
+    finally:
+        conn.close()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export PriceSample rows")
+    parser.add_argument("database", nargs="?", default=DATABASE_FILE)
+    parser.add_argument("output", nargs="?", default="product_inflation.ndjson")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument(
+        "--since",
+        help="ndjson only: append dates after YYYY-MM-DD, or 'last' to append "
+        "the samples written since the last record of the file",
+    )
+    parser.add_argument(
+        "--gzip",
+        action="store_true",
+        default=None,
+        help="compress the output (default for *.gz paths)",
+    )
+    args = parser.parse_args(argv)
+    if args.since and args.format == "json":
+        parser.error("--since is only supported for ndjson output")
+
+    count = export_samples(
+        args.database, args.output, args.format, args.since, args.gzip
+    )
+    print(f"Exported {count} records to {args.output}")
+    return count
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,10 @@
 import re
 import sqlite3
 import sys
+import threading
 import time
 from datetime import datetime
+from functools import lru_cache
 
 import requests
 from bs4 import BeautifulSoup
@@ -13,6 +15,12 @@ from selenium.webdriver.firefox.service import Service
 
 CONFIG_FILE = "store_config.txt"
 DATABASE_FILE = "product_inflation.db"
+# PriceSample rows buffered by PriceSampleWriter before one executemany/commit
+WRITER_BATCH_SIZE = 500
+# Connection settings: page cache in KiB, memory-mapped I/O, lock wait
+CACHE_SIZE_KB = 64 * 1024
+MMAP_SIZE = 256 * 1024 * 1024
+BUSY_TIMEOUT_MS = 5000
 
 # === Units and Conversions ===
 UNIT_BASE_LABELS = {
@@ -174,9 +182,24 @@ def save_html_to_file(html_content, store_name, variant):
         print(f"Error saving HTML: {e}")
 
 
+def connect_database(database_file=None):
+    """Open a connection in WAL mode (readers don't block the writer)"""
+    conn = sqlite3.connect(
+        database_file or DATABASE_FILE, timeout=BUSY_TIMEOUT_MS / 1000
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    # With WAL, NORMAL only syncs at checkpoints and is still crash-safe
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size={-CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
 def create_database():
     """Create database and tables if they don't exist"""
-    conn = sqlite3.connect(DATABASE_FILE)
+    conn = connect_database()
     cursor = conn.cursor()
 
     # Create Store table with country column
@@ -226,13 +249,35 @@ def create_database():
     """
     )
 
+    # Covering index for per-series lookups (LAG() window of touched series)
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_pricesample_series
+        ON PriceSample (store_id, product_type_id, variant, date, price_number)
+    """
+    )
+
+    # Date order for exports (pit_export.py): no scan and temp B-tree sort
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_pricesample_date
+        ON PriceSample (date, sample_id)
+    """
+    )
+
     conn.commit()
     conn.close()
 
 
-def get_or_create_store(store_name, country_name):
-    """Get store_id for store name, create if doesn't exist"""
-    conn = sqlite3.connect(DATABASE_FILE)
+def get_or_create_store(store_name, country_name, conn=None):
+    """Get store_id for store name, create if doesn't exist.
+
+    With conn given, the insert joins the caller's transaction and is
+    committed by the caller.
+    """
+    own_connection = conn is None
+    if own_connection:
+        conn = connect_database()
     cursor = conn.cursor()
 
     # Try to find existing store
@@ -248,15 +293,19 @@ def get_or_create_store(store_name, country_name):
             (store_name, country_name),
         )
         store_id = cursor.lastrowid
-        conn.commit()
+        if own_connection:
+            conn.commit()
 
-    conn.close()
+    if own_connection:
+        conn.close()
     return store_id
 
 
-def get_or_create_product_type(product_name):
+def get_or_create_product_type(product_name, conn=None):
     """Get product_type_id for product name, create if doesn't exist"""
-    conn = sqlite3.connect(DATABASE_FILE)
+    own_connection = conn is None
+    if own_connection:
+        conn = connect_database()
     cursor = conn.cursor()
 
     # Try to find existing product type
@@ -271,22 +320,210 @@ def get_or_create_product_type(product_name):
         # Create new product type
         cursor.execute("INSERT INTO ProductType (name) VALUES (?)", (product_name,))
         product_type_id = cursor.lastrowid
-        conn.commit()
+        if own_connection:
+            conn.commit()
 
-    conn.close()
+    if own_connection:
+        conn.close()
     return product_type_id
 
 
-def extract_price_info(price_string, currency_map):
-    """Extract price number from price string and get currency from currency_map"""
-    if not price_string:
-        return 0.0, ""
+class IdentityMap:
+    """In-memory Store and ProductType id cache for one database file.
 
-    currency = ""
-    if currency_map:
-        currency = list(currency_map.values())[0]
+    Both tables hold a few dozen rows, so they are loaded once and every
+    lookup after that is a dict access. Misses fall through to
+    get_or_create_store/get_or_create_product_type. Without conn the new
+    row is committed right away and its id goes into the map; with conn
+    the row belongs to the caller's transaction, so its id is staged for
+    that connection and published by commit(conn) or dropped by
+    rollback(conn). A lock makes it safe to share between worker threads.
+    Reverse lookups (id -> name) serve exporters.
+    """
+
+    def __init__(self, database_file=None):
+        self.database_file = database_file or DATABASE_FILE
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.store_ids = {}
+        self.product_type_ids = {}
+        self.stores = {}  # store_id -> (name, country)
+        self.product_types = {}  # product_type_id -> name
+        self.staged = {}  # conn -> ids created in its open transaction
+
+    def load(self, conn=None):
+        """(Re)load both tables, using conn if given"""
+        # Inside an open transaction conn would also see uncommitted rows
+        own_connection = conn is None or conn.in_transaction
+        if own_connection:
+            conn = connect_database(self.database_file)
+        try:
+            stores = conn.execute("SELECT store_id, name, country FROM Store")
+            stores = {row[0]: (row[1], row[2]) for row in stores}
+            product_types = dict(
+                conn.execute("SELECT product_type_id, name FROM ProductType")
+            )
+        finally:
+            if own_connection:
+                conn.close()
+
+        with self.lock:
+            self.stores = stores
+            self.product_types = product_types
+            self.store_ids = {name: id for id, (name, _) in stores.items()}
+            self.product_type_ids = {name: id for id, name in product_types.items()}
+            self.loaded = True
+
+    def clear(self):
+        """Forget all cached and staged ids, the next lookup reloads"""
+        with self.lock:
+            self.loaded = False
+            self.store_ids, self.stores = {}, {}
+            self.product_type_ids, self.product_types = {}, {}
+            self.staged = {}
+
+    def ensure_loaded(self, conn=None):
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    self.load(conn)
+
+    def commit(self, conn):
+        """Publish ids staged for conn, call after its transaction commits"""
+        with self.lock:
+            staged = self.staged.pop(conn, None)
+            if staged is None:
+                return
+            for store_name, (store_id, country_name) in staged["stores"].items():
+                self.store_ids[store_name] = store_id
+                self.stores[store_id] = (store_name, country_name)
+            for product_name, product_type_id in staged["product_types"].items():
+                self.product_type_ids[product_name] = product_type_id
+                self.product_types[product_type_id] = product_name
+
+    def rollback(self, conn):
+        """Drop ids staged for conn, their rows were rolled back"""
+        with self.lock:
+            self.staged.pop(conn, None)
+
+    def _staged_for(self, conn):
+        return self.staged.setdefault(conn, {"stores": {}, "product_types": {}})
+
+    def store_id(self, store_name, country_name, conn=None):
+        """Store id for a name, creating the store on a miss"""
+        self.ensure_loaded(conn)
+        store_id = self.store_ids.get(store_name)
+        if store_id is not None:
+            return store_id
+        with self.lock:
+            store_id = self.store_ids.get(store_name)
+            if store_id is not None:
+                return store_id
+            if conn is None:
+                store_id = get_or_create_store(store_name, country_name)
+                self.store_ids[store_name] = store_id
+                self.stores[store_id] = (store_name, country_name)
+                return store_id
+            staged = self._staged_for(conn)["stores"]
+            if store_name not in staged:
+                store_id = get_or_create_store(store_name, country_name, conn)
+                staged[store_name] = (store_id, country_name)
+            return staged[store_name][0]
+
+    def product_type_id(self, product_name, conn=None):
+        """ProductType id for a name, creating the product type on a miss"""
+        self.ensure_loaded(conn)
+        product_type_id = self.product_type_ids.get(product_name)
+        if product_type_id is not None:
+            return product_type_id
+        with self.lock:
+            product_type_id = self.product_type_ids.get(product_name)
+            if product_type_id is not None:
+                return product_type_id
+            if conn is None:
+                product_type_id = get_or_create_product_type(product_name)
+                self.product_type_ids[product_name] = product_type_id
+                self.product_types[product_type_id] = product_name
+                return product_type_id
+            staged = self._staged_for(conn)["product_types"]
+            if product_name not in staged:
+                staged[product_name] = get_or_create_product_type(product_name, conn)
+            return staged[product_name]
+
+    def store(self, store_id):
+        """(name, country) for a store id, (None, None) if unknown"""
+        self.ensure_loaded()
+        if store_id not in self.stores:
+            # Created by another process after we loaded
+            self.load()
+        return self.stores.get(store_id, (None, None))
+
+    def product_type_name(self, product_type_id):
+        self.ensure_loaded()
+        if product_type_id not in self.product_types:
+            self.load()
+        return self.product_types.get(product_type_id)
+
+
+_identity_maps = {}
+_identity_maps_lock = threading.Lock()
+
+
+def get_identity_map(database_file=None):
+    """Shared IdentityMap for a database file (one per process)"""
+    database_file = database_file or DATABASE_FILE
+    with _identity_maps_lock:
+        if database_file not in _identity_maps:
+            _identity_maps[database_file] = IdentityMap(database_file)
+        return _identity_maps[database_file]
+
+
+# === Price and package normalisation ===
+PRICE_CLEAN_PATTERN = re.compile(r"[^\d.,]")
+
+# Look for patterns like "24 oz", "2L", "500g", etc.
+PACKAGE_PATTERNS = [
+    re.compile(
+        r"(\d+(?:[,\.]\d+)?)\s*(oz|lb|g|kg|ml|l|fl oz|г|мл|л|кг|шт|ea|piece|pieces|pcs|pc)\b",
+        re.IGNORECASE,
+    ),
+    re.compile(
+        r"(\d+(?:[,\.]\d+)?)\s*(ounce|pound|gram|kilogram|liter|litre)\b",
+        re.IGNORECASE,
+    ),
+]
+
+# Normalize unit names
+PACKAGE_UNIT_ALIASES = {
+    "ounce": "oz",
+    "pound": "lb",
+    "gram": "g",
+    "kilogram": "kg",
+    "liter": "l",
+    "litre": "l",
+    "кг": "kg",
+    "pieces": "piece",
+    "pcs": "pc",
+}
+
+# Pages and archives repeat the same strings a lot, parse each one only once
+NORMALIZE_CACHE_SIZE = 65536
 
-    price_clean = re.sub(r"[^\d.,]", "", price_string)
+NORMALIZED_COLUMNS = (
+    "price",
+    "currency",
+    "package_string",
+    "size",
+    "unit",
+    "price_per_unit",
+    "price_per_unit_string",
+)
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def parse_price_number(price_string):
+    """Parse a price string like '1.390,80 грн' or '$2,499.99' into a float"""
+    price_clean = PRICE_CLEAN_PATTERN.sub("", price_string)
 
     # --- Normalize separators based on position and length ---
     if "," in price_clean and "." in price_clean:
@@ -316,49 +553,43 @@ def extract_price_info(price_string, currency_map):
     # ---------------------------------------------------------
 
     try:
-        price_number = float(price_clean)
-    except:
-        price_number = 0.0
+        return float(price_clean)
+    except ValueError:
+        return 0.0
+
+
+def extract_price_info(price_string, currency_map):
+    """Extract price number from price string and get currency from currency_map"""
+    if not price_string:
+        return 0.0, ""
+
+    currency = ""
+    if currency_map:
+        # Prefer the currency whose symbol is present in the price string
+        currency = next(
+            (code for symbol, code in currency_map.items() if symbol in price_string),
+            list(currency_map.values())[0],
+        )
 
-    print(f"Price number to database: {price_number}")
-    return price_number, currency
+    return parse_price_number(price_string), currency
 
 
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
 def extract_package_info(title_string):
     """Extract package size and unit from product title"""
     if not title_string:
         return "", 0.0, ""
 
-    # Look for patterns like "24 oz", "2L", "500g", etc.
-    patterns = [
-        r"(\d+(?:[,\.]\d+)?)\s*(oz|lb|g|kg|ml|l|fl oz|г|мл|л|кг|шт|ea|piece|pieces|pcs|pc)\b",
-        r"(\d+(?:[,\.]\d+)?)\s*(ounce|pound|gram|kilogram|liter|litre)\b",
-    ]
-
-    for pattern in patterns:
-        matches = re.findall(pattern, title_string, re.IGNORECASE)
-        if matches:
+    for pattern in PACKAGE_PATTERNS:
+        match = pattern.search(title_string)
+        if match:
             # Take the first match
-            size_number_str, unit = matches[0]
+            size_number_str, unit = match.groups()
 
             # Handle comma as decimal separator
-            size_number_str = size_number_str.replace(",", ".")
-            size_number = float(size_number_str)
+            size_number = float(size_number_str.replace(",", "."))
             unit = unit.lower()
-
-            # Normalize unit names
-            unit_map = {
-                "ounce": "oz",
-                "pound": "lb",
-                "gram": "g",
-                "kilogram": "kg",
-                "liter": "l",
-                "litre": "l",
-                "кг": "kg",
-                "pieces": "piece",
-                "pcs": "pc",
-            }
-            unit = unit_map.get(unit, unit)
+            unit = PACKAGE_UNIT_ALIASES.get(unit, unit)
 
             package_string = f"{size_number} {unit}"
             return package_string, size_number, unit
@@ -394,31 +625,36 @@ def calculate_price_per_unit(price_number, package_size, package_unit, currency)
     # Format the string with proper decimal formatting
     price_per_unit_string = f"{price_per_unit:.2f} {currency}/{standard_unit}"
 
-    print(f"Price per unit string to database: {price_per_unit_string}")
     return price_per_unit_string, price_per_unit
 
 
-def get_previous_price(store_id, product_type_id, variant):
-    """Get the most recent price for calculating inflation"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-
-    cursor.execute(
-        """
-        SELECT price_number FROM PriceSample
-        WHERE store_id = ? AND product_type_id = ? AND variant = ?
-        ORDER BY date DESC LIMIT 1
-    """,
-        (store_id, product_type_id, variant),
-    )
+def normalize_batch(rows):
+    """Normalise many (price_string, title, currency_map) rows in one call.
 
-    result = cursor.fetchone()
-    conn.close()
+    price_string may also be an already parsed number (e.g. from structured
+    data). Returns a dict of equally long lists keyed by NORMALIZED_COLUMNS.
+    Repeated price strings and titles are parsed only once.
+    """
+    columns = {name: [] for name in NORMALIZED_COLUMNS}
+    for price_string, title, currency_map in rows:
+        if isinstance(price_string, (int, float)):
+            price_number = float(price_string)
+            currency = list(currency_map.values())[0] if currency_map else ""
+        else:
+            price_number, currency = extract_price_info(price_string, currency_map)
+        package_string, size, unit = extract_package_info(title)
+        price_per_unit_string, price_per_unit = calculate_price_per_unit(
+            price_number, size, unit, currency
+        )
 
-    if result:
-        return result[0]
-    else:
-        return None
+        columns["price"].append(price_number)
+        columns["currency"].append(currency)
+        columns["package_string"].append(package_string)
+        columns["size"].append(size)
+        columns["unit"].append(unit)
+        columns["price_per_unit"].append(price_per_unit)
+        columns["price_per_unit_string"].append(price_per_unit_string)
+    return columns
 
 
 def calculate_inflation_rate(current_price, previous_price):
@@ -430,6 +666,84 @@ def calculate_inflation_rate(current_price, previous_price):
     return round(inflation_rate, 3)  # Round to 3 decimal places
 
 
+# Correlated subquery instead of UPDATE ... FROM, which needs SQLite 3.33;
+# LAG() keeps the floor at 3.25 (database.MIN_SQLITE_VERSION)
+INFLATION_RECOMPUTE = """
+    WITH series AS (
+        SELECT
+            sample_id,
+            LAG(price_number) OVER (
+                PARTITION BY store_id, product_type_id, variant
+                ORDER BY date
+            ) AS previous_price
+        FROM PriceSample
+        {series_filter}
+    )
+    UPDATE PriceSample
+    SET inflation_rate = (
+        SELECT CASE
+            WHEN series.previous_price IS NULL OR series.previous_price = 0 THEN 0.0
+            ELSE ROUND(
+                (PriceSample.price_number - series.previous_price)
+                / series.previous_price * 100, 3
+            )
+        END
+        FROM series
+        WHERE series.sample_id = PriceSample.sample_id
+    )
+    WHERE sample_id IN (SELECT sample_id FROM series) AND date >= ?
+"""
+
+# Limits the LAG() window to the series listed in temp.touched_series
+TOUCHED_SERIES_FILTER = """
+        WHERE (store_id, product_type_id) IN (
+            SELECT store_id, product_type_id FROM temp.touched_series
+        )
+"""
+
+
+def recompute_inflation_rates(conn=None, since=None, series=None):
+    """Fill inflation_rate in one set-based statement, returns updated rows.
+
+    The previous price of each sample comes from LAG() over its
+    (store, product type, variant) series, same rules as
+    calculate_inflation_rate. Only rows dated since (YYYY-MM-DD) or later
+    are updated, all rows if since is None. series limits the window to
+    the given (store_id, product_type_id) pairs, so a flush reads only the
+    series it wrote to instead of the whole table. Run it without series
+    after backfills and re-extractions that insert or change older samples.
+    """
+    own_connection = conn is None
+    if own_connection:
+        conn = connect_database()
+    try:
+        series_filter = ""
+        if series is not None:
+            # Keys go through a temp table: a VALUES list of pairs could
+            # exceed SQLITE_MAX_VARIABLE_NUMBER on large batches
+            conn.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS touched_series ("
+                "store_id INTEGER, product_type_id INTEGER, "
+                "PRIMARY KEY (store_id, product_type_id))"
+            )
+            conn.execute("DELETE FROM temp.touched_series")
+            conn.executemany(
+                "INSERT OR IGNORE INTO temp.touched_series VALUES (?, ?)", series
+            )
+            series_filter = TOUCHED_SERIES_FILTER
+        # cursor.rowcount is -1 for statements starting with WITH
+        changes = conn.total_changes
+        conn.execute(
+            INFLATION_RECOMPUTE.format(series_filter=series_filter), (since or "",)
+        )
+        if own_connection:
+            conn.commit()
+        return conn.total_changes - changes
+    finally:
+        if own_connection:
+            conn.close()
+
+
 def get_current_date_string():
     """Get current date as string in YYYY-MM-DD format"""
     now = datetime.now()
@@ -437,91 +751,99 @@ def get_current_date_string():
     return date_string
 
 
-def save_to_database(
-    store_name,
-    country_name,
-    product_name,
-    variant,
-    full_name,
-    full_price_string,
-    currency_map,
-):
-    """Save extracted data to database"""
-    # Check if product title or price is empty
-    if not full_name or not full_name.strip():
-        print(
-            f"✗ Skipping save: Product title is empty for {store_name} - {product_name} ({variant})"
-        )
-        return
-
-    if not full_price_string or not full_price_string.strip():
-        print(
-            f"✗ Skipping save: Product price is empty for {store_name} - {product_name} ({variant})"
-        )
-        return
-
-    # Get or create store and product type IDs
-    store_id = get_or_create_store(store_name, country_name)
-    product_type_id = get_or_create_product_type(product_name)
+PRICE_SAMPLE_INSERT = """
+    INSERT OR REPLACE INTO PriceSample (
+        store_id, product_type_id, date, variant, full_name,
+        full_price_string, price_number, price_currency,
+        package_size_string, package_size_number, package_unit,
+        price_per_unit_string, price_per_unit_number, inflation_rate
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
 
-    # Extract price information using currency_map
-    price_number, price_currency = extract_price_info(full_price_string, currency_map)
 
-    # print(f"Currency map for {store_name}: {currency_map}")
-    # print(f"Extracted price: {price_number}, currency: {price_currency}")
+class PriceSampleWriter:
+    """Buffered PriceSample writer holding a single WAL connection.
 
-    # Extract package information
-    package_string, package_size, package_unit = extract_package_info(full_name)
+    Rows are collected by add() and written with one executemany and one
+    commit per batch_size rows (and on flush/close), instead of a separate
+    connection and commit per lookup and per row. Inflation rates are
+    filled in set-based on flush, not with a query per row. Store and ProductType
+    rows created on the way are committed together with the batch.
 
-    # Calculate price per unit
-    price_per_unit_string, price_per_unit_number = calculate_price_per_unit(
-        price_number, package_size, package_unit, price_currency
-    )
+        with PriceSampleWriter() as writer:
+            writer.add(store, country, product, variant, title, price, currency_map)
+    """
 
-    # Get previous price for inflation calculation
-    previous_price = get_previous_price(store_id, product_type_id, variant)
-    inflation_rate = calculate_inflation_rate(price_number, previous_price)
-
-    # --- Added validation checks ---
-    # Check for empty or invalid numeric values
-    if (
-        not full_name.strip()
-        or not full_price_string.strip()
-        or not package_string.strip()
-        or not price_per_unit_string.strip()
-        or price_number <= 0
-        or package_size <= 0
-        or price_per_unit_number <= 0
-        or not isinstance(price_number, (int, float))
-        or not isinstance(package_size, (int, float))
-        or not isinstance(price_per_unit_number, (int, float))
-        or not package_unit
-        or not package_unit.strip()
+    def __init__(
+        self, database_file=None, batch_size=WRITER_BATCH_SIZE, identity_map=None
     ):
-        print(
-            f"✗ Skipping save: Invalid or incomplete data for {store_name} - {product_name} ({variant})"
+        self.database_file = database_file or DATABASE_FILE
+        self.batch_size = batch_size
+        self.conn = connect_database(self.database_file)
+        self.identity_map = identity_map or get_identity_map(self.database_file)
+        self.rows = []
+        self.saved_count = 0
+
+    def add(
+        self,
+        store_name,
+        country_name,
+        product_name,
+        variant,
+        full_name,
+        full_price_string,
+        currency_map,
+    ):
+        """Validate and buffer one sample, returns True if it was accepted"""
+        # Check if product title or price is empty
+        if not full_name or not full_name.strip():
+            print(
+                f"✗ Skipping save: Product title is empty for {store_name} - {product_name} ({variant})"
+            )
+            return False
+
+        if not full_price_string or not full_price_string.strip():
+            print(
+                f"✗ Skipping save: Product price is empty for {store_name} - {product_name} ({variant})"
+            )
+            return False
+
+        # Get or create store and product type IDs
+        store_id = self.identity_map.store_id(store_name, country_name, self.conn)
+        product_type_id = self.identity_map.product_type_id(product_name, self.conn)
+
+        # Extract price information using currency_map
+        price_number, price_currency = extract_price_info(
+            full_price_string, currency_map
         )
-        return
-    # --- End of added checks ---
+        print(f"Price number to database: {price_number}")
 
-    # Get current date as string
-    current_date_string = get_current_date_string()
-    # print(f"Current date: {current_date_string}")
+        # Extract package information
+        package_string, package_size, package_unit = extract_package_info(full_name)
 
-    # Insert into database
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute(
-            """
-            INSERT OR REPLACE INTO PriceSample (
-                store_id, product_type_id, date, variant, full_name,
-                full_price_string, price_number, price_currency,
-                package_size_string, package_size_number, package_unit,
-                price_per_unit_string, price_per_unit_number, inflation_rate
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
+        # Calculate price per unit
+        price_per_unit_string, price_per_unit_number = calculate_price_per_unit(
+            price_number, package_size, package_unit, price_currency
+        )
+        print(f"Price per unit string to database: {price_per_unit_string}")
+
+        # Check for empty or invalid numeric values
+        if (
+            not package_string.strip()
+            or not price_per_unit_string.strip()
+            or price_number <= 0
+            or package_size <= 0
+            or price_per_unit_number <= 0
+            or not package_unit
+            or not package_unit.strip()
+        ):
+            print(
+                f"✗ Skipping save: Invalid or incomplete data for {store_name} - {product_name} ({variant})"
+            )
+            return False
+
+        current_date_string = get_current_date_string()
+        self.rows.append(
             (
                 store_id,
                 product_type_id,
@@ -536,97 +858,198 @@ def save_to_database(
                 package_unit,
                 price_per_unit_string,
                 price_per_unit_number,
-                inflation_rate,
-            ),
+                None,  # inflation_rate is filled by flush()
+            )
         )
-
-        conn.commit()
         print(
-            f"✓ Saved to database: {store_name} - {product_name} ({variant}) on {current_date_string}"
+            f"✓ Queued for database: {store_name} - {product_name} ({variant}) on {current_date_string}"
         )
 
-        # if inflation_rate is not None:
-        #    print(f"  Inflation rate: {inflation_rate:.2f}%")
-        # else:
-        #    print(f"  Inflation rate: N/A (first entry)")
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+        return True
 
-    except sqlite3.Error as e:
-        print(f"✗ Database error: {e}")
+    def flush(self):
+        """Write buffered rows in one transaction, returns the number written.
 
-    conn.close()
+        Inflation rates of the new rows are computed in the same transaction
+        by one recompute_inflation_rates statement. On a database error the
+        whole batch is rolled back and the error is re-raised: its rows may
+        refer to stores and product types that were rolled back with it.
+        """
+        rows, self.rows = self.rows, []
+        try:
+            with self.conn:
+                self.conn.executemany(PRICE_SAMPLE_INSERT, rows)
+                if rows:
+                    since = min(row[2] for row in rows)
+                    series = {(row[0], row[1]) for row in rows}
+                    recompute_inflation_rates(self.conn, since, series)
+        except sqlite3.Error as e:
+            print(f"✗ Database error: {e}")
+            # Stores/product types created in this batch were rolled back too
+            self.identity_map.rollback(self.conn)
+            raise
+        self.identity_map.commit(self.conn)
+        self.saved_count += len(rows)
+        return len(rows)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def save_to_database(
+    store_name,
+    country_name,
+    product_name,
+    variant,
+    full_name,
+    full_price_string,
+    currency_map,
+    writer=None,
+):
+    """Save extracted data to database.
+
+    Pass a PriceSampleWriter to batch many samples into one transaction,
+    without it the sample is written and committed right away.
+    """
+    if writer is not None:
+        return writer.add(
+            store_name,
+            country_name,
+            product_name,
+            variant,
+            full_name,
+            full_price_string,
+            currency_map,
+        )
 
+    with PriceSampleWriter(batch_size=1) as single_writer:
+        return single_writer.add(
+            store_name,
+            country_name,
+            product_name,
+            variant,
+            full_name,
+            full_price_string,
+            currency_map,
+        )
 
-def parse_config(file_path):
+
+class ConfigParseError(ValueError):
+    """A STORE entry of the config file that cannot be parsed."""
+
+    def __init__(self, line, message):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+        self.message = message
+
+
+def _config_value(numbered, index, key):
+    """Value of the `KEY = value` line at index of a STORE entry."""
+    if index >= len(numbered):
+        raise ConfigParseError(numbered[-1][0], f"missing {key} line")
+    number, line = numbered[index]
+    name, sep, value = line.partition("=")
+    if not sep or name.strip() != key:
+        raise ConfigParseError(number, f"expected '{key} = ...', got '{line}'")
+    return value.strip()
+
+
+def _parse_entry(numbered):
+    """Parses one STORE entry given as (line number, line) pairs."""
+    lines = [line for _, line in numbered]
+    entry = {"TITLE": [], "PRICE": [], "URLS": {}, "CURRENCY_MAP": {}}
+    # Line number of the STORE line, for validation messages
+    entry["LINE"] = numbered[0][0]
+    entry["STORE"] = _config_value(numbered, 0, "STORE")
+    entry["COUNTRY"] = _config_value(numbered, 1, "COUNTRY")
+    entry["PRODUCT"] = _config_value(numbered, 2, "PRODUCT")
+    i = 3
+
+    # Find TITLE section
+    while i < len(lines) and not lines[i].startswith("TITLE"):
+        i = i + 1
+    i = i + 1  # skip TITLE = [
+    while i < len(lines) and not lines[i].startswith("]"):
+        entry["TITLE"].append(lines[i])
+        i = i + 1
+    i = i + 1
+
+    # Find PRICE section
+    while i < len(lines) and not lines[i].startswith("PRICE"):
+        i = i + 1
+    i = i + 1  # skip PRICE = [
+    while i < len(lines) and not lines[i].startswith("]"):
+        entry["PRICE"].append(lines[i])
+        i = i + 1
+    i = i + 1
+
+    # Find CURRENCY_MAP section
+    while i < len(lines) and not lines[i].startswith("CURRENCY_MAP"):
+        i = i + 1
+    if i < len(lines):
+        currency_line = lines[i]
+        # Parse the currency map - format: CURRENCY_MAP = ["$": "USD"]
+        try:
+            # Extract the content between [ and ]
+            start = currency_line.find("[")
+            end = currency_line.find("]")
+            if start != -1 and end != -1:
+                currency_content = currency_line[start + 1 : end]
+                # Parse "symbol": "code" format
+                import re
+
+                matches = re.findall(r'"([^"]+)":\s*"([^"]+)"', currency_content)
+                for symbol, code in matches:
+                    entry["CURRENCY_MAP"][symbol] = code
+        except:
+            print(f"Warning: Could not parse currency map for {entry['STORE']}")
+        i = i + 1
+
+    # Find URLS section
+    while i < len(lines) and not lines[i].startswith("URLS"):
+        i = i + 1
+    i = i + 1  # skip URLS = [
+    while i < len(lines) and not lines[i].startswith("]"):
+        line = lines[i]
+        if "cheapest:" in line:
+            entry["URLS"]["cheapest"] = line.split(":", 1)[1].strip()
+        elif "most_expensive:" in line:
+            entry["URLS"]["most_expensive"] = line.split(":", 1)[1].strip()
+        i = i + 1
+    return entry
+
+
+def parse_config(file_path, errors=None):
+    """
+    Parses store configs from file_path. Each STORE entry is parsed on its
+    own: a malformed entry raises ConfigParseError or, if an errors list is
+    given, is appended to it and skipped.
+    """
     with open(file_path, "r", encoding="utf-8-sig") as f:
-        lines = [line.strip() for line in f if line.strip()]
+        numbered = [(number, line.strip()) for number, line in enumerate(f, 1)]
+    numbered = [(number, line) for number, line in numbered if line]
 
+    starts = [i for i, (_, line) in enumerate(numbered) if line.startswith("STORE")]
+    starts.append(len(numbered))
     configs = []
-    i = 0
-    while i < len(lines):
-        if lines[i].startswith("STORE"):
-            entry = {"TITLE": [], "PRICE": [], "URLS": {}, "CURRENCY_MAP": {}}
-            entry["STORE"] = lines[i].split("=", 1)[1].strip()
-            entry["COUNTRY"] = lines[i + 1].split("=", 1)[1].strip()
-            entry["PRODUCT"] = lines[i + 2].split("=", 1)[1].strip()
-            i = i + 3
-
-            # Find TITLE section
-            while i < len(lines) and not lines[i].startswith("TITLE"):
-                i = i + 1
-            i = i + 1  # skip TITLE = [
-            while i < len(lines) and not lines[i].startswith("]"):
-                entry["TITLE"].append(lines[i])
-                i = i + 1
-            i = i + 1
-
-            # Find PRICE section
-            while i < len(lines) and not lines[i].startswith("PRICE"):
-                i = i + 1
-            i = i + 1  # skip PRICE = [
-            while i < len(lines) and not lines[i].startswith("]"):
-                entry["PRICE"].append(lines[i])
-                i = i + 1
-            i = i + 1
-
-            # Find CURRENCY_MAP section
-            while i < len(lines) and not lines[i].startswith("CURRENCY_MAP"):
-                i = i + 1
-            if i < len(lines):
-                currency_line = lines[i]
-                # Parse the currency map - format: CURRENCY_MAP = ["$": "USD"]
-                try:
-                    # Extract the content between [ and ]
-                    start = currency_line.find("[")
-                    end = currency_line.find("]")
-                    if start != -1 and end != -1:
-                        currency_content = currency_line[start + 1 : end]
-                        # Parse "symbol": "code" format
-                        import re
-
-                        matches = re.findall(
-                            r'"([^"]+)":\s*"([^"]+)"', currency_content
-                        )
-                        for symbol, code in matches:
-                            entry["CURRENCY_MAP"][symbol] = code
-                except:
-                    print(f"Warning: Could not parse currency map for {entry['STORE']}")
-                i = i + 1
-
-            # Find URLS section
-            while i < len(lines) and not lines[i].startswith("URLS"):
-                i = i + 1
-            i = i + 1  # skip URLS = [
-            while i < len(lines) and not lines[i].startswith("]"):
-                line = lines[i]
-                if "cheapest:" in line:
-                    entry["URLS"]["cheapest"] = line.split(":", 1)[1].strip()
-                elif "most_expensive:" in line:
-                    entry["URLS"]["most_expensive"] = line.split(":", 1)[1].strip()
-                i = i + 1
-            i = i + 1
-            configs.append(entry)
-        else:
-            i = i + 1
+    for start, end in zip(starts, starts[1:]):
+        try:
+            configs.append(_parse_entry(numbered[start:end]))
+        except ConfigParseError as error:
+            if errors is None:
+                raise
+            errors.append(error)
     return configs
 
 
@@ -650,13 +1073,17 @@ def check_element_attributes(element, required_attrs):
     return True
 
 
-def find_matching_element(page_soup, template_element):
+def iter_matching_elements(page_soup, template_element):
+    """Yield every element under page_soup (itself included) matching the template"""
     tag_name = template_element.name
     required_attrs = template_element.attrs
 
     ##print(f"Looking for {tag_name} with attributes: {required_attrs}")
 
     candidates = page_soup.find_all(tag_name)
+    # When searching inside a product tile the tile itself may be the match
+    if page_soup.name == tag_name:
+        candidates.insert(0, page_soup)
     ##print(f"Found {len(candidates)} {tag_name} elements in page")
 
     template_text = template_element.get_text().strip()
@@ -671,7 +1098,12 @@ def find_matching_element(page_soup, template_element):
         # Check if candidate text contains prefix, or accept if prefix empty
         if prefix == "" or prefix.lower() in candidate_text.lower():
             ##print(f"Found matching element: {candidate}")
-            return candidate
+            yield candidate
+
+
+def find_matching_element(page_soup, template_element):
+    for candidate in iter_matching_elements(page_soup, template_element):
+        return candidate
 
     print("No matching element found")
     return None
@@ -748,8 +1180,14 @@ def extract_text_from_element(element, template_element):
     return element_text
 
 
-def extract_data_from_template(template_lines, page_html):
-    """Extract data from page using template"""
+def parse_template(template_lines):
+    """Parse TITLE/PRICE template lines into a BeautifulSoup tree.
+
+    An already parsed template is returned as is, so callers can parse a
+    template once and reuse it for many pages.
+    """
+    if isinstance(template_lines, BeautifulSoup):
+        return template_lines
     template_html = "\n".join(template_lines)
     # print(f"Template HTML: {template_html}")
 
@@ -759,8 +1197,19 @@ def extract_data_from_template(template_lines, page_html):
     ):
         template_html = "<a " + template_html
 
-    template_soup = BeautifulSoup(template_html, "html.parser")
-    page_soup = BeautifulSoup(page_html, "html.parser")
+    return BeautifulSoup(template_html, "html.parser")
+
+
+def extract_data_from_template(template_lines, page_html):
+    """Extract data from page using template.
+
+    page_html may be raw HTML or an already parsed element (e.g. a product tile).
+    """
+    template_soup = parse_template(template_lines)
+    if isinstance(page_html, str):
+        page_soup = BeautifulSoup(page_html, "html.parser")
+    else:
+        page_soup = page_html
 
     extracted_parts = []
     processed_elements = []
@@ -856,6 +1305,63 @@ def extract_data_from_template(template_lines, page_html):
     return final_result
 
 
+def find_product_tiles(page_soup, template_element):
+    """Find one container element per product on a listing page.
+
+    Every element matching the template is climbed up to its highest ancestor
+    that contains no other match - that ancestor is the product tile.
+    """
+    matches = list(iter_matching_elements(page_soup, template_element))
+
+    # Keep only the outermost matches (nested tags can match the same template)
+    match_ids = {id(match) for match in matches}
+    anchors = [
+        match
+        for match in matches
+        if not any(id(parent) in match_ids for parent in match.parents)
+    ]
+
+    # Count how many anchors every ancestor contains
+    anchor_counts = {}
+    for anchor in anchors:
+        for parent in anchor.parents:
+            anchor_counts[id(parent)] = anchor_counts.get(id(parent), 0) + 1
+
+    tiles = []
+    for anchor in anchors:
+        tile = anchor
+        while tile.parent is not None and anchor_counts.get(id(tile.parent)) == 1:
+            tile = tile.parent
+        tiles.append(tile)
+    return tiles
+
+
+def extract_listing_from_template(title_lines, price_lines, page_html):
+    """Extract every product (title and price pair) from a listing page.
+
+    The first TITLE template element containing FFF is used to locate product
+    tiles, then TITLE and PRICE templates are applied inside each tile.
+    Tiles without a title or a price are skipped.
+    """
+    template_soup = parse_template(title_lines)
+    anchor_template = None
+    for template_element in template_soup.find_all():
+        if "FFF" in template_element.decode():
+            anchor_template = template_element
+            break
+    if anchor_template is None:
+        return []
+
+    page_soup = BeautifulSoup(page_html, "html.parser")
+    products = []
+    for tile in find_product_tiles(page_soup, anchor_template):
+        title = extract_data_from_template(title_lines, tile)
+        price = extract_data_from_template(price_lines, tile)
+        if title and price:
+            products.append({"full_name": title, "full_price": price})
+    return products
+
+
 def main():
     if not os.path.exists(CONFIG_FILE):
         print(f"Error: '{CONFIG_FILE}' not found in current directory.")
@@ -866,61 +1372,79 @@ def main():
     create_database()
     print(f"Database '{DATABASE_FILE}' ready.")
 
-    configs = parse_config(CONFIG_FILE)
+    parse_errors = []
+    configs = parse_config(CONFIG_FILE, parse_errors)
+    for error in parse_errors:
+        print(f"Warning: skipping malformed entry in {CONFIG_FILE}, {error}")
     print(f"Loaded {len(configs)} store configurations\n")
 
-    for config in configs:
-        print(f"{'='*50}")
-        print(
-            f"Processing: {config['STORE']} - {config['PRODUCT']} ({config['COUNTRY']})"
-        )
-
-        for variant in ["cheapest", "most_expensive"]:
-            url = config["URLS"].get(variant)
-            if url:
-                print(f"\nProcessing {variant} variant: {url}")
-
-                # Fetch HTML from URL using Selenium
-                # print("Fetching webpage...")
-                page_html = fetch_page_selenium(url)
-
-                # Saves Selenium output into HTML file on localdisk
-                # save_html_to_file(page_html, config['STORE'], variant)
-
-                # print("\n--- Extracting TITLE ---")
-                product_title = extract_data_from_template(config["TITLE"], page_html)
-
-                # print("\n--- Extracting PRICE ---")
-                product_price = extract_data_from_template(config["PRICE"], page_html)
-
-                # Show results
-                print(f"\n=== RESULTS for {config['STORE']} ({variant}) ===")
-                print(f"Store Name: {config['STORE']}")
-                print(f"Country: {config['COUNTRY']}")
-                print(f"Product Name: {config['PRODUCT']}")
-                print(f"Product Variant: {variant}")
-                print(f"Full Product Title: {product_title}")
-                print(f"Full Price: {product_price}")
-
-                # Save to database
-                # print(f"\n--- Saving to Database ---")
-                save_to_database(
-                    config["STORE"],
-                    config["COUNTRY"],
-                    config["PRODUCT"],
-                    variant,
-                    product_title,
-                    product_price,
-                    config["CURRENCY_MAP"],
-                )
-
-                print("-" * 50)
-            else:
-                print(f"No URL provided for {variant}")
-
-    print(f"\nScraping completed. Data saved to '{DATABASE_FILE}'.")
+    # One connection and a handful of commits for the whole run; buffered
+    # rows are flushed and the connection closed even if a page fails
+    with PriceSampleWriter() as writer:
+        for config in configs:
+            print(f"{'='*50}")
+            print(
+                f"Processing: {config['STORE']} - {config['PRODUCT']} ({config['COUNTRY']})"
+            )
+
+            for variant in ["cheapest", "most_expensive"]:
+                url = config["URLS"].get(variant)
+                if url:
+                    print(f"\nProcessing {variant} variant: {url}")
+
+                    # Fetch HTML from URL using Selenium
+                    # print("Fetching webpage...")
+                    page_html = fetch_page_selenium(url)
+
+                    # Saves Selenium output into HTML file on localdisk
+                    # save_html_to_file(page_html, config['STORE'], variant)
+
+                    # print("\n--- Extracting TITLE ---")
+                    product_title = extract_data_from_template(
+                        config["TITLE"], page_html
+                    )
+
+                    # print("\n--- Extracting PRICE ---")
+                    product_price = extract_data_from_template(
+                        config["PRICE"], page_html
+                    )
+
+                    # Show results
+                    print(f"\n=== RESULTS for {config['STORE']} ({variant}) ===")
+                    print(f"Store Name: {config['STORE']}")
+                    print(f"Country: {config['COUNTRY']}")
+                    print(f"Product Name: {config['PRODUCT']}")
+                    print(f"Product Variant: {variant}")
+                    print(f"Full Product Title: {product_title}")
+                    print(f"Full Price: {product_price}")
+
+                    # Save to database
+                    # print(f"\n--- Saving to Database ---")
+                    save_to_database(
+                        config["STORE"],
+                        config["COUNTRY"],
+                        config["PRODUCT"],
+                        variant,
+                        product_title,
+                        product_price,
+                        config["CURRENCY_MAP"],
+                        writer=writer,
+                    )
+
+                    print("-" * 50)
+                else:
+                    print(f"No URL provided for {variant}")
+
+    print(
+        f"\nScraping completed. {writer.saved_count} samples saved to '{DATABASE_FILE}'."
+    )
 
 
 if __name__ == "__main__":
-    main()
+    if "--recompute-inflation" in sys.argv:
+        # After backfills/re-extractions: refill inflation_rate for all rows
+        create_database()
+        print(f"Inflation rate recomputed for {recompute_inflation_rates()} samples")
+    else:
+        main()
     sys.exit()
@@ -0,0 +1,270 @@
+"""
+Structured product data extraction (JSON-LD, __NEXT_DATA__, microdata).
+
+Many stores embed product data for search engines or for client-side
+hydration. Reading it is much faster and less fragile than matching the
+TITLE/PRICE HTML templates, so it is tried first and the template matcher
+is only used as a fallback.
+
+Each record carries a "type": "Product" for a schema.org Product node that
+describes the page itself, "ListItem" for products inside an ItemList
+(listing tiles, related products) and "" for hydration state entries that
+only look like products. Product pages use main_product() to pick the page's
+own product instead of whatever comes first.
+"""
+
+import json
+import re
+
+from bs4 import BeautifulSoup
+
+JSON_LD_PATTERN = re.compile(
+    r"<script[^>]*type=[\"']application/ld\+json[\"'][^>]*>(.*?)</script>",
+    re.IGNORECASE | re.DOTALL,
+)
+NEXT_DATA_PATTERN = re.compile(
+    r"<script[^>]*id=[\"']__NEXT_DATA__[\"'][^>]*>(.*?)</script>",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# Keys used by hydration state for product names and prices
+NAME_KEYS = ("name", "productName", "title")
+PRICE_KEYS = ("price", "currentPrice", "priceInfo", "salePrice")
+# Generic keys only accepted inside an already found price object
+NESTED_PRICE_KEYS = PRICE_KEYS + ("value", "amount", "lowPrice")
+CURRENCY_KEYS = ("priceCurrency", "currency", "currencyCode", "currencyUnit")
+# Keys holding the package size, appended to the title for unit price parsing
+SIZE_KEYS = ("size", "weight", "packageSize", "netContent")
+
+# Hydration state can be very deep, stop walking past this level
+MAX_DEPTH = 25
+
+
+def _to_number(value):
+    """Convert a structured data price (number or canonical string) to float"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        cleaned = re.sub(r"[^\d.]", "", value.replace(",", "."))
+        # Canonical values use a single decimal dot
+        if cleaned and cleaned.count(".") <= 1:
+            try:
+                return float(cleaned)
+            except ValueError:
+                return None
+    return None
+
+
+def _find_price(value, depth=0):
+    """Return (price, currency) from a price value, nested price dict or offer"""
+    if depth > 3:
+        return None, ""
+    if isinstance(value, dict):
+        currency = ""
+        for key in CURRENCY_KEYS:
+            if isinstance(value.get(key), str):
+                currency = value[key]
+                break
+        for key in NESTED_PRICE_KEYS:
+            if key in value:
+                price, nested_currency = _find_price(value[key], depth + 1)
+                if price is not None:
+                    return price, currency or nested_currency
+        return None, ""
+    if isinstance(value, list):
+        for item in value:
+            price, currency = _find_price(item, depth + 1)
+            if price is not None:
+                return price, currency
+        return None, ""
+    return _to_number(value), ""
+
+
+def _size_text(value):
+    """Return package size text from a string or a QuantitativeValue dict"""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        number = value.get("value")
+        unit = value.get("unitText") or value.get("unitCode") or ""
+        if number is not None:
+            return f"{number} {unit}".strip()
+    return ""
+
+
+def _record(full_name, price, currency, kind=""):
+    return {
+        "full_name": full_name,
+        "full_price": f"{price} {currency}".strip(),
+        "price": price,
+        "currency": currency,
+        "type": kind,
+    }
+
+
+def _make_record(name, price, currency, data, kind=""):
+    """Build a product record, appending package size to the title if known"""
+    full_name = " ".join(name.split())
+    for key in SIZE_KEYS:
+        size = _size_text(data.get(key))
+        if size and size not in full_name:
+            full_name = f"{full_name}, {size}"
+            break
+    return _record(full_name, price, currency, kind)
+
+
+def _is_product_type(data):
+    types = data.get("@type", "")
+    if isinstance(types, str):
+        types = [types]
+    return "Product" in types or data.get("__typename") == "Product"
+
+
+def _walk_json_ld(data, records, depth=0, listed=False):
+    """Collect Product nodes from JSON-LD (including ItemList and @graph)"""
+    if depth > MAX_DEPTH:
+        return
+    if isinstance(data, list):
+        for item in data:
+            _walk_json_ld(item, records, depth + 1, listed)
+        return
+    if not isinstance(data, dict):
+        return
+
+    if _is_product_type(data) and isinstance(data.get("name"), str):
+        price, currency = _find_price(data.get("offers"))
+        if price is not None:
+            kind = "ListItem" if listed else "Product"
+            records.append(_make_record(data["name"], price, currency, data, kind))
+        return
+
+    for key in ("@graph", "mainEntity"):
+        if key in data:
+            _walk_json_ld(data[key], records, depth + 1, listed)
+    for key in ("itemListElement", "item"):
+        if key in data:
+            _walk_json_ld(data[key], records, depth + 1, True)
+
+
+def _walk_next_data(data, records, depth=0):
+    """Collect dicts that look like products from Next.js hydration state"""
+    if depth > MAX_DEPTH:
+        return
+    if isinstance(data, list):
+        for item in data:
+            _walk_next_data(item, records, depth + 1)
+        return
+    if not isinstance(data, dict):
+        return
+
+    name = next(
+        (data[key] for key in NAME_KEYS if isinstance(data.get(key), str)), None
+    )
+    if name:
+        for key in PRICE_KEYS:
+            if key in data:
+                price, currency = _find_price(data[key])
+                if price is not None:
+                    if not currency:
+                        currency = next(
+                            (
+                                data[k]
+                                for k in CURRENCY_KEYS
+                                if isinstance(data.get(k), str)
+                            ),
+                            "",
+                        )
+                    kind = "Product" if _is_product_type(data) else ""
+                    records.append(_make_record(name, price, currency, data, kind))
+                    return
+
+    for value in data.values():
+        if isinstance(value, (dict, list)):
+            _walk_next_data(value, records, depth + 1)
+
+
+def extract_json_ld(page_html):
+    """Extract products from application/ld+json blocks"""
+    records = []
+    for block in JSON_LD_PATTERN.findall(page_html):
+        try:
+            data = json.loads(block.strip())
+        except ValueError:
+            continue
+        _walk_json_ld(data, records)
+    return records
+
+
+def extract_next_data(page_html):
+    """Extract products from the __NEXT_DATA__ hydration state"""
+    match = NEXT_DATA_PATTERN.search(page_html)
+    if not match:
+        return []
+    try:
+        data = json.loads(match.group(1).strip())
+    except ValueError:
+        return []
+    records = []
+    _walk_next_data(data, records)
+    return records
+
+
+def _itemprop_value(element):
+    return element.get("content") or element.get_text(strip=True)
+
+
+def extract_microdata(page_html):
+    """Extract products marked up with schema.org itemprop attributes"""
+    # Parsing the page is the expensive part, skip pages without microdata
+    if "itemprop" not in page_html:
+        return []
+
+    soup = BeautifulSoup(page_html, "html.parser")
+    records = []
+    for scope in soup.find_all(itemtype=re.compile(r"schema\.org/Product")):
+        name_element = scope.find(itemprop="name")
+        price_element = scope.find(itemprop="price")
+        if not name_element or not price_element:
+            continue
+        price = _to_number(_itemprop_value(price_element))
+        if price is None:
+            continue
+        currency_element = scope.find(itemprop="priceCurrency")
+        currency = _itemprop_value(currency_element) if currency_element else ""
+        full_name = " ".join(_itemprop_value(name_element).split())
+        listed = scope.find_parent(itemtype=re.compile(r"schema\.org/ItemList"))
+        kind = "ListItem" if listed else "Product"
+        records.append(_record(full_name, price, currency, kind))
+    return records
+
+
+def extract_structured_products(page_html):
+    """Extract products from structured data, trying the cheapest sources first.
+
+    Returns a list of {"full_name", "full_price", "price", "currency", "type"}
+    dicts in page order, or an empty list when the page has no usable
+    structured data.
+    """
+    if not page_html:
+        return []
+
+    for extractor in (extract_json_ld, extract_next_data, extract_microdata):
+        records = extractor(page_html)
+        # Drop duplicates (the same product is often repeated in the state)
+        unique = []
+        seen = set()
+        for record in records:
+            key = (record["full_name"], record["price"])
+            if key not in seen and record["full_name"] and record["price"] > 0:
+                seen.add(key)
+                unique.append(record)
+        if unique:
+            return unique
+    return []
+
+
+def main_product(records):
+    """The page's own Product record, None if the page only lists products"""
+    return next((record for record in records if record["type"] == "Product"), None)
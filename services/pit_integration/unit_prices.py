@@ -0,0 +1,171 @@
+"""
+Vectorised unit price computation for large result batches.
+
+Units are encoded as small ints that index conversion factor and base label
+lookup arrays, so price/size division and rounding run in NumPy instead of
+one dict lookup per item. Results are identical to
+store_productscraper.calculate_price_per_unit (see the benchmark below).
+"""
+
+import numpy as np
+
+try:
+    from .store_productscraper import (
+        UNIT_BASE_LABELS,
+        UNIT_PATTERNS,
+        calculate_price_per_unit,
+        extract_package_info,
+        extract_price_info,
+    )
+except ImportError:  # run as a script: python unit_prices.py
+    from store_productscraper import (
+        UNIT_BASE_LABELS,
+        UNIT_PATTERNS,
+        calculate_price_per_unit,
+        extract_package_info,
+        extract_price_info,
+    )
+
+UNKNOWN_UNIT = -1
+
+UNIT_CODES = {unit: code for code, unit in enumerate(UNIT_PATTERNS)}
+CONVERSION_FACTORS = np.array(list(UNIT_PATTERNS.values()), dtype=np.float64)
+
+BASE_LABELS = sorted(set(UNIT_BASE_LABELS.values()))
+BASE_LABEL_CODES = np.array(
+    [BASE_LABELS.index(UNIT_BASE_LABELS[unit]) for unit in UNIT_PATTERNS],
+    dtype=np.int8,
+)
+
+
+def encode_units(units):
+    """Encode unit strings as int8 codes, UNKNOWN_UNIT for unknown or empty"""
+    return np.fromiter(
+        (UNIT_CODES.get(unit, UNKNOWN_UNIT) for unit in units),
+        dtype=np.int8,
+        count=len(units),
+    )
+
+
+def _round_like_python(values, ndigits=2):
+    """Round like the builtin round(), which is exact for half-way decimals.
+
+    np.round scales by 10**ndigits first, which can move a value across the
+    .5 boundary. Only values that land next to the boundary are re-rounded
+    with the builtin, everything else is already identical.
+    """
+    scale = 10.0**ndigits
+    scaled = values * scale
+    rounded = np.rint(scaled) / scale
+
+    distance = np.abs(np.abs(scaled - np.floor(scaled)) - 0.5)
+    ambiguous = np.flatnonzero(distance <= 4 * np.spacing(np.abs(scaled)))
+    for index in ambiguous:
+        rounded[index] = round(float(values[index]), ndigits)
+    return rounded
+
+
+def calculate_price_per_unit_array(prices, sizes, unit_codes):
+    """Calculate price per standard unit for whole arrays.
+
+    Returns (price_per_unit, base_label_codes). Invalid rows (zero size,
+    unknown unit) get 0.0 and UNKNOWN_UNIT, like the scalar function.
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    unit_codes = np.asarray(unit_codes, dtype=np.int8)
+
+    known = unit_codes != UNKNOWN_UNIT
+    lookup = np.where(known, unit_codes, 0)
+    standard_sizes = sizes * np.where(known, CONVERSION_FACTORS[lookup], 0.0)
+    valid = known & (sizes != 0) & (standard_sizes != 0)
+
+    price_per_unit = np.zeros(len(prices), dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        price_per_unit[valid] = _round_like_python(
+            prices[valid] / standard_sizes[valid]
+        )
+
+    label_codes = np.where(valid, BASE_LABEL_CODES[lookup], UNKNOWN_UNIT)
+    return price_per_unit, label_codes.astype(np.int8)
+
+
+def format_price_per_unit(price_per_unit, label_codes, currencies):
+    """Build price_per_unit strings ('3.50 USD/kg'), '' for invalid rows"""
+    return [
+        f"{value:.2f} {currency}/{BASE_LABELS[code]}" if code != UNKNOWN_UNIT else ""
+        for value, code, currency in zip(
+            price_per_unit.tolist(), label_codes.tolist(), currencies
+        )
+    ]
+
+
+def normalize_arrays(rows):
+    """Normalise (price_string, title, currency_map) rows into NumPy columns.
+
+    String parsing uses the memoized scalar parsers, the unit price maths
+    runs vectorised. Returns a dict with price, currency, size, unit,
+    unit_code, price_per_unit and price_per_unit_string columns.
+    """
+    prices, currencies, sizes, units = [], [], [], []
+    for price_string, title, currency_map in rows:
+        price, currency = extract_price_info(price_string, currency_map)
+        _, size, unit = extract_package_info(title)
+        prices.append(price)
+        currencies.append(currency)
+        sizes.append(size)
+        units.append(unit)
+
+    unit_codes = encode_units(units)
+    price_per_unit, label_codes = calculate_price_per_unit_array(
+        prices, sizes, unit_codes
+    )
+    return {
+        "price": np.array(prices, dtype=np.float64),
+        "currency": currencies,
+        "size": np.array(sizes, dtype=np.float64),
+        "unit": units,
+        "unit_code": unit_codes,
+        "price_per_unit": price_per_unit,
+        "price_per_unit_string": format_price_per_unit(
+            price_per_unit, label_codes, currencies
+        ),
+    }
+
+
+if __name__ == "__main__":
+    # Benchmark: scalar vs vectorised unit prices, results must be identical
+    import time
+
+    rows_count = 500_000
+    rng = np.random.default_rng(42)
+    units = list(UNIT_PATTERNS) + ["", "box"]
+    prices = np.round(rng.uniform(0.1, 500.0, rows_count), 2)
+    sizes = rng.choice(
+        [0, 0.25, 0.5, 1, 1.5, 2, 10, 14, 24, 400, 500, 1000], rows_count
+    )
+    unit_list = [units[i] for i in rng.integers(0, len(units), rows_count)]
+
+    price_list = prices.tolist()
+    size_list = sizes.tolist()
+
+    started = time.perf_counter()
+    scalar = [
+        calculate_price_per_unit(price, size, unit, "USD")
+        for price, size, unit in zip(price_list, size_list, unit_list)
+    ]
+    scalar_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    codes = encode_units(unit_list)
+    vector, labels = calculate_price_per_unit_array(prices, sizes, codes)
+    vector_time = time.perf_counter() - started
+
+    strings = format_price_per_unit(vector, labels, ["USD"] * rows_count)
+    assert [value for _, value in scalar] == vector.tolist()
+    assert [string for string, _ in scalar] == strings
+
+    print(f"Rows: {rows_count}")
+    print(f"Scalar:     {scalar_time:.3f} s")
+    print(f"Vectorised: {vector_time:.3f} s ({scalar_time / vector_time:.1f}x)")
+    print("Results are identical")
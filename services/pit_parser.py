@@ -6,32 +6,26 @@
 import asyncio
 import logging
 import os
-import sys
-from pathlib import Path
 
-# Добавляем путь к модулям PIT
-sys.path.insert(0, str(Path(__file__).parent / "pit_integration"))
+import config as app_config
+from services.pit_config import load_configs
+from services.pit_integration import store_productscraper, structured_data
 
 logger = logging.getLogger(__name__)
 
-# Константы
-CONFIG_PATH = Path(__file__).parent / "pit_integration" / "store_config.txt"
 
-
-async def parse_config_async():
+async def parse_config_async(store_filter=None, product_filter=None):
     """
-    Асинхронно загружает конфигурацию магазинов из файла.
-    Возвращает список конфигураций в формате словаря.
+    Асинхронно загружает конфигурацию магазинов из БД или из файла.
+    Возвращает список конфигураций в формате словаря, отфильтрованный
+    по магазинам и продуктам (в БД - SQL-запросом).
+    Файл разбирается заново только после его изменения (см. pit_config).
     """
-
-    # Синхронную операцию чтения файла выполняем в отдельном потоке
-    def load_config():
-        from store_productscraper import parse_config
-
-        return parse_config(str(CONFIG_PATH))
-
+    # Запрос к БД или проверку изменений файла выполняем в отдельном потоке
     loop = asyncio.get_event_loop()
-    configs = await loop.run_in_executor(None, load_config)
+    configs = await loop.run_in_executor(
+        None, load_configs, store_filter, product_filter
+    )
     logger.info(f"Загружено {len(configs)} конфигураций магазинов")
     return configs
 
@@ -44,14 +38,13 @@ async def fetch_page_async(url, use_selenium=True):
         use_selenium (bool): если True, использует Selenium; иначе requests.
     Возвращает HTML (str) или None при ошибке.
     """
-    from store_productscraper import fetch_page_requests, fetch_page_selenium
 
     def fetch():
         if use_selenium:
-            return fetch_page_selenium(url)
+            return store_productscraper.fetch_page_selenium(url)
         else:
             # fetch_page_requests возвращает BeautifulSoup, преобразуем в HTML
-            soup = fetch_page_requests(url)
+            soup = store_productscraper.fetch_page_requests(url)
             return str(soup) if soup else None
 
     loop = asyncio.get_event_loop()
@@ -63,16 +56,79 @@ async def fetch_page_async(url, use_selenium=True):
         return None
 
 
+def build_result(config, variant, title, price, price_number=None, currency=None):
+    """
+    Нормализует извлечённые заголовок и цену в словарь результата:
+    числовая цена и валюта, размер упаковки и цена за единицу.
+    price_number и currency передаются, если они уже известны
+    (например, из структурированных данных страницы).
+    """
+    currency_map = config.get("CURRENCY_MAP", {})
+    if price_number is None:
+        # Извлекаем числовую цену и валюту
+        price_number, currency = store_productscraper.extract_price_info(
+            price, currency_map
+        )
+    elif not currency:
+        currency = next(iter(currency_map.values()), "")
+    # Извлекаем размер упаковки
+    (
+        package_string,
+        package_size,
+        package_unit,
+    ) = store_productscraper.extract_package_info(title)
+    # Вычисляем цену за единицу
+    (
+        price_per_unit_string,
+        price_per_unit_number,
+    ) = store_productscraper.calculate_price_per_unit(
+        price_number, package_size, package_unit, currency
+    )
+
+    return make_result(
+        config,
+        variant,
+        title,
+        price,
+        {
+            "price": price_number,
+            "currency": currency,
+            "size": package_size,
+            "unit": package_unit,
+            "price_per_unit": price_per_unit_number,
+            "price_per_unit_string": price_per_unit_string,
+        },
+    )
+
+
+def make_result(config, variant, title, price, normalized):
+    """Собирает словарь результата из нормализованных значений цены и упаковки."""
+    return {
+        "store": config["STORE"],
+        "country": config["COUNTRY"],
+        "product_name": config["PRODUCT"],
+        "product_type": config["PRODUCT"],
+        "variant": variant,
+        "full_name": title,
+        "full_price": price,
+        "price": normalized["price"],
+        "currency": normalized["currency"],
+        "unit_size": normalized["size"],
+        "unit_type": normalized["unit"],
+        "price_per_unit": normalized["price_per_unit"],
+        "price_per_unit_string": normalized["price_per_unit_string"],
+        "external_id": None,  # можно сгенерировать хэш
+    }
+
+
 async def extract_product_data_async(config, variant="cheapest"):
     """
     Извлекает данные о продукте для заданной конфигурации и варианта.
     Возвращает словарь с полями:
-        store, country, product_name, variant, full_name, full_price,
-        price, unit_size, unit_type, price_per_unit, external_id
+        store, country, product_name, product_type, variant, full_name,
+        full_price, price, unit_size, unit_type, price_per_unit, external_id
     Если данные не найдены, возвращает None.
     """
-    from store_productscraper import extract_data_from_template
-
     url = config["URLS"].get(variant)
     if not url:
         logger.warning(
@@ -85,19 +141,32 @@ async def extract_product_data_async(config, variant="cheapest"):
     if not html:
         return None
 
-    # Извлекаем заголовок и цену по шаблону
+    # Сначала ищем структурированные данные, шаблоны TITLE/PRICE - запасной путь
     def extract():
-        title = extract_data_from_template(config["TITLE"], html)
-        price = extract_data_from_template(config["PRICE"], html)
-        return title, price
+        structured = structured_data.extract_structured_products(html)
+        # Узел @type Product самой страницы, а не первый товар из блоков
+        # "похожие товары" или состояния гидратации
+        product = structured_data.main_product(structured)
+        if product:
+            return product
+        return {
+            "full_name": store_productscraper.extract_data_from_template(
+                config.get("TITLE_TEMPLATE", config["TITLE"]), html
+            ),
+            "full_price": store_productscraper.extract_data_from_template(
+                config.get("PRICE_TEMPLATE", config["PRICE"]), html
+            ),
+        }
 
     loop = asyncio.get_event_loop()
     try:
-        title, price = await loop.run_in_executor(None, extract)
+        item = await loop.run_in_executor(None, extract)
     except Exception as e:
         logger.error(f"Ошибка извлечения данных для {config['STORE']}: {e}")
         return None
 
+    title = item["full_name"]
+    price = item["full_price"]
     # Если нет данных, пропускаем
     if not title or not price:
         logger.warning(
@@ -106,71 +175,114 @@ async def extract_product_data_async(config, variant="cheapest"):
         return None
 
     # Извлекаем информацию об упаковке и рассчитываем цену за единицу
-    # Используем функции из store_productscraper
-    from store_productscraper import (
-        UNIT_BASE_LABELS,
-        calculate_price_per_unit,
-        extract_package_info,
-        extract_price_info,
-    )
-
-    # Извлекаем числовую цену и валюту
-    price_number, currency = extract_price_info(price, config.get("CURRENCY_MAP", {}))
-    # Извлекаем размер упаковки
-    package_string, package_size, package_unit = extract_package_info(title)
-    # Вычисляем цену за единицу
-    price_per_unit_string, price_per_unit_number = calculate_price_per_unit(
-        price_number, package_size, package_unit, currency
+    result = build_result(
+        config, variant, title, price, item.get("price"), item.get("currency")
     )
 
-    # Формируем результат
-    result = {
-        "store": config["STORE"],
-        "country": config["COUNTRY"],
-        "product_name": config["PRODUCT"],
-        "variant": variant,
-        "full_name": title,
-        "full_price": price,
-        "price": price_number,
-        "currency": currency,
-        "unit_size": package_size,
-        "unit_type": package_unit,
-        "price_per_unit": price_per_unit_number,
-        "price_per_unit_string": price_per_unit_string,
-        "external_id": None,  # можно сгенерировать хэш
-    }
-
     logger.info(
-        f"Извлечены данные: {config['STORE']} - {config['PRODUCT']} цена {price_number} {currency}"
+        f"Извлечены данные: {config['STORE']} - {config['PRODUCT']} "
+        f"цена {result['price']} {result['currency']}"
     )
     return result
 
 
-async def run_pit_parsing(store_filter=None, product_filter=None):
+async def extract_listing_data_async(config, variant="cheapest"):
+    """
+    Извлекает все товары со страницы листинга за одну загрузку страницы.
+    Возвращает список словарей в формате extract_product_data_async, где
+    product_name - полное название товара с плитки (каждая плитка - отдельный
+    товар), product_type - PRODUCT из конфигурации, position - место на странице.
+    Если данные не найдены, возвращает пустой список.
+    """
+    url = config["URLS"].get(variant)
+    if not url:
+        logger.warning(
+            f"URL для варианта {variant} не указан в конфигурации {config['STORE']}"
+        )
+        return []
+
+    html = await fetch_page_async(url, use_selenium=True)
+    if not html:
+        return []
+
+    # Разбор плиток и расчёт цен за единицу выполняем одним заданием в потоке
+    def extract():
+        # Структурированные данные страницы, шаблоны TITLE/PRICE - запасной путь
+        listing = structured_data.extract_structured_products(html)
+        if not listing:
+            listing = store_productscraper.extract_listing_from_template(
+                config.get("TITLE_TEMPLATE", config["TITLE"]),
+                config.get("PRICE_TEMPLATE", config["PRICE"]),
+                html,
+            )
+        # Цены и упаковки всей страницы нормализуем одним пакетом
+        currency_map = config.get("CURRENCY_MAP", {})
+        columns = store_productscraper.normalize_batch(
+            (
+                item.get("price", item["full_price"]),
+                item["full_name"],
+                {item["currency"]: item["currency"]}
+                if item.get("currency")
+                else currency_map,
+            )
+            for item in listing
+        )
+        results = []
+        for index, item in enumerate(listing):
+            normalized = {name: values[index] for name, values in columns.items()}
+            result = make_result(
+                config, variant, item["full_name"], item["full_price"], normalized
+            )
+            result["product_name"] = item["full_name"]
+            result["position"] = index + 1
+            results.append(result)
+        return results
+
+    loop = asyncio.get_event_loop()
+    try:
+        results = await loop.run_in_executor(None, extract)
+    except Exception as e:
+        logger.error(f"Ошибка извлечения листинга для {config['STORE']}: {e}")
+        return []
+
+    if not results:
+        logger.warning(
+            f"Не найдено ни одного товара на странице {config['STORE']} - {config['PRODUCT']}"
+        )
+    else:
+        logger.info(
+            f"Извлечено {len(results)} товаров: {config['STORE']} - {config['PRODUCT']} ({variant})"
+        )
+    return results
+
+
+async def run_pit_parsing(store_filter=None, product_filter=None, full_listing=None):
     """
     Основная функция парсинга: загружает конфигурации, обрабатывает каждый магазин,
     возвращает список результатов.
     Параметры:
         store_filter (list): список названий магазинов для фильтрации (опционально)
         product_filter (list): список названий продуктов для фильтрации (опционально)
+        full_listing (bool): если True, извлекает все товары со страницы листинга,
+            а не только первый найденный; по умолчанию - настройка PIT_FULL_LISTING
     """
-    configs = await parse_config_async()
+    if full_listing is None:
+        full_listing = app_config.PIT_FULL_LISTING
+    configs = await parse_config_async(
+        store_filter=store_filter, product_filter=product_filter
+    )
     results = []
 
     for config in configs:
-        store = config["STORE"]
-        product = config["PRODUCT"]
-
-        if store_filter and store not in store_filter:
-            continue
-        if product_filter and product not in product_filter:
-            continue
-
         # Обрабатываем оба варианта (cheapest, most_expensive)
         for variant in ["cheapest", "most_expensive"]:
             if variant not in config["URLS"] or not config["URLS"][variant]:
                 continue
 
+            if full_listing:
+                results.extend(await extract_listing_data_async(config, variant))
+                continue
+
             data = await extract_product_data_async(config, variant)
             if data:
                 results.append(data)
@@ -0,0 +1,140 @@
+"""
+Асинхронный доступ к базе для обработчиков бота и маршрутов веб-приложения.
+
+peewee синхронный: запрос, выполненный прямо в корутине, останавливает цикл
+событий, и медленный запрос одного пользователя задерживает всех остальных.
+run_db выполняет функцию в отдельном ограниченном пуле потоков
+(DB_EXECUTOR_WORKERS) и ждёт результат не дольше DB_QUERY_TIMEOUT секунд:
+
+    products = await run_db(get_pit_products, store="Auchan")
+
+Потоки пула живут всё время работы процесса, поэтому у каждого из них своё
+подключение, которое не закрывается между задачами (для PostgreSQL пул
+подключений DB_POOL_SIZE должен быть не меньше числа потоков). По таймауту
+вызывающий получает asyncio.TimeoutError: ещё не начатая задача отменяется,
+выполняющийся запрос SQLite прерывается через sqlite3 interrupt.
+
+Функции ниже выполняют запросы обработчиков целиком, вместе со связанными
+записями, чтобы в корутину возвращались готовые данные, а не ленивые
+запросы, которые выполнились бы при обходе уже в цикле событий.
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from database import is_sqlite
+from models import PriceHistory, Product, Subscription, db
+from services.snapshot import price_cache
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=config.DB_EXECUTOR_WORKERS, thread_name_prefix="db"
+)
+
+
+async def run_db(func, *args, timeout=None, **kwargs):
+    """
+    Выполняет func(*args, **kwargs) в пуле потоков базы и возвращает результат.
+    timeout - секунды ожидания, по умолчанию DB_QUERY_TIMEOUT.
+    """
+    timeout = config.DB_QUERY_TIMEOUT if timeout is None else timeout
+    running = {}
+    lock = threading.Lock()
+
+    def call():
+        db.connect(reuse_if_open=True)
+        with lock:
+            running["connection"] = db.connection()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with lock:
+                running.clear()
+
+    future = asyncio.get_running_loop().run_in_executor(executor, call)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        with lock:
+            connection = running.get("connection")
+            if connection is not None and is_sqlite(db):
+                connection.interrupt()
+        name = getattr(func, "__name__", repr(func))
+        logger.warning(f"Запрос {name} не выполнен за {timeout} с и прерван")
+        raise
+
+
+async def price_snapshot():
+    """
+    Снимок цен (services/snapshot.py) без блокировок; база запрашивается
+    в пуле потоков, только если снимка нет или он устарел.
+    """
+    return price_cache.current() or await run_db(price_cache.get)
+
+
+def set_subscription(user_id, subscribed):
+    """
+    Подписывает пользователя на отчёты или отписывает от них. Upsert по
+    user_id (ON CONFLICT есть и в SQLite, и в PostgreSQL) меняет только
+    subscribed, остальные настройки подписки сохраняются.
+    """
+    (
+        Subscription.insert(user_id=user_id, subscribed=subscribed)
+        .on_conflict(
+            conflict_target=[Subscription.user_id],
+            update={Subscription.subscribed: subscribed},
+        )
+        .execute()
+    )
+
+
+def get_active_subscriptions():
+    """Подписки пользователей, получающих отчёты."""
+    query = Subscription.select().where(Subscription.subscribed == True)  # noqa: E712
+    return list(query)
+
+
+def toggle_notify_only_on_change(user_id):
+    """Переключает уведомления только об изменениях, возвращает новое значение."""
+    with db.atomic():
+        sub, _ = Subscription.get_or_create(user_id=user_id)
+        sub.notify_only_on_change = not sub.notify_only_on_change
+        sub.save()
+    return sub.notify_only_on_change
+
+
+def get_pit_product_details(product_id, history_limit=5):
+    """
+    Товар PIT и его последние наблюдения цены (новые первыми)
+    или None, если товара нет.
+    """
+    product = Product.get_or_none(Product.id == product_id, Product.category == "pit")
+    if product is None:
+        return None
+    history = list(
+        PriceHistory.select()
+        .where(PriceHistory.product == product)
+        .order_by(PriceHistory.timestamp.desc())
+        .limit(history_limit)
+    )
+    return product, history
+
+
+def compare_unit_prices(name):
+    """
+    Товары PIT, в названии которых есть name: (сравнимые, без курса).
+    Сравнимые отсортированы по цене за единицу в базовой валюте (посчитана
+    при записи); у товаров без курса валюты её нет, и они не ранжируются.
+    """
+    products = list(
+        Product.select()
+        .where((Product.category == "pit") & (Product.name.contains(name)))
+        .order_by(Product.base_price_per_unit.asc(nulls="LAST"), Product.store)
+    )
+    ranked = [p for p in products if p.base_price_per_unit is not None]
+    without_rate = [p for p in products if p.base_price_per_unit is None]
+    return ranked, without_rate
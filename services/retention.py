@@ -0,0 +1,348 @@
+"""
+Уровни хранения наблюдений цен.
+
+save_prices записывает цену каждого товара каталога при каждом парсинге
+(раз в минуту), поэтому PriceHistory растёт на весь каталог каждую минуту.
+Движок хранения ограничивает рост:
+
+- сырые наблюдения хранятся RAW_RETENTION_DAYS дней;
+- более старые сворачиваются в почасовые (HourlyPriceRollup) и суточные
+  (DailyPriceRollup) агрегаты open/close/min/max со временем последнего
+  наблюдения и удаляются - по одному часу наблюдений в транзакции;
+- почасовые агрегаты хранятся HOURLY_RETENTION_DAYS дней, суточные - бессрочно;
+- запуски парсинга (ScrapeRun) удаляются, когда свёрнуты все их наблюдения.
+
+История товаров PIT (категория pit) пишется только при изменении цены
+и хранит размер упаковки и валюту, поэтому не сворачивается.
+
+history_points читает историю за период из всех уровней: сырые наблюдения,
+почасовые агрегаты за свёрнутые часы и суточные за удалённые почасовые.
+
+    python -m services.retention
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+from peewee import EXCLUDED, fn
+
+from config import HOURLY_RETENTION_DAYS, RAW_RETENTION_DAYS
+from database import with_connection
+from models import (
+    DailyPriceRollup,
+    HourlyPriceRollup,
+    PriceHistory,
+    Product,
+    ScrapeRun,
+    db,
+)
+from services.pit_db import BATCH_SIZE, insert_chunks
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FIELDS = ("open", "close", "min_price", "max_price", "samples", "last_at")
+
+
+def floor_hour(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(timestamp):
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def raw_cutoff(now=None):
+    """Наблюдения раньше этого момента сворачиваются (граница суток)."""
+    return floor_day((now or datetime.now()) - timedelta(days=RAW_RETENTION_DAYS))
+
+
+def hourly_cutoff(now=None):
+    """Почасовые агрегаты раньше этого момента удаляются (граница суток)."""
+    return floor_day((now or datetime.now()) - timedelta(days=HOURLY_RETENTION_DAYS))
+
+
+def rolled_observations(cutoff):
+    """
+    Наблюдения, которые сворачиваются: начатые и последний раз
+    подтверждённые раньше cutoff, кроме истории товаров PIT. Текущее
+    наблюдение неизменной цены (last_seen продлевается) остаётся сырым.
+    """
+    return (
+        PriceHistory.select()
+        .join(Product)
+        .where(
+            (Product.category != "pit")
+            & (PriceHistory.timestamp < cutoff)
+            & (fn.COALESCE(PriceHistory.last_seen, PriceHistory.timestamp) < cutoff)
+        )
+    )
+
+
+def aggregate(rows):
+    """
+    Сворачивает наблюдения (product_id, price, last_at), упорядоченные
+    по времени внутри товара. Возвращает {product_id: агрегат}.
+    """
+    aggregates = {}
+    for product_id, price, timestamp in rows:
+        current = aggregates.get(product_id)
+        if current is None:
+            aggregates[product_id] = {
+                "open": price,
+                "close": price,
+                "min_price": price,
+                "max_price": price,
+                "samples": 1,
+                "last_at": timestamp,
+            }
+        else:
+            current["close"] = price
+            current["min_price"] = min(current["min_price"], price)
+            current["max_price"] = max(current["max_price"], price)
+            current["samples"] += 1
+            current["last_at"] = timestamp
+    return aggregates
+
+
+def merge_rollups(model, bucket, aggregates):
+    """
+    Записывает агрегаты интервала bucket. Если агрегат товара уже есть
+    (сутки сворачиваются по часам), более поздние наблюдения дополняют его.
+    """
+    product_ids = list(aggregates)
+    rows = []
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        chunk = product_ids[start : start + BATCH_SIZE]
+        existing = {
+            rollup.product_id: rollup
+            for rollup in model.select().where(
+                (model.bucket == bucket) & model.product.in_(chunk)
+            )
+        }
+        for product_id in chunk:
+            new = aggregates[product_id]
+            old = existing.get(product_id)
+            if old is not None:
+                new = {
+                    "open": old.open,
+                    "close": new["close"],
+                    "min_price": min(old.min_price, new["min_price"]),
+                    "max_price": max(old.max_price, new["max_price"]),
+                    "samples": old.samples + new["samples"],
+                    "last_at": new["last_at"],
+                }
+            rows.append(dict(new, product=product_id, bucket=bucket))
+
+    update = {getattr(model, name): getattr(EXCLUDED, name) for name in ROLLUP_FIELDS}
+    for chunk in insert_chunks(rows):
+        model.insert_many(chunk).on_conflict(
+            conflict_target=[model.product, model.bucket], update=update
+        ).execute()
+
+
+def rollup_hour(start, cutoff):
+    """
+    Сворачивает наблюдения часа start в почасовой и суточный агрегаты
+    и удаляет их. Всё в одной транзакции. Возвращает число наблюдений.
+    """
+    end = start + timedelta(hours=1)
+    query = (
+        rolled_observations(cutoff)
+        .select(
+            PriceHistory.id,
+            PriceHistory.product,
+            PriceHistory.price,
+            fn.COALESCE(PriceHistory.last_seen, PriceHistory.timestamp),
+        )
+        .where((PriceHistory.timestamp >= start) & (PriceHistory.timestamp < end))
+        .order_by(PriceHistory.product, PriceHistory.timestamp, PriceHistory.id)
+    )
+    with db.atomic():
+        rows = list(query.tuples())
+        if not rows:
+            return 0
+        aggregates = aggregate(row[1:] for row in rows)
+        merge_rollups(HourlyPriceRollup, start, aggregates)
+        merge_rollups(DailyPriceRollup, floor_day(start), aggregates)
+        ids = [row[0] for row in rows]
+        for chunk_start in range(0, len(ids), BATCH_SIZE):
+            chunk = ids[chunk_start : chunk_start + BATCH_SIZE]
+            PriceHistory.delete().where(PriceHistory.id.in_(chunk)).execute()
+    return len(rows)
+
+
+def next_observation(cutoff):
+    """Время самого старого несвёрнутого наблюдения раньше cutoff или None."""
+    return rolled_observations(cutoff).select(fn.MIN(PriceHistory.timestamp)).scalar()
+
+
+def prune_hourly(cutoff):
+    """Удаляет почасовые агрегаты раньше cutoff пакетами. Возвращает число строк."""
+    deleted = 0
+    while True:
+        ids = [
+            rollup.id
+            for rollup in HourlyPriceRollup.select(HourlyPriceRollup.id)
+            .where(HourlyPriceRollup.bucket < cutoff)
+            .limit(BATCH_SIZE)
+        ]
+        if not ids:
+            return deleted
+        with db.atomic():
+            deleted += (
+                HourlyPriceRollup.delete()
+                .where(HourlyPriceRollup.id.in_(ids))
+                .execute()
+            )
+
+
+def prune_runs(cutoff):
+    """
+    Удаляет запуски парсинга раньше cutoff, у которых не осталось сырых
+    наблюдений, пакетами. Возвращает число строк.
+    """
+    observed = PriceHistory.select().where(PriceHistory.run == ScrapeRun.id)
+    deleted = 0
+    while True:
+        ids = [
+            run.id
+            for run in ScrapeRun.select(ScrapeRun.id)
+            .where((ScrapeRun.started_at < cutoff) & ~fn.EXISTS(observed))
+            .limit(BATCH_SIZE)
+        ]
+        if not ids:
+            return deleted
+        with db.atomic():
+            deleted += ScrapeRun.delete().where(ScrapeRun.id.in_(ids)).execute()
+
+
+@with_connection(db)
+def run_retention(now=None):
+    """Сворачивает устаревшие наблюдения и удаляет старые почасовые агрегаты."""
+    now = now or datetime.now()
+    cutoff = raw_cutoff(now)
+    stats = {"observations": 0, "hours": 0, "hourly_deleted": 0, "runs_deleted": 0}
+    oldest = next_observation(cutoff)
+    while oldest is not None:
+        stats["observations"] += rollup_hour(floor_hour(oldest), cutoff)
+        stats["hours"] += 1
+        oldest = next_observation(cutoff)
+    stats["hourly_deleted"] = prune_hourly(hourly_cutoff(now))
+    stats["runs_deleted"] = prune_runs(cutoff)
+    logger.info(
+        f"Хранение: свёрнуто {stats['observations']} наблюдений за "
+        f"{stats['hours']} ч., удалено почасовых агрегатов: {stats['hourly_deleted']}, "
+        f"запусков парсинга: {stats['runs_deleted']}"
+    )
+    return stats
+
+
+def product_ids(product_name=None):
+    """Подзапрос id товаров с именем product_name (всех, если имя не задано)."""
+    products = Product.select(Product.id)
+    if product_name:
+        products = products.where(Product.name == product_name)
+    return products
+
+
+def in_effect_ids(model, time_field, condition):
+    """
+    Подзапрос id строк model, действовавших на момент since: последняя
+    по time_field строка каждого товара среди удовлетворяющих condition.
+    """
+    ranked = (
+        model.select(
+            model.id.alias("id"),
+            fn.ROW_NUMBER()
+            .over(
+                partition_by=[model.product],
+                order_by=[time_field.desc(), model.id.desc()],
+            )
+            .alias("position"),
+        )
+        .where(condition)
+        .alias("ranked")
+    )
+    return model.select(ranked.c.id).from_(ranked).where(ranked.c.position == 1)
+
+
+def raw_points(since, product_name=None):
+    """
+    Сырые наблюдения с момента since: [(время, цена)] - начало каждого
+    наблюдения и last_seen, до которого цена держалась. В режиме
+    OBSERVATION_MODE="change" у неизменной цены строк внутри периода нет,
+    поэтому, как в utils.price_steps, берётся и наблюдение, действовавшее
+    в момент since, с началом, обрезанным по since.
+    """
+    products = product_ids(product_name)
+    in_effect = in_effect_ids(
+        PriceHistory,
+        PriceHistory.timestamp,
+        (PriceHistory.timestamp <= since) & PriceHistory.product.in_(products),
+    )
+    query = PriceHistory.select(
+        PriceHistory.timestamp, PriceHistory.last_seen, PriceHistory.price
+    ).where(
+        PriceHistory.product.in_(products)
+        & ((PriceHistory.timestamp > since) | PriceHistory.id.in_(in_effect))
+    )
+    points = []
+    for timestamp, last_seen, price in query.tuples():
+        start = max(timestamp, since)
+        points.append((start, price))
+        if last_seen is not None and last_seen > start:
+            points.append((last_seen, price))
+    return points
+
+
+def history_points(since, product_name=None):
+    """
+    История цен с момента since: [(время, цена)] по возрастанию времени.
+    Свёрнутые периоды представлены последней ценой интервала. Цена,
+    действовавшая в момент since, берётся из того уровня, где лежит
+    последнее наблюдение товара до since, со временем, обрезанным по since.
+    """
+    products = product_ids(product_name)
+    hourly = HourlyPriceRollup.select(
+        HourlyPriceRollup.last_at, HourlyPriceRollup.close
+    ).where(HourlyPriceRollup.bucket >= since)
+    daily = DailyPriceRollup.select(
+        DailyPriceRollup.last_at, DailyPriceRollup.close
+    ).where(DailyPriceRollup.bucket >= since)
+
+    # Суточные агрегаты нужны только для дней, почасовые агрегаты которых удалены
+    hourly_start = HourlyPriceRollup.select(fn.MIN(HourlyPriceRollup.bucket)).scalar()
+    if hourly_start is not None:
+        daily = daily.where(DailyPriceRollup.bucket < floor_day(hourly_start))
+
+    points = []
+    in_effect = {}
+    # От старого уровня к новому: более новый агрегат до since заменяет старый
+    for query, model in ((daily, DailyPriceRollup), (hourly, HourlyPriceRollup)):
+        points.extend(query.where(model.product.in_(products)).tuples())
+        previous = model.select(model.product, model.last_at, model.close).where(
+            model.id.in_(
+                in_effect_ids(
+                    model,
+                    model.bucket,
+                    (model.bucket < since) & model.product.in_(products),
+                )
+            )
+        )
+        for product_id, last_at, close in previous.tuples():
+            in_effect[product_id] = (max(last_at, since), close)
+
+    # Товары с сырым наблюдением до since получают его из raw_points
+    raw_before = PriceHistory.select(PriceHistory.product).where(
+        (PriceHistory.timestamp <= since) & PriceHistory.product.in_(products)
+    )
+    for (product_id,) in raw_before.distinct().tuples():
+        in_effect.pop(product_id, None)
+    points.extend(in_effect.values())
+    points.extend(raw_points(since, product_name))
+    return sorted(points, key=lambda point: point[0])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(run_retention())
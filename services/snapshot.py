@@ -0,0 +1,213 @@
+"""
+Снимок текущих и предыдущих цен в памяти процесса.
+
+Отчёты бота, рассылка и главная страница веб-приложения читают цены из
+снимка, а не из базы. Снимок неизменяем: запись цен строит новый и
+подменяет ссылку целиком, поэтому читатели работают без блокировок и видят
+либо старую, либо новую версию. Каждая версия получает следующий номер
+поколения (generation), по нему веб-приложение и бот проверяют свои кэши.
+
+- save_prices после фиксации транзакции дополняет снимок сохранёнными
+  товарами (patch), не обращаясь к базе;
+- save_pit_results сбрасывает снимок, и он перестраивается одним запросом
+  при следующем чтении (rebuild);
+- снимок старше PRICE_SNAPSHOT_TTL секунд перечитывается из базы, так
+  подхватываются цены, записанные другими процессами (бот и веб-приложение
+  с общей базой PostgreSQL).
+
+Запись цен выполняется в блоке price_cache.ingest() без блокировки.
+Блокировка берётся только на подмену снимка и номера поколения. Перестроение,
+во время чтения которого шла запись, не публикует прочитанный снимок: он мог
+не увидеть зафиксированную запись и затереть её патч.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from peewee import JOIN, Window, fn
+
+import config
+from models import PriceHistory, Product, db
+
+
+class PriceEntry(NamedTuple):
+    """Текущая цена товара каталога и цена на предыдущем парсинге."""
+
+    id: int
+    name: str
+    category: str
+    price: float
+    previous: Optional[float]  # None - товар новый
+    timestamp: datetime  # когда цена в каталоге последний раз менялась
+
+
+class PriceSnapshot:
+    """Неизменяемая версия цен с номером поколения."""
+
+    def __init__(self, entries, generation, loaded_at, epoch):
+        self.entries = entries  # id товара -> PriceEntry
+        self.generation = generation
+        # Поколения считаются заново после перезапуска процесса, поэтому
+        # для проверки кэшей снаружи (ETag) к ним добавляется время запуска
+        self.version = f"{epoch}.{generation}"
+        self.loaded_at = loaded_at  # time.monotonic() последнего чтения из базы
+        # Одноимённые товары разных магазинов: остаётся обновлённый последним
+        ordered = sorted(entries.values(), key=lambda e: (e.timestamp, e.id))
+        self.prices = {e.name: (e.price, e.previous) for e in ordered}
+        self.by_category = {}
+        for entry in sorted(entries.values(), key=lambda e: (e.category, e.name)):
+            self.by_category.setdefault(entry.category, []).append(entry)
+
+
+def load_entries():
+    """
+    Текущая и предыдущая цена каждого товара каталога одним запросом.
+
+    Наблюдения ранжируются окном по товару (индекс product + timestamp):
+    для текущего наблюдения LEAD даёт цену предыдущего. Если текущее
+    наблюдение продлевалось (last_seen позже его начала), на прошлом
+    парсинге цена была той же и previous совпадает с текущей.
+    """
+    window = Window(
+        partition_by=[PriceHistory.product],
+        order_by=[PriceHistory.timestamp.desc(), PriceHistory.id.desc()],
+    )
+    ranked = (
+        PriceHistory.select(
+            PriceHistory.product.alias("product_id"),
+            (PriceHistory.last_seen > PriceHistory.timestamp).alias("seen_again"),
+            fn.LEAD(PriceHistory.price).over(window).alias("previous"),
+            fn.ROW_NUMBER().over(window).alias("position"),
+        )
+        .window(window)
+        .alias("ranked")
+    )
+    query = Product.select(
+        Product.id,
+        Product.name,
+        Product.category,
+        Product.price,
+        ranked.c.previous,
+        ranked.c.seen_again,
+        Product.timestamp,
+    ).join(
+        ranked,
+        JOIN.LEFT_OUTER,
+        on=(ranked.c.product_id == Product.id) & (ranked.c.position == 1),
+    )
+    entries = {}
+    for row in query.tuples():
+        product_id, name, category, price, previous, seen_again, timestamp = row
+        previous = price if seen_again else previous
+        entries[product_id] = PriceEntry(
+            product_id, name, category, price, previous, timestamp
+        )
+    return entries
+
+
+class PriceSnapshotCache:
+    """Текущий снимок цен; чтение без блокировок, подмена снимка под блокировкой."""
+
+    def __init__(self):
+        self._snapshot = None
+        self._generation = 0
+        self._epoch = time.time_ns()
+        self._lock = threading.Lock()
+        self._writing = 0  # блоков ingest() выполняется сейчас
+        self._writes = 0  # входов и выходов из ingest() за всё время
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def current(self):
+        """Снимок без обращения к базе или None, если его нет или он устарел."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        if time.monotonic() - snapshot.loaded_at > config.PRICE_SNAPSHOT_TTL:
+            return None
+        return snapshot
+
+    def get(self):
+        """Актуальный снимок, при необходимости перечитывается из базы."""
+        return self.current() or self.rebuild()
+
+    def rebuild(self):
+        """
+        Перечитывает снимок из базы. Запрос выполняется без блокировки;
+        если во время него шла запись цен, снимок возвращается, но не
+        становится текущим.
+        """
+        with self._lock:
+            writes = self._writes
+        entries = load_entries()
+        loaded_at = time.monotonic()
+        with self._lock:
+            current = self._writes == writes and not self._writing
+            return self._publish(entries, loaded_at, current)
+
+    def patch(self, products):
+        """
+        Дополняет снимок сохранёнными строками каталога (Product): цена
+        товара до записи становится предыдущей. Внутри внешней транзакции
+        запись ещё не зафиксирована, поэтому снимок сбрасывается.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None:
+                return
+            if db.in_transaction():
+                self._snapshot = None
+                return
+            entries = dict(snapshot.entries)
+            for product in products:
+                old = entries.get(product.id)
+                entries[product.id] = PriceEntry(
+                    product.id,
+                    product.name,
+                    product.category,
+                    product.price,
+                    old.price if old else None,
+                    product.timestamp,
+                )
+            # Поколение меняется, только если изменились сами цены
+            if entries != snapshot.entries:
+                self._publish(entries, snapshot.loaded_at)
+
+    @contextmanager
+    def ingest(self):
+        """
+        Блок записи цен: транзакция и патч снимка. Блокировку не держит,
+        только отмечает запись для перестроений, идущих одновременно с ней.
+        """
+        with self._lock:
+            self._writing += 1
+            self._writes += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._writing -= 1
+                self._writes += 1
+
+    def invalidate(self):
+        """Сбрасывает снимок, следующее чтение перечитает базу."""
+        with self._lock:
+            self._snapshot = None
+
+    def _publish(self, entries, loaded_at, current=True):
+        # Вызывается под блокировкой. Номер поколения получает и неопубликованный
+        # снимок, чтобы его версия (ETag) не совпала с версией текущего
+        self._generation += 1
+        snapshot = PriceSnapshot(entries, self._generation, loaded_at, self._epoch)
+        if current:
+            # Подменяем ссылку целиком, читатели видят либо старую, либо новую версию
+            self._snapshot = snapshot
+        return snapshot
+
+
+price_cache = PriceSnapshotCache()
@@ -8,24 +8,66 @@ from peewee import SqliteDatabase
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import config
-from models import Basket, BasketItem, PriceHistory, Product, Subscription, db, init_db
+
+# Тесты можно запустить на локальном PostgreSQL:
+# TEST_DATABASE_URL=postgresql://postgres@localhost/priceparser_test pytest
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    config.DB_ENGINE = "postgres"
+    config.DATABASE_URL = TEST_DATABASE_URL
+
+from database import init_database, is_sqlite
+from models import (
+    Basket,
+    BasketItem,
+    CurrencyRate,
+    DailyPriceRollup,
+    HourlyPriceRollup,
+    LatestPrice,
+    PriceHistory,
+    Product,
+    ScrapeRun,
+    StoreConfig,
+    StoreTemplate,
+    StoreUrl,
+    Subscription,
+    db,
+    init_db,
+)
+from services.snapshot import price_cache
 
 # Переопределяем DATABASE_PATH на временную базу в памяти для тестов
 config.DATABASE_PATH = ":memory:"
 
+MODELS = [
+    Product,
+    Subscription,
+    ScrapeRun,
+    PriceHistory,
+    LatestPrice,
+    HourlyPriceRollup,
+    DailyPriceRollup,
+    CurrencyRate,
+    StoreConfig,
+    StoreTemplate,
+    StoreUrl,
+    Basket,
+    BasketItem,
+]
+
 
 @pytest.fixture(scope="session")
 def test_database():
-    """Создаёт временную базу данных в памяти для всех тестов."""
-    # Используем ту же глобальную базу данных из models.py
-    db = SqliteDatabase(":memory:")
-    # Заменяем базу данных у моделей
-    for model in [Product, Subscription, PriceHistory, Basket, BasketItem]:
-        model._meta.database = db
+    """Создаёт тестовую базу для всех тестов: в памяти или в TEST_DATABASE_URL."""
+    # Используем ту же глобальную базу данных из models.py, но в памяти,
+    # чтобы db.atomic() в коде приложения работал с тестовой базой
+    if is_sqlite(db):
+        init_database(db, ":memory:")
     db.connect()
-    db.create_tables([Product, Subscription, PriceHistory, Basket, BasketItem])
+    db.drop_tables(MODELS, safe=True)
+    db.create_tables(MODELS)
     yield db
-    db.drop_tables([Product, Subscription, PriceHistory, Basket, BasketItem])
+    db.drop_tables(MODELS)
     db.close()
 
 
@@ -36,9 +78,18 @@ def clean_database(test_database):
     with test_database.atomic():
         BasketItem.delete().execute()
         Basket.delete().execute()
+        LatestPrice.delete().execute()
+        HourlyPriceRollup.delete().execute()
+        DailyPriceRollup.delete().execute()
         PriceHistory.delete().execute()
+        ScrapeRun.delete().execute()
+        CurrencyRate.delete().execute()
+        StoreUrl.delete().execute()
+        StoreTemplate.delete().execute()
+        StoreConfig.delete().execute()
         Subscription.delete().execute()
         Product.delete().execute()
+    price_cache.invalidate()
     yield
 
 
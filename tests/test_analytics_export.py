@@ -0,0 +1,112 @@
+import csv
+import gzip
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from models import DailyPriceRollup, PriceHistory, Product
+from services import analytics_export
+
+
+@pytest.fixture
+def history(test_database):
+    """История цен двух магазинов за два месяца."""
+    walmart = Product.create(name="Bread", price=2.0, store="Walmart", currency="USD")
+    lidl = Product.create(name="Bread", price=1.5, store="Lidl Plus", currency="EUR")
+    for product, timestamp, price in [
+        (walmart, datetime(2025, 1, 10, 12, 0, 0, 123456), 2.0),
+        (walmart, datetime(2025, 2, 3, 9, 30), 2.2),
+        (lidl, datetime(2025, 1, 11, 8, 0), 1.5),
+    ]:
+        PriceHistory.create(
+            product=product, price=price, currency=product.currency, timestamp=timestamp
+        )
+
+
+def partitions(output_dir):
+    return sorted(
+        os.path.relpath(root, output_dir)
+        for root, _, files in os.walk(output_dir)
+        if any(name.startswith("part-") for name in files)
+    )
+
+
+def test_csv_fallback_without_pyarrow(history, tmp_path, monkeypatch):
+    monkeypatch.setattr(analytics_export, "load_pyarrow", lambda: None)
+    output_dir = str(tmp_path / "history")
+    stats = analytics_export.export_price_history(output_dir)
+    assert stats == {"files": 3, "rows": 3, "partitions": 3}
+    assert partitions(output_dir) == [
+        "month=2025-01/store=Lidl%20Plus",
+        "month=2025-01/store=Walmart",
+        "month=2025-02/store=Walmart",
+    ]
+    path = os.path.join(output_dir, "month=2025-02/store=Walmart/part-00000.csv.gz")
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 1
+    assert rows[0]["price"] == "2.2"
+    assert rows[0]["date"] == "2025-02-03"
+    assert "store" not in rows[0]
+    with open(os.path.join(output_dir, "_schema.json"), encoding="utf-8") as f:
+        schema = json.load(f)
+    assert schema["format"] == "csv"
+    assert schema["columns"]["price"] == "float"
+
+
+def test_daily_rollups_export(test_database, tmp_path, monkeypatch):
+    monkeypatch.setattr(analytics_export, "load_pyarrow", lambda: None)
+    product = Product.create(name="Bread", price=2.0, store="Walmart", currency="USD")
+    DailyPriceRollup.create(
+        product=product,
+        bucket=datetime(2024, 11, 5),
+        open=2.0,
+        close=2.4,
+        min_price=1.9,
+        max_price=2.4,
+        samples=72,
+        last_at=datetime(2024, 11, 5, 23, 40),
+    )
+    output_dir = str(tmp_path / "daily")
+    assert analytics_export.main(["daily", output_dir, "--format", "csv"])["rows"] == 1
+    path = os.path.join(output_dir, "month=2024-11/store=Walmart/part-00000.csv.gz")
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        (row,) = list(csv.DictReader(f))
+    assert (row["date"], row["close"], row["samples"]) == ("2024-11-05", "2.4", "72")
+    assert row["currency"] == "USD"
+
+
+def test_parquet_requires_pyarrow(history, tmp_path, monkeypatch):
+    monkeypatch.setattr(analytics_export, "load_pyarrow", lambda: None)
+    with pytest.raises(RuntimeError):
+        analytics_export.export_price_history(str(tmp_path), fmt="parquet")
+
+
+def test_reexport_replaces_partition_files(history, tmp_path, monkeypatch):
+    monkeypatch.setattr(analytics_export, "load_pyarrow", lambda: None)
+    monkeypatch.setattr(analytics_export, "PART_ROWS", 1)
+    output_dir = str(tmp_path / "history")
+    analytics_export.export_price_history(output_dir)
+    stats = analytics_export.export_price_history(output_dir, since="2025-02-15")
+    # Перевыгружается весь месяц, начиная с которого задан since
+    assert stats["rows"] == 1
+    files = os.listdir(os.path.join(output_dir, "month=2025-02/store=Walmart"))
+    assert files == ["part-00000.csv.gz"]
+
+
+def test_parquet_dataset(history, tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow
+    import pyarrow.dataset
+
+    output_dir = str(tmp_path / "history")
+    analytics_export.export_price_history(output_dir, fmt="parquet")
+    dataset = pyarrow.dataset.dataset(output_dir, partitioning="hive")
+    table = dataset.to_table(filter=pyarrow.dataset.field("store") == "Walmart")
+    assert table.num_rows == 2
+    assert pyarrow.types.is_dictionary(table.schema.field("name").type)
+    assert table.schema.field("price").type == pyarrow.float64()
+    assert table.schema.field("date").type == pyarrow.date32()
+    assert sorted(table.column("price").to_pylist()) == [2.0, 2.2]
@@ -7,7 +7,9 @@ from services.basket import (
     create_basket,
     delete_basket,
     get_basket,
+    get_basket_item,
     get_basket_items,
+    get_user_basket_summaries,
     get_user_baskets,
     remove_from_basket,
 )
@@ -178,6 +180,28 @@ class TestGetBasketItems:
         assert len(items) == 0
 
 
+class TestBasketSummaries:
+    """Тесты сводки по корзинам пользователя."""
+
+    def test_summaries_count_items_and_total(
+        self, sample_user_id, sample_basket_item, sample_product
+    ):
+        """Количество позиций и сумма считаются одним запросом, пустые корзины - нули."""
+        empty = create_basket(sample_user_id, name="Пустая")
+        summaries = {b.id: b for b in get_user_basket_summaries(sample_user_id)}
+        basket = summaries[sample_basket_item.basket.id]
+        assert basket.item_count == 1
+        assert basket.total == pytest.approx(sample_product.price * 2.0)
+        assert summaries[empty.id].item_count == 0
+        assert summaries[empty.id].total == 0.0
+
+    def test_get_basket_item_with_basket(self, sample_basket_item, sample_user_id):
+        """Позиция загружается вместе с корзиной."""
+        item = get_basket_item(sample_basket_item.id)
+        assert item.basket.user_id == sample_user_id
+        assert get_basket_item(99999) is None
+
+
 class TestDeleteBasket:
     """Тесты удаления корзины."""
 
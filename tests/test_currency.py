@@ -0,0 +1,145 @@
+from datetime import date
+
+import pytest
+
+from models import CurrencyRate, PriceHistory, Product
+from services.currency import (
+    CurrencyConverter,
+    converter,
+    load_rates_file,
+    normalize_currency,
+)
+from services.pit_db import save_pit_results
+from services.repository import compare_unit_prices
+
+
+@pytest.fixture
+def rates(test_database):
+    """Курсы USD и UAH к рублю с историей."""
+    CurrencyRate.create(currency="USD", date=date(2025, 1, 1), rate=100.0)
+    CurrencyRate.create(currency="USD", date=date(2025, 6, 1), rate=80.0)
+    CurrencyRate.create(currency="UAH", date=date(2025, 1, 1), rate=2.5)
+    converter.load()
+    yield converter
+    CurrencyRate.delete().execute()
+    converter.load()
+
+
+def test_normalize_currency():
+    assert normalize_currency("ГРН") == "UAH"
+    assert normalize_currency("грн") == "UAH"
+    assert normalize_currency(" usd ") == "USD"
+    assert normalize_currency(None) == ""
+
+
+def test_rate_history(rates):
+    """Курс на дату - последний курс не позже этой даты."""
+    assert rates.rate("USD", date(2024, 12, 31)) is None
+    assert rates.rate("USD", date(2025, 1, 1)) == 100.0
+    assert rates.rate("USD", date(2025, 5, 31)) == 100.0
+    assert rates.rate("USD", date(2025, 7, 1)) == 80.0
+    assert rates.rate("RUB") == 1.0
+    assert rates.rate("EUR") is None
+
+
+def test_convert_many(rates):
+    converted = rates.convert_many(
+        [1.5, 10.0, 3.0, None, 7.0], ["USD", "ГРН", "RUB", "USD", "EUR"]
+    )
+    assert converted == [120.0, 25.0, 3.0, None, None]
+
+
+def test_converter_loads_lazily(rates):
+    fresh = CurrencyConverter(base_currency="RUB")
+    assert fresh.convert(2.0, "USD", date(2025, 3, 1)) == 200.0
+
+
+def test_load_rates_file(tmp_path, test_database):
+    path = tmp_path / "rates.csv"
+    path.write_text(
+        "# комментарий\n"
+        "date,currency,rate\n"
+        "2025-01-01,USD,90.5\n"
+        "2025-01-01,грн,2.2\n"
+        "2025-02-01,USD,91\n",
+        encoding="utf-8",
+    )
+    assert load_rates_file(str(path)) == 3
+    # Повторный импорт обновляет курс, а не дублирует строку
+    path.write_text("date,currency,rate\n2025-01-01,USD,92\n", encoding="utf-8")
+    load_rates_file(str(path))
+    assert CurrencyRate.select().count() == 3
+    assert converter.rate("USD", date(2025, 1, 15)) == 92.0
+    assert converter.rate("UAH", date(2025, 1, 15)) == 2.2
+    CurrencyRate.delete().execute()
+    converter.load()
+
+
+def test_save_pit_results_materializes_base_price(rates):
+    results = [
+        {
+            "store": "Walmart",
+            "product_name": "Bread",
+            "price": 1.82,
+            "currency": "USD",
+            "unit_size": 14.0,
+            "unit_type": "oz",
+            "price_per_unit": 4.59,
+            "external_id": None,
+        },
+        {
+            "store": "ATB Market",
+            "product_name": "Bread",
+            "price": 30.0,
+            "currency": "ГРН",
+            "unit_size": 500.0,
+            "unit_type": "г",
+            "price_per_unit": 60.0,
+            "external_id": None,
+        },
+    ]
+    save_pit_results(results)
+    walmart = Product.get(Product.store == "Walmart")
+    atb = Product.get(Product.store == "ATB Market")
+    assert walmart.currency == "USD"
+    assert walmart.base_price_per_unit == 367.2
+    assert atb.currency == "UAH"
+    assert atb.base_price_per_unit == 150.0
+    history = PriceHistory.get(PriceHistory.product == atb)
+    assert history.base_price_per_unit == 150.0
+    # Сравнение сортируется по базовой цене прямо в SQL
+    ordered = Product.select().order_by(Product.base_price_per_unit)
+    assert [p.store for p in ordered] == ["ATB Market", "Walmart"]
+
+
+def test_converter_reloads_after_ttl(rates, monkeypatch):
+    assert rates.rate("EUR") is None
+    CurrencyRate.create(currency="EUR", date=date(2025, 1, 1), rate=105.0)
+    # До истечения TTL курсы берутся из памяти
+    assert rates.rate("EUR") is None
+    monkeypatch.setattr("services.currency.CURRENCY_RATES_TTL", -1)
+    assert rates.rate("EUR") == 105.0
+
+
+def test_compare_excludes_rows_without_rate(rates):
+    results = [
+        {
+            "store": store,
+            "product_name": "Bread",
+            "price": price,
+            "currency": currency,
+            "unit_size": 1.0,
+            "unit_type": "кг",
+            "price_per_unit": price,
+            "external_id": None,
+        }
+        for store, price, currency in [
+            ("Walmart", 1.0, "USD"),
+            ("Lidl", 0.5, "EUR"),
+            ("Auchan", 90.0, "RUB"),
+        ]
+    ]
+    save_pit_results(results)
+    ranked, without_rate = compare_unit_prices("Bread")
+    assert [p.store for p in ranked] == ["Walmart", "Auchan"]
+    assert [p.store for p in without_rate] == ["Lidl"]
@@ -0,0 +1,42 @@
+import threading
+
+from database import make_sqlite_database, thread_connection
+
+
+def pragma(database, name):
+    return database.execute_sql(f"PRAGMA {name}").fetchone()[0]
+
+
+def test_pragmas_applied_to_each_connection(tmp_path):
+    database = make_sqlite_database(str(tmp_path / "prices.db"))
+    with thread_connection(database):
+        assert pragma(database, "journal_mode") == "wal"
+        assert pragma(database, "synchronous") == 1  # NORMAL
+        assert pragma(database, "temp_store") == 2  # MEMORY
+        assert pragma(database, "busy_timeout") > 0
+        assert pragma(database, "cache_size") < 0
+    assert database.is_closed()
+
+
+def test_thread_connection_keeps_open_connection(tmp_path):
+    database = make_sqlite_database(str(tmp_path / "prices.db"))
+    database.connect()
+    with thread_connection(database):
+        pass
+    assert not database.is_closed()
+    database.close()
+
+
+def test_worker_thread_closes_its_connection(tmp_path):
+    database = make_sqlite_database(str(tmp_path / "prices.db"))
+    states = []
+
+    def worker():
+        with thread_connection(database):
+            states.append(database.is_closed())
+        states.append(database.is_closed())
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert states == [False, True]
@@ -0,0 +1,139 @@
+import importlib
+
+import pytest
+from peewee import SqliteDatabase
+from playhouse.migrate import SchemaMigrator
+
+from migrations import MIGRATIONS, applied_versions, run_migrations
+
+# Схема prices.db до интеграции с PIT
+OLD_SCHEMA = [
+    'CREATE TABLE "product" ("id" INTEGER NOT NULL PRIMARY KEY, '
+    '"name" VARCHAR(255) NOT NULL, "price" REAL NOT NULL, '
+    '"timestamp" DATETIME NOT NULL)',
+    'CREATE TABLE "subscription" ("id" INTEGER NOT NULL PRIMARY KEY, '
+    '"user_id" INTEGER NOT NULL, "subscribed" INTEGER NOT NULL)',
+    'CREATE UNIQUE INDEX "subscription_user_id" ON "subscription" ("user_id")',
+]
+
+
+@pytest.fixture
+def old_database(tmp_path):
+    database = SqliteDatabase(str(tmp_path / "prices.db"))
+    database.connect()
+    for statement in OLD_SCHEMA:
+        database.execute_sql(statement)
+    database.execute_sql(
+        "INSERT INTO product (name, price, timestamp) "
+        "VALUES ('Bulbasaur', 63.0, '2025-01-01 10:00:00')"
+    )
+    yield database
+    database.close()
+
+
+def columns(database, table):
+    return {column.name for column in database.get_columns(table)}
+
+
+def indexes(database, table):
+    return {index.name: index.unique for index in database.get_indexes(table)}
+
+
+def test_old_database_is_upgraded(old_database):
+    applied = run_migrations(old_database)
+    assert applied == [version for version, _ in MIGRATIONS]
+    assert {"category", "store", "external_id", "currency"} <= columns(
+        old_database, "product"
+    )
+    assert "notify_only_on_change" in columns(old_database, "subscription")
+    product_indexes = indexes(old_database, "product")
+    assert product_indexes["product_name_timestamp"] is False
+    assert product_indexes["product_external_id"] is True
+    # Существующие строки получают значения по умолчанию
+    row = old_database.execute_sql(
+        "SELECT name, category, store FROM product"
+    ).fetchone()
+    assert row == ("Bulbasaur", "uncategorized", "unknown")
+
+
+def test_migrations_are_applied_once(old_database):
+    run_migrations(old_database)
+    assert run_migrations(old_database) == []
+    assert applied_versions(old_database) == {version for version, _ in MIGRATIONS}
+
+
+def test_duplicate_external_ids_are_cleared(old_database):
+    old_database.execute_sql("ALTER TABLE product ADD COLUMN external_id VARCHAR(255)")
+    for name in ("Milk", "Kefir"):
+        old_database.execute_sql(
+            "INSERT INTO product (name, price, timestamp, external_id) "
+            "VALUES (?, 1.0, '2025-01-02 10:00:00', 'abc')",
+            (name,),
+        )
+    run_migrations(old_database)
+    rows = old_database.execute_sql(
+        "SELECT external_id FROM product WHERE name IN ('Milk', 'Kefir') ORDER BY id"
+    ).fetchall()
+    assert rows == [("abc",), (None,)]
+
+
+def test_observation_rows_are_folded_into_catalogue(old_database):
+    for price, timestamp in (
+        (64.0, "2025-01-01 10:01:00"),
+        (65.0, "2025-01-01 10:02:00"),
+    ):
+        old_database.execute_sql(
+            "INSERT INTO product (name, price, timestamp) VALUES ('Bulbasaur', ?, ?)",
+            (price, timestamp),
+        )
+    run_migrations(old_database)
+    products = old_database.execute_sql(
+        "SELECT id, name, price FROM product"
+    ).fetchall()
+    assert len(products) == 1
+    product_id, _, price = products[0]
+    assert price == 65.0
+    history = old_database.execute_sql(
+        "SELECT product_id, price FROM pricehistory ORDER BY timestamp"
+    ).fetchall()
+    assert history == [(product_id, 63.0), (product_id, 64.0), (product_id, 65.0)]
+    latest = old_database.execute_sql(
+        "SELECT product_id, price, observed_at FROM latestprice"
+    ).fetchall()
+    assert latest == [(product_id, 65.0, "2025-01-01 10:02:00")]
+
+
+def test_history_table_created_as_of_its_version(old_database):
+    migrator = SchemaMigrator.from_database(old_database)
+    for version, name in MIGRATIONS[:4]:
+        importlib.import_module(f"migrations.{name}").upgrade(old_database, migrator)
+    assert "last_seen" not in columns(old_database, "pricehistory")
+    assert "run_id" not in columns(old_database, "pricehistory")
+    # Имена индексов совпадают с теми, что создаёт init_db
+    assert set(indexes(old_database, "pricehistory")) == {
+        "pricehistory_product_id",
+        "pricehistory_product_id_timestamp",
+    }
+    assert old_database.execute_sql("SELECT COUNT(*) FROM latestprice").fetchone() == (
+        1,
+    )
+
+
+def test_missing_tables_are_skipped(tmp_path):
+    database = SqliteDatabase(str(tmp_path / "empty.db"))
+    assert run_migrations(database) == [version for version, _ in MIGRATIONS]
+    assert database.get_tables() == ["schema_version"]
+
+
+def test_history_gets_run_column(old_database):
+    old_database.execute_sql(
+        'CREATE TABLE "pricehistory" ("id" INTEGER NOT NULL PRIMARY KEY, '
+        '"product_id" INTEGER NOT NULL, "price" REAL NOT NULL, '
+        '"timestamp" DATETIME NOT NULL)'
+    )
+    run_migrations(old_database)
+    assert {"last_seen", "run_id"} <= columns(old_database, "pricehistory")
+    assert "pricehistory_run_id" in indexes(old_database, "pricehistory")
+    # Таблица, на которую ссылается run_id, создаётся той же миграцией
+    assert old_database.table_exists("scraperun")
+    assert "scraperun_started_at" in indexes(old_database, "scraperun")
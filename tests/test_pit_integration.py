@@ -1,27 +1,72 @@
 import asyncio
+import gzip
+import json
 import os
+import sqlite3
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import AsyncMock, MagicMock, Mock, patch
 
 import pytest
+from peewee import IntegrityError
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from models import PriceHistory, Product
+from models import LatestPrice, PriceHistory, Product, StoreConfig, StoreTemplate, db
+from services import pit_db
+from services.pit_config import (
+    StoreConfigRegistry,
+    config_registry,
+    has_db_configs,
+    import_config_file,
+    load_configs,
+    load_db_configs,
+)
 from services.pit_db import (
     add_price_history,
     generate_external_id,
     get_or_create_product,
     get_pit_products,
+    latest_prices,
     save_pit_results,
 )
+from services.pit_integration import pit_export, store_productscraper
+from services.pit_integration.store_productscraper import (
+    PriceSampleWriter,
+    calculate_price_per_unit,
+    extract_package_info,
+    extract_price_info,
+    normalize_batch,
+)
+from services.pit_integration.structured_data import (
+    extract_structured_products,
+    main_product,
+)
+from services.pit_integration.unit_prices import (
+    calculate_price_per_unit_array,
+    encode_units,
+    format_price_per_unit,
+    normalize_arrays,
+)
 from services.pit_parser import (
+    extract_listing_data_async,
     extract_product_data_async,
     fetch_page_async,
     parse_config_async,
     run_pit_parsing,
 )
 
+CURRENCY_MAP = {"$": "USD"}
+
+
+@pytest.fixture
+def database_file(tmp_path, monkeypatch):
+    """Пустая база PIT во временном каталоге вместо product_inflation.db."""
+    path = str(tmp_path / "product_inflation.db")
+    monkeypatch.setattr(store_productscraper, "DATABASE_FILE", path)
+    store_productscraper.create_database()
+    return path
+
 
 class TestPitParser:
     """Тесты модуля pit_parser."""
@@ -33,9 +78,19 @@ class TestPitParser:
             "services.pit_parser.store_productscraper.parse_config"
         )
         mock_parse.return_value = [
-            {"STORE": "Auchan", "COUNTRY": "France", "PRODUCT": "Milk", "URLS": {}}
+            {
+                "STORE": "Auchan",
+                "COUNTRY": "France",
+                "PRODUCT": "Milk",
+                "TITLE": ["<h3>FFF</h3>"],
+                "PRICE": ["<span>FFF</span>"],
+                "CURRENCY_MAP": {"€": "EUR"},
+                "URLS": {"cheapest": "https://example.com"},
+            }
         ]
+        config_registry.invalidate()
         configs = await parse_config_async()
+        config_registry.invalidate()
         assert len(configs) == 1
         assert configs[0]["STORE"] == "Auchan"
         assert configs[0]["PRODUCT"] == "Milk"
@@ -184,16 +239,911 @@ class TestPitParser:
         mock_parse = mocker.patch("services.pit_parser.parse_config_async")
         mock_parse.return_value = [
             {"STORE": "Auchan", "PRODUCT": "Milk", "URLS": {"cheapest": "url"}},
-            {"STORE": "Carrefour", "PRODUCT": "Bread", "URLS": {"cheapest": "url"}},
         ]
         mock_extract = mocker.patch("services.pit_parser.extract_product_data_async")
         mock_extract.return_value = {"store": "Auchan", "price": 100}
         results = await run_pit_parsing(
             store_filter=["Auchan"], product_filter=["Milk"]
         )
+        # Фильтры передаются в загрузку конфигураций (SQL или реестр)
+        mock_parse.assert_called_once_with(
+            store_filter=["Auchan"], product_filter=["Milk"]
+        )
         # Должен быть вызван только для Auchan Milk
         assert mock_extract.call_count == 1
 
+    @pytest.mark.asyncio
+    async def test_extract_listing_data_async(self, mocker):
+        """Тест извлечения всех товаров со страницы листинга."""
+        html = """
+        <ul class="grid">
+          <li class="tile">
+            <h3 class="title">Toast Bread 500 g</h3>
+            <span class="price">$1.50</span>
+          </li>
+          <li class="tile">
+            <h3 class="title">Rye Bread 1 kg</h3>
+            <span class="price">$3.20</span>
+          </li>
+          <li class="tile">
+            <h3 class="title">Sold out bread</h3>
+          </li>
+        </ul>
+        """
+        mock_fetch = mocker.patch("services.pit_parser.fetch_page_async")
+        mock_fetch.return_value = html
+        config = {
+            "STORE": "Walmart",
+            "COUNTRY": "USA",
+            "PRODUCT": "Bread",
+            "URLS": {"cheapest": "http://example.com"},
+            "TITLE": ['<h3 class="title">FFF</h3>'],
+            "PRICE": ['<span class="price">FFF</span>'],
+            "CURRENCY_MAP": {"$": "USD"},
+        }
+        results = await extract_listing_data_async(config, "cheapest")
+        assert len(results) == 2
+        assert [r["product_name"] for r in results] == [
+            "Toast Bread 500 g",
+            "Rye Bread 1 kg",
+        ]
+        assert [r["position"] for r in results] == [1, 2]
+        assert all(r["product_type"] == "Bread" for r in results)
+        assert results[0]["price"] == 1.5
+        assert results[0]["price_per_unit"] == 3.0
+        assert results[1]["price_per_unit"] == 3.2
+        mock_fetch.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_run_pit_parsing_full_listing(self, mocker):
+        """Тест режима полного листинга."""
+        mock_parse = mocker.patch("services.pit_parser.parse_config_async")
+        mock_parse.return_value = [
+            {"STORE": "Auchan", "PRODUCT": "Milk", "URLS": {"cheapest": "url"}},
+        ]
+        mock_listing = mocker.patch("services.pit_parser.extract_listing_data_async")
+        mock_listing.return_value = [{"store": "Auchan"}, {"store": "Auchan"}]
+        mock_extract = mocker.patch("services.pit_parser.extract_product_data_async")
+        results = await run_pit_parsing(full_listing=True)
+        assert len(results) == 2
+        mock_extract.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_run_pit_parsing_full_listing_setting(self, mocker, monkeypatch):
+        """Режим листинга по умолчанию берётся из настройки PIT_FULL_LISTING."""
+        monkeypatch.setattr("config.PIT_FULL_LISTING", True)
+        mock_parse = mocker.patch("services.pit_parser.parse_config_async")
+        mock_parse.return_value = [
+            {"STORE": "Auchan", "PRODUCT": "Milk", "URLS": {"cheapest": "url"}},
+        ]
+        mock_listing = mocker.patch("services.pit_parser.extract_listing_data_async")
+        mock_listing.return_value = [{"store": "Auchan"}]
+        mock_extract = mocker.patch("services.pit_parser.extract_product_data_async")
+        assert len(await run_pit_parsing()) == 1
+        mock_extract.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_extract_product_data_async_structured(self, mocker):
+        """Тест быстрого пути через структурированные данные страницы."""
+        html = """
+        <script type="application/ld+json">
+        {"@type": "Product", "name": "Whole Milk 2 l",
+         "offers": {"@type": "Offer", "price": "1.390", "priceCurrency": "EUR"}}
+        </script>
+        """
+        mock_fetch = mocker.patch("services.pit_parser.fetch_page_async")
+        mock_fetch.return_value = html
+        mock_template = mocker.patch(
+            "services.pit_parser.store_productscraper.extract_data_from_template"
+        )
+        config = {
+            "STORE": "Billa",
+            "COUNTRY": "Austria",
+            "PRODUCT": "Milk",
+            "URLS": {"cheapest": "http://example.com"},
+            "TITLE": [],
+            "PRICE": [],
+            "CURRENCY_MAP": {"€": "EUR"},
+        }
+        result = await extract_product_data_async(config, "cheapest")
+        mock_template.assert_not_called()
+        assert result["full_name"] == "Whole Milk 2 l"
+        assert result["price"] == 1.39
+        assert result["currency"] == "EUR"
+        assert result["price_per_unit"] == 0.69
+
+
+class TestStoreConfigRegistry:
+    """Тесты кэша и проверки конфигураций магазинов."""
+
+    VALID = """STORE = Walmart
+COUNTRY = USA
+PRODUCT = Bread
+
+TITLE = [
+<h3>FFF</h3>
+]
+
+PRICE = [
+<span class="price">FFF</span>
+]
+
+CURRENCY_MAP = ["$": "USD"]
+
+URLS = [
+cheapest: https://www.walmart.com/bread
+most_expensive:
+]
+"""
+
+    INVALID = """===
+
+STORE = Lidl
+COUNTRY = Germany
+PRODUCT = Milk
+
+TITLE = [
+<h3></h3>
+]
+
+PRICE = [
+<span class="price">FFF</span>
+]
+
+CURRENCY_MAP = ["€": "EUR"]
+
+URLS = [
+cheapest: www.lidl.de/milk
+most_expensive:
+]
+"""
+
+    @pytest.fixture
+    def config_file(self, tmp_path):
+        path = tmp_path / "store_config.txt"
+        path.write_text(self.VALID, encoding="utf-8")
+        return path
+
+    def test_configs_are_cached_until_file_changes(self, config_file, mocker):
+        registry = StoreConfigRegistry(config_file)
+        parse = mocker.spy(store_productscraper, "parse_config")
+        configs = registry.get_configs()
+        assert registry.get_configs() is configs
+        assert parse.call_count == 1
+        # Тот же контент с новым mtime не разбирается заново
+        os.utime(config_file, ns=(1, 1))
+        registry.get_configs()
+        assert parse.call_count == 1
+
+    def test_hot_reload(self, config_file):
+        registry = StoreConfigRegistry(config_file)
+        assert registry.stores() == ["Walmart"]
+        config_file.write_text(
+            self.VALID + "\n===\n\n" + self.VALID.replace("Walmart", "Target"),
+            encoding="utf-8",
+        )
+        assert registry.stores() == ["Walmart", "Target"]
+        assert registry.version == 2
+
+    def test_invalid_entries_reported_with_line_numbers(self, config_file):
+        config_file.write_text(self.VALID + self.INVALID, encoding="utf-8")
+        registry = StoreConfigRegistry(config_file)
+        assert [c["STORE"] for c in registry.get_configs()] == ["Walmart"]
+        assert registry.errors == [
+            "store_config.txt:21: Lidl / Milk: в шаблоне TITLE нет метки FFF",
+            "store_config.txt:21: Lidl / Milk: некорректный URL для cheapest: "
+            "www.lidl.de/milk",
+        ]
+
+    def test_malformed_entry_skipped_with_line_number(self, config_file):
+        malformed = self.VALID.replace("Walmart", "Target").replace(
+            "COUNTRY = USA", "COUNTRY USA"
+        )
+        config_file.write_text(self.VALID + "\n===\n\n" + malformed, encoding="utf-8")
+        registry = StoreConfigRegistry(config_file)
+        assert registry.stores() == ["Walmart"]
+        assert registry.errors == [
+            "store_config.txt:23: expected 'COUNTRY = ...', got 'COUNTRY USA'"
+        ]
+
+    def test_malformed_reload_keeps_last_good_configs(self, config_file):
+        registry = StoreConfigRegistry(config_file)
+        configs = registry.get_configs()
+        config_file.write_text(
+            self.VALID.replace("COUNTRY = USA", "COUNTRY USA"), encoding="utf-8"
+        )
+        assert registry.get_configs() is configs
+        assert registry.version == 1
+        assert registry.errors == [
+            "store_config.txt:2: expected 'COUNTRY = ...', got 'COUNTRY USA'"
+        ]
+        # Исправленный файл снова загружается
+        config_file.write_text(self.VALID.replace("Bread", "Milk"), encoding="utf-8")
+        assert [c["PRODUCT"] for c in registry.get_configs()] == ["Milk"]
+        assert registry.errors == []
+
+    def test_store_lookup_and_compiled_templates(self, config_file):
+        registry = StoreConfigRegistry(config_file)
+        (config,) = registry.for_store("Walmart")
+        assert registry.for_store("Unknown") == []
+        assert config["TITLE_TEMPLATE"].find("h3") is not None
+        html = '<div><h3>Toast Bread 500 g</h3><span class="price">$1.50</span></div>'
+        extract = store_productscraper.extract_data_from_template
+        assert extract(config["TITLE_TEMPLATE"], html) == "Toast Bread 500 g"
+        assert extract(config["PRICE_TEMPLATE"], html) == "$1.50"
+
+
+class TestStoreConfigDb:
+    """Тесты хранения конфигураций магазинов в БД."""
+
+    @pytest.fixture
+    def config_file(self, tmp_path):
+        valid = TestStoreConfigRegistry.VALID
+        path = tmp_path / "store_config.txt"
+        path.write_text(
+            valid
+            + "\n===\n\n"
+            + valid.replace("Walmart", "Target")
+            + "\n===\n\n"
+            + valid.replace("Bread", "Milk")
+            + TestStoreConfigRegistry.INVALID,
+            encoding="utf-8",
+        )
+        return path
+
+    def test_import_config_file(self, config_file):
+        imported, errors = import_config_file(config_file)
+        assert imported == 3
+        assert len(errors) == 2
+        assert StoreConfig.select().count() == 3
+        config = StoreConfig.get(store="Walmart", product="Bread")
+        assert [t.line for t in config.templates.order_by(StoreTemplate.position)] == [
+            "<h3>FFF</h3>",
+            '<span class="price">FFF</span>',
+        ]
+        assert [(u.variant, u.url) for u in config.urls] == [
+            ("cheapest", "https://www.walmart.com/bread")
+        ]
+        # Повторный импорт обновляет записи, а не дублирует их
+        import_config_file(config_file)
+        assert StoreConfig.select().count() == 3
+        assert StoreTemplate.select().count() == 6
+
+    def test_load_db_configs_filters_in_sql(self, config_file):
+        import_config_file(config_file)
+        configs = load_db_configs(store_filter=["Walmart"])
+        assert [(c["STORE"], c["PRODUCT"]) for c in configs] == [
+            ("Walmart", "Bread"),
+            ("Walmart", "Milk"),
+        ]
+        configs = load_db_configs(store_filter=["Walmart"], product_filter=["Milk"])
+        assert len(configs) == 1
+        config = configs[0]
+        assert config["CURRENCY_MAP"] == {"$": "USD"}
+        assert config["TITLE"] == ["<h3>FFF</h3>"]
+        assert config["TITLE_TEMPLATE"].find("h3") is not None
+        assert load_db_configs(product_filter=["Eggs"]) == []
+
+    def test_load_configs_prefers_database(self, config_file):
+        assert not has_db_configs()
+        import_config_file(config_file)
+        StoreConfig.update(active=False).where(StoreConfig.store == "Target").execute()
+        assert [c["STORE"] for c in load_configs()] == ["Walmart", "Walmart"]
+
+    def test_import_deactivates_removed_configs(self, config_file, tmp_path):
+        import_config_file(config_file)
+        path = tmp_path / "store_config_new.txt"
+        path.write_text(TestStoreConfigRegistry.VALID, encoding="utf-8")
+        imported, errors = import_config_file(path)
+        assert (imported, errors) == (1, [])
+        assert [(c["STORE"], c["PRODUCT"]) for c in load_configs()] == [
+            ("Walmart", "Bread")
+        ]
+        # Файл с неразобранной записью ничего не отключает
+        path.write_text(
+            TestStoreConfigRegistry.VALID.replace("COUNTRY = USA", "COUNTRY USA"),
+            encoding="utf-8",
+        )
+        imported, errors = import_config_file(path)
+        assert imported == 0 and len(errors) == 1
+        assert len(load_configs()) == 1
+
+
+class TestStructuredData:
+    """Тесты извлечения структурированных данных."""
+
+    def test_json_ld_item_list(self):
+        html = """
+        <script type="application/ld+json">
+        {"@context": "https://schema.org", "@type": "ItemList",
+         "itemListElement": [
+           {"@type": "ListItem", "position": 1, "item": {
+             "@type": "Product", "name": "White Bread",
+             "weight": {"@type": "QuantitativeValue", "value": 500, "unitText": "g"},
+             "offers": {"price": 1.82, "priceCurrency": "USD"}}},
+           {"@type": "ListItem", "position": 2, "item": {
+             "@type": "Product", "name": "Rye Bread",
+             "offers": [{"@type": "AggregateOffer", "lowPrice": "2.10",
+                         "priceCurrency": "USD"}]}}
+         ]}
+        </script>
+        """
+        products = extract_structured_products(html)
+        assert [p["full_name"] for p in products] == [
+            "White Bread, 500 g",
+            "Rye Bread",
+        ]
+        assert [p["price"] for p in products] == [1.82, 2.1]
+        assert all(p["currency"] == "USD" for p in products)
+
+    def test_next_data(self):
+        html = """
+        <script id="__NEXT_DATA__" type="application/json">
+        {"props": {"pageProps": {"items": [
+          {"name": "Classic White Bistro", "packageSize": "675 g",
+           "priceInfo": {"currentPrice": {"price": 3.49, "currencyUnit": "CAD"}}},
+          {"name": "Classic White Bistro", "packageSize": "675 g",
+           "priceInfo": {"currentPrice": {"price": 3.49, "currencyUnit": "CAD"}}}
+        ]}}}
+        </script>
+        """
+        products = extract_structured_products(html)
+        assert len(products) == 1
+        assert products[0]["full_name"] == "Classic White Bistro, 675 g"
+        assert products[0]["price"] == 3.49
+        assert products[0]["currency"] == "CAD"
+
+    def test_microdata(self):
+        html = """
+        <div itemscope itemtype="https://schema.org/Product">
+          <span itemprop="name">Хлеб нарезной 400 г</span>
+          <meta itemprop="price" content="45.50">
+          <meta itemprop="priceCurrency" content="RUB">
+        </div>
+        """
+        products = extract_structured_products(html)
+        assert products == [
+            {
+                "full_name": "Хлеб нарезной 400 г",
+                "full_price": "45.5 RUB",
+                "price": 45.5,
+                "currency": "RUB",
+                "type": "Product",
+            }
+        ]
+
+    def test_main_product_skips_listed_products(self):
+        html = """
+        <script type="application/ld+json">
+        {"@type": "ItemList", "itemListElement": [
+          {"@type": "ListItem", "item": {"@type": "Product", "name": "Rye Bread",
+            "offers": {"price": 2.1, "priceCurrency": "USD"}}}]}
+        </script>
+        <script type="application/ld+json">
+        {"@type": "Product", "name": "White Bread",
+         "offers": {"price": 1.82, "priceCurrency": "USD"}}
+        </script>
+        """
+        products = extract_structured_products(html)
+        assert [p["type"] for p in products] == ["ListItem", "Product"]
+        assert main_product(products)["full_name"] == "White Bread"
+        assert main_product(products[:1]) is None
+
+    def test_no_structured_data(self):
+        assert extract_structured_products("<html><p>Bread</p></html>") == []
+        assert extract_structured_products(None) == []
+
+
+class TestNormalization:
+    """Тесты пакетной нормализации цен и упаковок."""
+
+    ROWS = [
+        ("$1.82", "White Bread, 14 oz", {"$": "USD"}),
+        ("1.390,80 грн", "Хлеб 500 г", {"грн": "ГРН"}),
+        ("2,499.99", "Milk 2L", {"$": "CAD"}),
+        ("", "Eggs 10 pcs", {"₽": "RUB"}),
+        ("45", "Bread without size", {}),
+        (3.5, "Rye Bread 1 kg", {"EUR": "EUR"}),
+        ("$1.82", "White Bread, 14 oz", {"$": "USD"}),
+    ]
+
+    def test_normalize_batch_matches_scalar(self):
+        columns = normalize_batch(self.ROWS)
+        assert all(len(values) == len(self.ROWS) for values in columns.values())
+        for index, (price_string, title, currency_map) in enumerate(self.ROWS):
+            if isinstance(price_string, float):
+                price, currency = price_string, "EUR"
+            else:
+                price, currency = extract_price_info(price_string, currency_map)
+            package_string, size, unit = extract_package_info(title)
+            ppu_string, ppu = calculate_price_per_unit(price, size, unit, currency)
+            assert columns["price"][index] == price
+            assert columns["currency"][index] == currency
+            assert columns["package_string"][index] == package_string
+            assert columns["size"][index] == size
+            assert columns["unit"][index] == unit
+            assert columns["price_per_unit"][index] == ppu
+            assert columns["price_per_unit_string"][index] == ppu_string
+
+    def test_currency_detected_by_symbol(self):
+        currency_map = {"$": "USD", "€": "EUR"}
+        assert extract_price_info("€3.50", currency_map) == (3.5, "EUR")
+        assert extract_price_info("$3.50", currency_map) == (3.5, "USD")
+        assert extract_price_info("3.50", currency_map) == (3.5, "USD")
+
+    def test_normalize_batch_values(self):
+        columns = normalize_batch(self.ROWS[:3])
+        assert columns["price"] == [1.82, 1390.8, 2499.99]
+        assert columns["unit"] == ["oz", "г", "l"]
+        assert columns["price_per_unit_string"][1] == "2781.60 ГРН/kg"
+
+    def test_repeated_titles_parsed_once(self):
+        extract_package_info.cache_clear()
+        normalize_batch([("$1", "Toast 500 g", {})] * 50)
+        assert extract_package_info.cache_info().misses == 1
+
+
+class TestPriceSampleWriter:
+    """Тесты пакетной записи PriceSample в базу PIT."""
+
+    def count_samples(self, database_file):
+        conn = sqlite3.connect(database_file)
+        count = conn.execute("SELECT COUNT(*) FROM PriceSample").fetchone()[0]
+        conn.close()
+        return count
+
+    def test_rows_are_buffered_until_flush(self, database_file):
+        writer = PriceSampleWriter(database_file, batch_size=10)
+        assert writer.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert writer.add(
+            "Walmart",
+            "USA",
+            "Bread",
+            "cheapest",
+            "Bread, 14 oz",
+            "$1.82",
+            CURRENCY_MAP,
+        )
+        assert writer.add(
+            "Walmart", "USA", "Milk", "cheapest", "Milk 2 l", "$3.10", CURRENCY_MAP
+        )
+        assert self.count_samples(database_file) == 0
+        writer.close()
+        assert writer.saved_count == 2
+        assert self.count_samples(database_file) == 2
+
+    def test_flush_every_batch_size_rows(self, database_file, mocker):
+        writer = PriceSampleWriter(database_file, batch_size=2)
+        flush = mocker.spy(writer, "flush")
+        for index in range(5):
+            writer.add(
+                "Walmart",
+                "USA",
+                f"Product {index}",
+                "cheapest",
+                "Bread, 14 oz",
+                "$1.82",
+                CURRENCY_MAP,
+            )
+        assert flush.call_count == 2
+        assert self.count_samples(database_file) == 4
+        writer.close()
+        assert self.count_samples(database_file) == 5
+
+    def test_invalid_rows_are_skipped(self, database_file):
+        with PriceSampleWriter(database_file) as writer:
+            assert not writer.add(
+                "Walmart", "USA", "Bread", "cheapest", "", "$1.82", CURRENCY_MAP
+            )
+            assert not writer.add(
+                "Walmart",
+                "USA",
+                "Bread",
+                "cheapest",
+                "Bread",
+                "$1.82",
+                CURRENCY_MAP,
+            )
+        assert self.count_samples(database_file) == 0
+
+    def test_save_to_database_without_writer(self, database_file):
+        assert store_productscraper.save_to_database(
+            "Walmart",
+            "USA",
+            "Bread",
+            "cheapest",
+            "Bread, 14 oz",
+            "$1.82",
+            CURRENCY_MAP,
+        )
+        assert self.count_samples(database_file) == 1
+
+    def test_flush_reraises_database_error(self, database_file, mocker):
+        mocker.patch.object(
+            store_productscraper,
+            "recompute_inflation_rates",
+            side_effect=sqlite3.OperationalError("database is locked"),
+        )
+        writer = PriceSampleWriter(database_file, batch_size=10)
+        writer.add(
+            "Walmart",
+            "USA",
+            "Bread",
+            "cheapest",
+            "Bread, 14 oz",
+            "$1.82",
+            CURRENCY_MAP,
+        )
+        with pytest.raises(sqlite3.OperationalError):
+            writer.close()
+        # Пакет откатан целиком и не засчитан как записанный
+        assert writer.saved_count == 0
+        assert self.count_samples(database_file) == 0
+
+
+class TestInflationRecompute:
+    """Тесты пересчёта инфляции оконной функцией LAG()."""
+
+    def save(self, monkeypatch, date, price, variant="cheapest"):
+        monkeypatch.setattr(
+            store_productscraper, "get_current_date_string", lambda: date
+        )
+        store_productscraper.save_to_database(
+            "Walmart", "USA", "Bread", variant, "Bread, 14 oz", price, CURRENCY_MAP
+        )
+
+    def rates(self, database_file):
+        conn = sqlite3.connect(database_file)
+        rows = conn.execute(
+            "SELECT date, variant, inflation_rate FROM PriceSample ORDER BY date, variant"
+        ).fetchall()
+        conn.close()
+        return rows
+
+    def test_flush_fills_inflation_rate(self, database_file, monkeypatch):
+        self.save(monkeypatch, "2025-01-01", "$2.00")
+        self.save(monkeypatch, "2025-01-02", "$2.50")
+        self.save(monkeypatch, "2025-01-02", "$9.00", variant="most_expensive")
+        self.save(monkeypatch, "2025-01-03", "$2.00")
+        assert self.rates(database_file) == [
+            ("2025-01-01", "cheapest", 0.0),
+            ("2025-01-02", "cheapest", 25.0),
+            ("2025-01-02", "most_expensive", 0.0),
+            ("2025-01-03", "cheapest", -20.0),
+        ]
+
+    def test_writer_backfill_updates_later_rows(self, database_file, monkeypatch):
+        self.save(monkeypatch, "2025-01-03", "$3.00")
+        # Более ранняя дата, записанная позже, пересчитывает и следующие строки
+        self.save(monkeypatch, "2025-01-01", "$2.00")
+        assert self.rates(database_file) == [
+            ("2025-01-01", "cheapest", 0.0),
+            ("2025-01-03", "cheapest", 50.0),
+        ]
+
+    def test_recompute_since_date(self, database_file, monkeypatch):
+        self.save(monkeypatch, "2025-01-01", "$2.00")
+        self.save(monkeypatch, "2025-01-02", "$2.50")
+        conn = sqlite3.connect(database_file)
+        conn.execute("UPDATE PriceSample SET inflation_rate = NULL")
+        conn.commit()
+        conn.close()
+        assert store_productscraper.recompute_inflation_rates(since="2025-01-02") == 1
+        assert self.rates(database_file) == [
+            ("2025-01-01", "cheapest", None),
+            ("2025-01-02", "cheapest", 25.0),
+        ]
+        assert store_productscraper.recompute_inflation_rates() == 2
+
+    def test_recompute_touched_series_since_date(self, database_file, monkeypatch):
+        for store in ("Walmart", "Lidl"):
+            for date, price in [("2025-01-01", "$2.00"), ("2025-01-02", "$2.50")]:
+                monkeypatch.setattr(
+                    store_productscraper, "get_current_date_string", lambda: date
+                )
+                store_productscraper.save_to_database(
+                    store,
+                    "USA",
+                    "Bread",
+                    "cheapest",
+                    "Bread, 14 oz",
+                    price,
+                    CURRENCY_MAP,
+                )
+        conn = sqlite3.connect(database_file)
+        conn.execute("UPDATE PriceSample SET inflation_rate = NULL")
+        series = conn.execute(
+            "SELECT store_id, product_type_id FROM Store, ProductType "
+            "WHERE Store.name = 'Walmart'"
+        ).fetchall()
+        assert (
+            store_productscraper.recompute_inflation_rates(
+                conn, since="2025-01-02", series=series
+            )
+            == 1
+        )
+        rows = conn.execute(
+            "SELECT Store.name, date, inflation_rate FROM PriceSample "
+            "JOIN Store USING (store_id) ORDER BY Store.name, date"
+        ).fetchall()
+        conn.close()
+        # Предыдущая цена берётся и из строк раньше since
+        assert rows == [
+            ("Lidl", "2025-01-01", None),
+            ("Lidl", "2025-01-02", None),
+            ("Walmart", "2025-01-01", None),
+            ("Walmart", "2025-01-02", 25.0),
+        ]
+
+    def test_flush_recomputes_only_touched_series(self, database_file, monkeypatch):
+        self.save(monkeypatch, "2025-01-01", "$2.00")
+        conn = sqlite3.connect(database_file)
+        conn.execute("UPDATE PriceSample SET inflation_rate = NULL")
+        conn.commit()
+        conn.close()
+        monkeypatch.setattr(
+            store_productscraper, "get_current_date_string", lambda: "2025-01-01"
+        )
+        store_productscraper.save_to_database(
+            "Lidl",
+            "Germany",
+            "Bread",
+            "cheapest",
+            "Bread, 14 oz",
+            "$3.00",
+            CURRENCY_MAP,
+        )
+        conn = store_productscraper.connect_database(database_file)
+        rows = conn.execute(
+            "SELECT Store.name, inflation_rate FROM PriceSample "
+            "JOIN Store USING (store_id) ORDER BY Store.name"
+        ).fetchall()
+        # Пустой список серий создаёт temp.touched_series для плана запроса
+        store_productscraper.recompute_inflation_rates(conn, series=[])
+        query = store_productscraper.INFLATION_RECOMPUTE.format(
+            series_filter=store_productscraper.TOUCHED_SERIES_FILTER
+        )
+        plan = conn.execute("EXPLAIN QUERY PLAN " + query, ("",)).fetchall()
+        conn.close()
+        # Серия Walmart не пересчитывалась
+        assert rows == [("Lidl", 0.0), ("Walmart", None)]
+        details = " ".join(row[-1] for row in plan)
+        assert (
+            "SEARCH PriceSample USING COVERING INDEX idx_pricesample_series" in details
+        )
+
+    def test_series_lookup_uses_covering_index(self, database_file):
+        conn = sqlite3.connect(database_file)
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT price_number FROM PriceSample "
+            "WHERE store_id = 1 AND product_type_id = 1 AND variant = 'cheapest' "
+            "ORDER BY date DESC LIMIT 1"
+        ).fetchall()
+        conn.close()
+        assert "COVERING INDEX idx_pricesample_series" in plan[0][-1]
+
+
+class TestPitExport:
+    """Тесты потокового экспорта PriceSample."""
+
+    @pytest.fixture
+    def database_file(self, database_file, monkeypatch):
+        for date, price in [("2025-01-01", "$2.00"), ("2025-01-02", "$2.50")]:
+            monkeypatch.setattr(
+                store_productscraper, "get_current_date_string", lambda: date
+            )
+            store_productscraper.save_to_database(
+                "Walmart",
+                "USA",
+                "Bread",
+                "cheapest",
+                "Bread, 1 kg",
+                price,
+                CURRENCY_MAP,
+            )
+        return database_file
+
+    def read_lines(self, path):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def test_ndjson_export(self, database_file, tmp_path):
+        output = str(tmp_path / "samples.ndjson")
+        assert pit_export.export_samples(database_file, output) == 2
+        records = self.read_lines(output)
+        assert [r["date"] for r in records] == ["2025-01-01", "2025-01-02"]
+        assert records[0] == {
+            "sample_id": 1,
+            "date": "2025-01-01",
+            "variant": "cheapest",
+            "product_type_name": "Bread",
+            "store_name": "Walmart",
+            "store_country": "USA",
+            "price_per_unit_string": "2.00 USD/kg",
+        }
+
+    def test_json_export_is_one_array(self, database_file, tmp_path):
+        output = str(tmp_path / "samples.json")
+        pit_export.export_samples(database_file, output, fmt="json")
+        with open(output, encoding="utf-8") as f:
+            assert len(json.load(f)) == 2
+
+    def test_incremental_gzip_export(self, database_file, tmp_path, monkeypatch):
+        output = str(tmp_path / "samples.ndjson.gz")
+        assert pit_export.export_samples(database_file, output, since="2025-01-01") == 1
+        assert pit_export.last_exported_date(output) == "2025-01-02"
+        # Ничего нового - ничего не дописывается
+        assert pit_export.export_samples(database_file, output, since="last") == 0
+
+        monkeypatch.setattr(
+            store_productscraper, "get_current_date_string", lambda: "2025-01-03"
+        )
+        store_productscraper.save_to_database(
+            "Walmart",
+            "USA",
+            "Bread",
+            "cheapest",
+            "Bread, 1 kg",
+            "$3.00",
+            CURRENCY_MAP,
+        )
+        assert pit_export.export_samples(database_file, output, since="last") == 1
+        # Строка за уже выгруженную дату, записанная позже, тоже дописывается
+        store_productscraper.save_to_database(
+            "Walmart",
+            "USA",
+            "Bread",
+            "most_expensive",
+            "Bread, 1 kg",
+            "$4.00",
+            CURRENCY_MAP,
+        )
+        assert pit_export.export_samples(database_file, output, since="last") == 1
+        assert [(r["date"], r["variant"]) for r in self.read_lines(output)] == [
+            ("2025-01-02", "cheapest"),
+            ("2025-01-03", "cheapest"),
+            ("2025-01-03", "most_expensive"),
+        ]
+
+    def test_last_continues_exports_without_sample_id(self, database_file, tmp_path):
+        output = str(tmp_path / "samples.ndjson")
+        with open(output, "w", encoding="utf-8") as f:
+            f.write('{"date":"2025-01-01","variant":"cheapest"}\n')
+        assert pit_export.export_samples(database_file, output, since="last") == 1
+        assert self.read_lines(output)[-1]["date"] == "2025-01-02"
+
+    def test_export_reads_date_index(self, database_file):
+        conn = sqlite3.connect(database_file)
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN " + pit_export.EXPORT_QUERY, ("",)
+        ).fetchall()
+        conn.close()
+        details = " ".join(row[-1] for row in plan)
+        assert "idx_pricesample_date" in details
+        assert "TEMP B-TREE" not in details
+
+    @pytest.mark.parametrize("name", ["samples.ndjson", "samples.ndjson.gz"])
+    def test_last_exported_date_reads_tail(self, tmp_path, monkeypatch, name):
+        monkeypatch.setattr(pit_export, "TAIL_BLOCK_SIZE", 16)
+        output = str(tmp_path / name)
+        with pit_export.open_output(output) as f:
+            for day in range(1, 10):
+                f.write(f'{{"date":"2025-01-0{day}","variant":"cheapest"}}\n')
+            f.write("\n")
+        assert pit_export.last_exported_date(output) == "2025-01-09"
+
+    def test_json_export_rejects_since(self, database_file, tmp_path):
+        output = str(tmp_path / "samples.json")
+        with pytest.raises(ValueError):
+            pit_export.export_samples(database_file, output, "json", "2025-01-01")
+        assert not os.path.exists(output)
+
+
+class TestIdentityMap:
+    """Тесты кэша идентификаторов Store и ProductType."""
+
+    def test_lookups_hit_the_database_once(self, database_file, mocker):
+        store_productscraper.get_or_create_store("Walmart", "USA")
+        identity_map = store_productscraper.IdentityMap(database_file)
+        create = mocker.spy(store_productscraper, "get_or_create_store")
+        first = identity_map.store_id("Walmart", "USA")
+        assert identity_map.store_id("Walmart", "USA") == first
+        # Уже существующий магазин берётся из загруженного кэша
+        assert create.call_count == 0
+        new = identity_map.store_id("Lidl", "Germany")
+        assert identity_map.store_id("Lidl", "Germany") == new
+        assert create.call_count == 1
+        assert identity_map.store(new) == ("Lidl", "Germany")
+
+    def test_product_types_are_written_through(self, database_file):
+        identity_map = store_productscraper.IdentityMap(database_file)
+        bread = identity_map.product_type_id("Bread")
+        assert identity_map.product_type_name(bread) == "Bread"
+        # Новая карта видит созданный тип в базе
+        fresh = store_productscraper.IdentityMap(database_file)
+        assert fresh.product_type_id("Bread") == bread
+
+    def test_concurrent_creates_return_one_id(self, database_file):
+        identity_map = store_productscraper.IdentityMap(database_file)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            ids = set(
+                executor.map(lambda _: identity_map.product_type_id("Milk"), range(32))
+            )
+        assert len(ids) == 1
+
+    def test_ids_published_after_commit(self, database_file):
+        identity_map = store_productscraper.IdentityMap(database_file)
+        conn = store_productscraper.connect_database(database_file)
+        store_id = identity_map.store_id("Lidl", "Germany", conn)
+        assert identity_map.store_id("Lidl", "Germany", conn) == store_id
+        assert "Lidl" not in identity_map.store_ids
+        conn.commit()
+        identity_map.commit(conn)
+        assert identity_map.store_ids["Lidl"] == store_id
+        assert identity_map.store(store_id) == ("Lidl", "Germany")
+        conn.close()
+
+    def test_ids_dropped_on_rollback(self, database_file):
+        identity_map = store_productscraper.IdentityMap(database_file)
+        conn = store_productscraper.connect_database(database_file)
+        identity_map.product_type_id("Bread", conn)
+        conn.rollback()
+        identity_map.rollback(conn)
+        assert "Bread" not in identity_map.product_type_ids
+        # После отката тип создаётся заново и попадает в общий кэш
+        bread = identity_map.product_type_id("Bread")
+        assert identity_map.product_type_name(bread) == "Bread"
+        conn.close()
+
+    def test_clear_forgets_ids(self, database_file):
+        identity_map = store_productscraper.IdentityMap(database_file)
+        identity_map.product_type_id("Bread")
+        identity_map.clear()
+        assert identity_map.product_type_ids == {} and not identity_map.loaded
+        assert identity_map.product_type_id("Bread") is not None
+
+    def test_shared_map_per_database(self, database_file):
+        shared = store_productscraper.get_identity_map(database_file)
+        assert store_productscraper.get_identity_map(database_file) is shared
+        writer = PriceSampleWriter(database_file)
+        assert writer.identity_map is shared
+        writer.close()
+
+
+class TestVectorizedUnitPrices:
+    """Тесты векторного расчёта цены за единицу."""
+
+    def test_identical_to_scalar(self):
+        units = ["g", "kg", "oz", "fl oz", "мл", "л", "шт", "pcs", "", "box"]
+        prices, sizes, unit_list = [], [], []
+        for index in range(2000):
+            prices.append(round(0.005 + index * 0.137, 3))
+            sizes.append([0, 0.25, 0.5, 1, 2, 14, 400, 1000][index % 8])
+            unit_list.append(units[index % len(units)])
+        # Значения ровно на границе округления
+        prices += [2.675, 1.005, 0.285, 1.115]
+        sizes += [1, 1, 1, 1]
+        unit_list += ["kg", "l", "шт", "pc"]
+
+        values, labels = calculate_price_per_unit_array(
+            prices, sizes, encode_units(unit_list)
+        )
+        strings = format_price_per_unit(values, labels, ["USD"] * len(prices))
+        for index, (price, size, unit) in enumerate(zip(prices, sizes, unit_list)):
+            expected_string, expected = calculate_price_per_unit(
+                price, size, unit, "USD"
+            )
+            assert values[index] == expected
+            assert strings[index] == expected_string
+
+    def test_normalize_arrays(self):
+        rows = TestNormalization.ROWS[:5]
+        columns = normalize_arrays(rows)
+        scalar = normalize_batch(rows)
+        assert columns["price_per_unit"].tolist() == scalar["price_per_unit"]
+        assert columns["price_per_unit_string"] == scalar["price_per_unit_string"]
+
 
 class TestPitDb:
     """Тесты модуля pit_db."""
@@ -288,6 +1238,33 @@ class TestPitDb:
         )
         assert count == 1
 
+    def test_add_price_history_updates_latest_price(self, sample_product):
+        item = {
+            "price": 110.0,
+            "unit_size": 1.0,
+            "unit_type": "л",
+            "price_per_unit": 110.0,
+        }
+        add_price_history(sample_product, item)
+        latest = LatestPrice.get_by_id(sample_product.id)
+        assert latest.price == 110.0
+        assert latest.price_per_unit == 110.0
+        add_price_history(sample_product, dict(item, price=120.0))
+        assert LatestPrice.get_by_id(sample_product.id).price == 120.0
+        assert LatestPrice.select().count() == 1
+
+    def test_latest_prices_fall_back_to_history(self, sample_product):
+        """Товары с историей, записанной до появления LatestPrice."""
+        PriceHistory.create(product=sample_product, price=95.0)
+        assert latest_prices([sample_product.id]) == {sample_product.id: 95.0}
+        item = {
+            "price": 95.0,
+            "unit_size": 1.0,
+            "unit_type": "л",
+            "price_per_unit": 95.0,
+        }
+        assert add_price_history(sample_product, item) is False
+
     def test_save_pit_results(self, test_database):
         """Тест сохранения результатов парсинга."""
         results = [
@@ -350,6 +1327,125 @@ class TestPitDb:
         assert sample_product.price == 90.0
         assert sample_product.price_per_unit == 90.0
 
+    def make_results(self, count, price=10.0):
+        return [
+            {
+                "store": "Auchan",
+                "product_name": f"Milk {index}",
+                "price": price,
+                "unit_size": 1.0,
+                "unit_type": "л",
+                "price_per_unit": price,
+                "external_id": None,
+            }
+            for index in range(count)
+        ]
+
+    def test_save_pit_results_query_count_is_constant(self, mocker):
+        """Число SQL-запросов не зависит от размера пакета."""
+        save_pit_results(self.make_results(5))
+        execute = mocker.spy(db, "execute_sql")
+        # 5 изменившихся цен + 5 новых товаров
+        save_pit_results(self.make_results(10, price=11.0))
+        small = execute.call_count
+        execute.reset_mock()
+        # 10 изменившихся цен + 90 новых товаров
+        save_pit_results(self.make_results(100, price=12.0))
+        assert execute.call_count == small
+        assert Product.select().count() == 100
+        assert PriceHistory.select().count() == 115
+        assert Product.get(Product.name == "Milk 3").price == 12.0
+
+    def test_save_pit_results_history_only_on_change(self):
+        save_pit_results(self.make_results(3))
+        results = self.make_results(3)
+        results[1]["price"] = 11.0
+        stats = save_pit_results(results)
+        assert stats["products_created"] == 0
+        assert stats["products_updated"] == 3
+        assert stats["history_added"] == 1
+        assert PriceHistory.select().count() == 4
+
+    def test_save_pit_results_maintains_latest_price(self):
+        save_pit_results(self.make_results(2))
+        results = self.make_results(2)
+        results[0]["price"] = 12.0
+        save_pit_results(results)
+        prices = {
+            latest.product.name: latest.price
+            for latest in LatestPrice.select().join(Product)
+        }
+        assert prices == {"Milk 0": 12.0, "Milk 1": 10.0}
+
+    def test_save_pit_results_extends_unchanged_observation(self):
+        save_pit_results(self.make_results(1))
+        first = PriceHistory.get()
+        save_pit_results(self.make_results(1))
+        current = PriceHistory.get()
+        assert PriceHistory.select().count() == 1
+        assert current.last_seen > first.last_seen
+
+    def test_save_pit_results_duplicates_in_batch(self):
+        results = self.make_results(1) + self.make_results(1, price=11.0)
+        stats = save_pit_results(results)
+        assert stats["products_created"] == 1
+        assert stats["products_updated"] == 1
+        assert stats["history_added"] == 2
+        product = Product.get(Product.name == "Milk 0")
+        assert product.price == 11.0
+        assert [h.price for h in product.price_history.order_by(PriceHistory.id)] == [
+            10.0,
+            11.0,
+        ]
+
+    def test_save_pit_results_rolls_back_batch(self, mocker):
+        mocker.patch.object(
+            PriceHistory, "insert_many", side_effect=Exception("DB error")
+        )
+        stats = save_pit_results(self.make_results(3))
+        assert stats["errors"] == 3
+        assert stats["products_created"] == 0
+        assert Product.select().count() == 0
+
+    def test_external_id_is_unique(self, sample_product):
+        with pytest.raises(IntegrityError):
+            Product.create(name="Other", price=1.0, external_id="test_123")
+        # NULL допускается у нескольких товаров
+        Product.create(name="A", price=1.0)
+        Product.create(name="B", price=1.0)
+
+    def test_save_pit_results_upserts_on_external_id_conflict(self, mocker):
+        """Товар, созданный параллельным запуском, обновляется, а не дублируется."""
+        external_id = generate_external_id("Auchan", "Milk 0", 1.0, "л")
+        # Между пробой по ключу и вставкой другой процесс создаёт тот же товар
+        Product.create(
+            name="Milk 0",
+            price=9.0,
+            store="Auchan",
+            unit_size=1.0,
+            unit_type="л",
+            external_id=external_id,
+        )
+        mocker.patch.object(pit_db, "fetch_products_by_key", return_value={})
+        stats = save_pit_results(self.make_results(1, price=11.0))
+        assert stats["errors"] == 0
+        assert Product.select().count() == 1
+        product = Product.get(Product.external_id == external_id)
+        assert product.price == 11.0
+        assert product.price_history.count() == 1
+
+    def test_key_lookup_respects_variable_limit(self, monkeypatch):
+        """Поиск товаров по ключу разбивается на запросы по лимиту переменных."""
+        monkeypatch.setattr(pit_db, "max_query_variables", lambda database: 4)
+        keys = []
+        for index in range(5):
+            Product.create(name=f"Milk {index}", price=1.0, store=f"Store {index}")
+            keys.append(
+                pit_db.product_key(f"Store {index}", f"Milk {index}", None, None)
+            )
+        found = pit_db.fetch_products_by_key(keys)
+        assert sorted(found) == sorted(keys)
+
     def test_get_pit_products(self, test_database):
         """Тест получения товаров категории pit."""
         # Создадим несколько товаров
@@ -0,0 +1,201 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from models import (
+    BasketItem,
+    LatestPrice,
+    PriceHistory,
+    Product,
+    ScrapeRun,
+    Subscription,
+)
+from services import notifier, pit_db, repository
+from services.basket import add_to_basket, create_basket
+from services.history import get_price_history
+from utils import (
+    get_latest_prices,
+    get_previous_prices,
+    get_price_snapshot,
+    price_at,
+    price_steps,
+    save_prices,
+)
+
+
+def scrape(**prices):
+    return {
+        name: {"price": price, "category": "pokemon"} for name, price in prices.items()
+    }
+
+
+def test_save_prices_keeps_one_catalogue_row():
+    save_prices(scrape(Bulbasaur=63.0, Ivysaur=87.0))
+    save_prices(scrape(Bulbasaur=65.0, Ivysaur=87.0))
+    assert Product.select().count() == 2
+    bulbasaur = Product.get(Product.name == "Bulbasaur")
+    assert bulbasaur.price == 65.0
+    assert bulbasaur.category == "pokemon"
+    assert [h.price for h in bulbasaur.price_history.order_by(PriceHistory.id)] == [
+        63.0,
+        65.0,
+    ]
+    assert LatestPrice.get_by_id(bulbasaur.id).price == 65.0
+
+
+def test_save_prices_returns_run(monkeypatch):
+    monkeypatch.setattr("utils.OBSERVATION_MODE", "change")
+    assert save_prices({}) is None
+    first = save_prices(scrape(Bulbasaur=63.0, Ivysaur=87.0))
+    second = save_prices(scrape(Bulbasaur=65.0, Ivysaur=87.0))
+    assert second != first
+    run = ScrapeRun.get_by_id(second)
+    assert (run.products, run.observations) == (2, 1)
+    # Наблюдения запуска - только изменившиеся цены, с временем запуска
+    observations = list(run.price_history)
+    assert [(h.product.name, h.price) for h in observations] == [("Bulbasaur", 65.0)]
+    assert observations[0].timestamp == run.started_at
+    assert {h.timestamp for h in ScrapeRun.get_by_id(first).price_history} == {
+        ScrapeRun.get_by_id(first).started_at
+    }
+
+
+def test_insert_chunks_respect_variable_limit(monkeypatch):
+    monkeypatch.setattr(pit_db, "max_query_variables", lambda database: 999)
+    rows = [{"product": 1, "price": 1.0, "timestamp": None}] * 1000
+    assert [len(chunk) for chunk in pit_db.insert_chunks(rows)] == [333, 333, 333, 1]
+    assert list(pit_db.insert_chunks([])) == []
+
+
+def test_latest_and_previous_prices():
+    save_prices(scrape(Bulbasaur=63.0))
+    assert get_latest_prices() == {"Bulbasaur": 63.0}
+    assert get_previous_prices() == {}
+    save_prices(scrape(Bulbasaur=65.0, Ivysaur=87.0))
+    assert get_latest_prices() == {"Bulbasaur": 65.0, "Ivysaur": 87.0}
+    assert get_previous_prices() == {"Bulbasaur": 63.0}
+
+
+def test_price_snapshot(monkeypatch):
+    monkeypatch.setattr("utils.OBSERVATION_MODE", "change")
+    save_prices(scrape(Bulbasaur=63.0, Ivysaur=87.0))
+    assert get_price_snapshot() == {"Bulbasaur": (63.0, None), "Ivysaur": (87.0, None)}
+    save_prices(scrape(Bulbasaur=65.0, Ivysaur=87.0))
+    # Ivysaur не менялся: текущее наблюдение продлено, previous == latest
+    assert get_price_snapshot() == {
+        "Bulbasaur": (65.0, 63.0),
+        "Ivysaur": (87.0, 87.0),
+    }
+
+
+def test_notifier_reports_changes_from_snapshot(monkeypatch, mocker):
+    async def run_inline(func, *args, timeout=None, **kwargs):
+        # Потоки пула работают с другой базой в памяти
+        return func(*args, **kwargs)
+
+    monkeypatch.setattr(notifier, "run_db", run_inline)
+    monkeypatch.setattr(repository, "run_db", run_inline)
+    Subscription.create(user_id=1, subscribed=True, notify_only_on_change=True)
+    Subscription.create(user_id=2, subscribed=True)
+    save_prices(scrape(Bulbasaur=63.0, Ivysaur=87.0))
+    prices = scrape(Bulbasaur=65.0, Ivysaur=87.0)
+    save_prices(prices)
+    bot = mocker.Mock(send_message=mocker.AsyncMock())
+    asyncio.run(notifier.notify_subscribers(bot, prices))
+    sent = {call.args[0]: call.args[1] for call in bot.send_message.call_args_list}
+    assert sent[1] == "Product: Bulbasaur, Price: $65.00 (up $2.00)"
+    assert sent[2].splitlines() == [
+        "Product: Bulbasaur, Price: $65.00 (up $2.00)",
+        "Product: Ivysaur, Price: $87.00",
+    ]
+
+
+def test_basket_item_refers_to_catalogue_product():
+    save_prices(scrape(Bulbasaur=63.0))
+    product = Product.get(Product.name == "Bulbasaur")
+    basket = create_basket(user_id=1)
+    add_to_basket(basket.id, product.id)
+    save_prices(scrape(Bulbasaur=65.0))
+    assert BasketItem.get().product.price == 65.0
+
+
+def test_price_history_by_name():
+    save_prices(scrape(Bulbasaur=63.0, Ivysaur=87.0))
+    save_prices(scrape(Bulbasaur=65.0, Ivysaur=87.0))
+    history = get_price_history(product_name="Bulbasaur")
+    assert [record["price"] for record in history] == [63.0, 65.0]
+
+
+def test_price_history_of_unchanged_price():
+    """Цена не менялась внутри периода: история - наблюдение, обрезанное по началу."""
+    now = datetime.now()
+    product = Product.create(name="Bulbasaur", price=63.0)
+    PriceHistory.create(
+        product=product,
+        price=63.0,
+        timestamp=now - timedelta(days=10),
+        last_seen=now - timedelta(hours=1),
+    )
+    history = get_price_history(product_name="Bulbasaur", days=7)
+    assert [record["price"] for record in history] == [63.0, 63.0]
+    first = datetime.strptime(history[0]["timestamp"], "%Y-%m-%d %H:%M:%S")
+    assert now - timedelta(days=7, minutes=1) < first < now - timedelta(days=6)
+    assert history == [
+        {"timestamp": step[key].strftime("%Y-%m-%d %H:%M:%S"), "price": step["price"]}
+        for step in price_steps(product.id, first, now)
+        for key in ("start", "end")
+    ]
+
+
+def test_unchanged_price_extends_observation(monkeypatch):
+    import utils
+
+    monkeypatch.setattr(utils, "OBSERVATION_MODE", "change")
+    save_prices(scrape(Bulbasaur=63.0))
+    first = PriceHistory.get()
+    save_prices(scrape(Bulbasaur=63.0))
+    assert PriceHistory.select().count() == 1
+    current = PriceHistory.get()
+    assert current.last_seen > first.last_seen
+    # Цена на прошлом парсинге совпадает с текущей
+    assert get_previous_prices() == {"Bulbasaur": 63.0}
+    save_prices(scrape(Bulbasaur=65.0))
+    assert PriceHistory.select().count() == 2
+    assert get_previous_prices() == {"Bulbasaur": 63.0}
+
+
+def test_every_mode_writes_each_scrape(monkeypatch):
+    import utils
+
+    monkeypatch.setattr(utils, "OBSERVATION_MODE", "every")
+    save_prices(scrape(Bulbasaur=63.0))
+    save_prices(scrape(Bulbasaur=63.0))
+    assert PriceHistory.select().count() == 2
+
+
+def test_price_steps_reconstruct_history():
+    product = Product.create(name="Bulbasaur", price=65.0)
+    start = datetime(2025, 1, 1, 10, 0)
+    for minute, price, seen in ((0, 63.0, 30), (30, 65.0, 45)):
+        PriceHistory.create(
+            product=product,
+            price=price,
+            timestamp=start + timedelta(minutes=minute),
+            last_seen=start + timedelta(minutes=seen),
+        )
+    assert price_at(product.id, start + timedelta(minutes=10)) == 63.0
+    assert price_at(product.id, start - timedelta(minutes=1)) is None
+    steps = price_steps(
+        product.id, start + timedelta(minutes=10), start + timedelta(hours=1)
+    )
+    assert steps == [
+        {
+            "start": start + timedelta(minutes=10),
+            "end": start + timedelta(minutes=30),
+            "price": 63.0,
+        },
+        {
+            "start": start + timedelta(minutes=30),
+            "end": start + timedelta(minutes=45),
+            "price": 65.0,
+        },
+    ]
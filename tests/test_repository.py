@@ -0,0 +1,72 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from database import is_sqlite
+from models import PriceHistory, Subscription, db
+from services import repository
+
+# Бесконечный рекурсивный запрос: завершается только прерыванием
+ENDLESS_QUERY = (
+    "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) "
+    "SELECT COUNT(*) FROM n"
+)
+
+
+@pytest.fixture
+def single_worker(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(repository, "executor", executor)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+@pytest.mark.asyncio
+async def test_run_db_uses_worker_thread(single_worker):
+    result = await repository.run_db(lambda: threading.current_thread())
+    assert result is not threading.main_thread()
+
+
+@pytest.mark.asyncio
+async def test_run_db_propagates_errors(single_worker):
+    with pytest.raises(ValueError):
+        await repository.run_db(int, "not a number")
+
+
+@pytest.mark.asyncio
+async def test_run_db_timeout_interrupts_query(single_worker):
+    if not is_sqlite(db):
+        pytest.skip("прерывание запроса есть только у SQLite")
+    with pytest.raises(asyncio.TimeoutError):
+        await repository.run_db(db.execute_sql, ENDLESS_QUERY, timeout=0.2)
+    # Прерванный запрос освободил единственный поток пула
+    assert await repository.run_db(lambda: 42, timeout=5) == 42
+
+
+def test_toggle_notify_only_on_change(sample_user_id):
+    assert repository.toggle_notify_only_on_change(sample_user_id) is True
+    assert repository.toggle_notify_only_on_change(sample_user_id) is False
+    assert Subscription.select().count() == 1
+
+
+def test_pit_product_details(sample_product):
+    sample_product.category = "pit"
+    sample_product.save()
+    for price in (100.0, 110.0):
+        PriceHistory.create(product=sample_product, price=price)
+    product, history = repository.get_pit_product_details(sample_product.id)
+    assert product.id == sample_product.id
+    assert len(history) == 2
+    assert repository.get_pit_product_details(sample_product.id + 1) is None
+
+
+def test_set_subscription_upserts(sample_user_id):
+    repository.set_subscription(sample_user_id, True)
+    repository.toggle_notify_only_on_change(sample_user_id)
+    repository.set_subscription(sample_user_id, False)
+    sub = Subscription.get(Subscription.user_id == sample_user_id)
+    assert (sub.subscribed, sub.notify_only_on_change) == (False, True)
+    assert Subscription.select().count() == 1
+    assert repository.get_active_subscriptions() == []
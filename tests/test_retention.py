@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import DailyPriceRollup, HourlyPriceRollup, PriceHistory, Product, ScrapeRun
+from services import retention
+
+NOW = datetime(2025, 3, 20, 12, 0)
+
+
+@pytest.fixture
+def observations(test_database):
+    """Наблюдения товара раз в 20 минут за 10 дней до NOW."""
+    product = Product.create(name="Bulbasaur", price=60.0)
+    start = NOW - timedelta(days=10)
+    rows = [
+        {
+            "product": product,
+            "price": 60.0 + index % 7,
+            "timestamp": start + timedelta(minutes=20 * index),
+        }
+        for index in range(10 * 24 * 3)
+    ]
+    PriceHistory.insert_many(rows).execute()
+    return product, rows
+
+
+def test_old_observations_are_rolled_up(observations):
+    product, rows = observations
+    stats = retention.run_retention(NOW)
+    cutoff = retention.raw_cutoff(NOW)
+    rolled = [row for row in rows if row["timestamp"] < cutoff]
+    assert stats["observations"] == len(rolled)
+    assert PriceHistory.select().where(PriceHistory.timestamp < cutoff).count() == 0
+    assert PriceHistory.select().count() == len(rows) - len(rolled)
+
+    first_hour = HourlyPriceRollup.get(
+        HourlyPriceRollup.bucket == rolled[0]["timestamp"]
+    )
+    assert (first_hour.open, first_hour.close) == (60.0, 62.0)
+    assert (first_hour.min_price, first_hour.max_price) == (60.0, 62.0)
+    assert first_hour.samples == 3
+
+    day = DailyPriceRollup.get(
+        DailyPriceRollup.bucket == retention.floor_day(rolled[0]["timestamp"])
+    )
+    day_rows = [
+        row["price"] for row in rolled if row["timestamp"].date() == day.bucket.date()
+    ]
+    assert day.samples == len(day_rows)
+    assert (day.open, day.close) == (day_rows[0], day_rows[-1])
+    assert (day.min_price, day.max_price) == (min(day_rows), max(day_rows))
+
+
+def test_retention_is_idempotent(observations):
+    retention.run_retention(NOW)
+    stats = retention.run_retention(NOW)
+    assert stats["observations"] == 0
+
+
+def test_pit_history_is_kept(test_database):
+    product = Product.create(name="Milk", price=1.0, category="pit")
+    PriceHistory.create(product=product, price=1.0, timestamp=NOW - timedelta(days=30))
+    assert retention.run_retention(NOW)["observations"] == 0
+    assert PriceHistory.select().count() == 1
+
+
+def test_hourly_rollups_are_pruned(observations, monkeypatch):
+    monkeypatch.setattr(retention, "HOURLY_RETENTION_DAYS", 8)
+    stats = retention.run_retention(NOW)
+    assert stats["hourly_deleted"] > 0
+    assert (
+        HourlyPriceRollup.select()
+        .where(HourlyPriceRollup.bucket < retention.hourly_cutoff(NOW))
+        .count()
+        == 0
+    )
+    assert DailyPriceRollup.select().count() == 3
+
+
+def test_history_reads_all_tiers(observations, monkeypatch):
+    monkeypatch.setattr(retention, "HOURLY_RETENTION_DAYS", 8)
+    retention.run_retention(NOW)
+    points = retention.history_points(NOW - timedelta(days=30), "Bulbasaur")
+    timestamps = [timestamp for timestamp, _ in points]
+    assert timestamps == sorted(timestamps)
+    daily = DailyPriceRollup.select().where(
+        DailyPriceRollup.bucket < retention.hourly_cutoff(NOW)
+    )
+    hourly = HourlyPriceRollup.select()
+    raw = PriceHistory.select()
+    assert len(points) == daily.count() + hourly.count() + raw.count()
+    # Последняя точка - последнее сырое наблюдение
+    assert (
+        points[-1][0]
+        == PriceHistory.select(PriceHistory.timestamp)
+        .order_by(PriceHistory.timestamp.desc())
+        .scalar()
+    )
+
+
+def test_history_starts_with_rollup_in_effect(test_database):
+    product = Product.create(name="Ivysaur", price=87.0)
+    since = NOW - timedelta(days=30)
+    for model, bucket, close in [
+        (DailyPriceRollup, NOW - timedelta(days=120), 80.0),
+        (HourlyPriceRollup, NOW - timedelta(days=60), 85.0),
+        (HourlyPriceRollup, NOW - timedelta(days=10), 90.0),
+    ]:
+        model.create(
+            product=product,
+            bucket=bucket,
+            open=close,
+            close=close,
+            min_price=close,
+            max_price=close,
+            samples=1,
+            last_at=bucket,
+        )
+    # Цена на момент since - из последнего агрегата до него, а не из суточного
+    assert retention.history_points(since, "Ivysaur") == [
+        (since, 85.0),
+        (NOW - timedelta(days=10), 90.0),
+    ]
+    # Сырое наблюдение до since новее любого агрегата
+    PriceHistory.create(product=product, price=87.0, timestamp=NOW - timedelta(days=40))
+    assert retention.history_points(since, "Ivysaur")[0] == (since, 87.0)
+
+
+def test_current_observation_is_not_rolled_up(test_database):
+    product = Product.create(name="Ivysaur", price=87.0)
+    PriceHistory.create(
+        product=product,
+        price=87.0,
+        timestamp=NOW - timedelta(days=30),
+        last_seen=NOW - timedelta(minutes=1),
+    )
+    assert retention.run_retention(NOW)["observations"] == 0
+    assert PriceHistory.select().count() == 1
+
+
+def test_runs_without_observations_are_pruned(test_database):
+    product = Product.create(name="Bulbasaur", price=60.0)
+    old = NOW - timedelta(days=30)
+    rolled_run = ScrapeRun.create(started_at=old)
+    kept_run = ScrapeRun.create(started_at=old)
+    recent_run = ScrapeRun.create(started_at=NOW)
+    PriceHistory.create(product=product, price=60.0, timestamp=old, run=rolled_run)
+    # Текущее наблюдение не сворачивается, его запуск остаётся
+    PriceHistory.create(
+        product=product, price=61.0, timestamp=old, last_seen=NOW, run=kept_run
+    )
+    stats = retention.run_retention(NOW)
+    assert stats["runs_deleted"] == 1
+    assert {run.id for run in ScrapeRun.select()} == {kept_run.id, recent_run.id}
@@ -0,0 +1,95 @@
+from models import Product, db
+from services import snapshot
+from services.pit_db import save_pit_results
+from services.snapshot import load_entries, price_cache
+from utils import save_prices
+
+
+def scrape(**prices):
+    return {
+        name: {"price": price, "category": "pokemon"} for name, price in prices.items()
+    }
+
+
+def test_patch_matches_database(monkeypatch):
+    monkeypatch.setattr("utils.OBSERVATION_MODE", "change")
+    save_prices(scrape(Bulbasaur=63.0, Ivysaur=87.0))
+    first = price_cache.get()
+    save_prices(scrape(Bulbasaur=65.0, Ivysaur=87.0, Venusaur=120.0))
+    patched = price_cache.current()
+    assert patched.generation == first.generation + 1
+    assert patched.prices == {
+        "Bulbasaur": (65.0, 63.0),
+        "Ivysaur": (87.0, 87.0),
+        "Venusaur": (120.0, None),
+    }
+    assert patched.entries == load_entries()
+
+
+def test_generation_kept_when_prices_repeat(monkeypatch):
+    monkeypatch.setattr("utils.OBSERVATION_MODE", "change")
+    save_prices(scrape(Bulbasaur=63.0))
+    save_prices(scrape(Bulbasaur=65.0))
+    save_prices(scrape(Bulbasaur=65.0))  # previous становится равной latest
+    generation = price_cache.get().generation
+    save_prices(scrape(Bulbasaur=65.0))
+    assert price_cache.current().generation == generation
+
+
+def test_by_category():
+    save_prices(scrape(Ivysaur=87.0, Bulbasaur=63.0))
+    Product.create(name="Milk", price=1.0, category="dairy")
+    price_cache.invalidate()
+    categories = price_cache.get().by_category
+    assert list(categories) == ["dairy", "pokemon"]
+    assert [e.name for e in categories["pokemon"]] == ["Bulbasaur", "Ivysaur"]
+
+
+def test_pit_results_reset_snapshot():
+    save_prices(scrape(Bulbasaur=63.0))
+    price_cache.get()
+    item = {
+        "store": "Auchan",
+        "product_name": "Milk",
+        "price": 89.99,
+        "unit_size": 1.0,
+        "unit_type": "л",
+        "price_per_unit": 89.99,
+    }
+    save_pit_results([item])
+    assert price_cache.current() is None
+    assert price_cache.get().prices["Milk"] == (89.99, None)
+
+
+def test_patch_inside_outer_transaction_resets_snapshot():
+    save_prices(scrape(Bulbasaur=63.0))
+    price_cache.get()
+    with db.atomic():
+        save_prices(scrape(Bulbasaur=65.0))
+        assert price_cache.current() is None
+
+
+def test_expired_snapshot_is_reloaded(monkeypatch):
+    save_prices(scrape(Bulbasaur=63.0))
+    old = price_cache.get()
+    monkeypatch.setattr(snapshot.config, "PRICE_SNAPSHOT_TTL", -1)
+    assert price_cache.current() is None
+    assert price_cache.get().generation > old.generation
+
+
+def test_rebuild_overlapping_write_is_not_published(monkeypatch):
+    save_prices(scrape(Bulbasaur=63.0))
+    price_cache.invalidate()
+    load = snapshot.load_entries
+
+    def load_during_write():
+        # Запись во время запроса перестроения: блокировка при этом не занята
+        with price_cache.ingest():
+            return load()
+
+    monkeypatch.setattr(snapshot, "load_entries", load_during_write)
+    built = price_cache.rebuild()
+    assert built.prices == {"Bulbasaur": (63.0, None)}
+    assert price_cache.current() is None
+    monkeypatch.setattr(snapshot, "load_entries", load)
+    assert price_cache.get().generation > built.generation
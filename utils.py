@@ -1,53 +1,198 @@
 # /Project/PriceParser/utils.py
 
-from collections import defaultdict
 from datetime import datetime
 
-from peewee import fn
+from config import OBSERVATION_MODE
+from models import PriceHistory, Product, ScrapeRun, Subscription, db
+from services.pit_db import (
+    fetch_products_by_key,
+    insert_chunks,
+    product_key,
+    read_latest_prices,
+    record_latest_prices,
+    touch_observations,
+)
+from services.snapshot import price_cache
 
-from models import Product, Subscription
+# Товары scrapeme сохраняются без магазина и размера упаковки
+SCRAPE_STORE = "unknown"
 
 
 def save_prices(prices):
-    for name, data in prices.items():
-        Product.create(
-            name=name,
-            price=data["price"],
-            category=data.get("category", "uncategorized"),
-            timestamp=datetime.now(),
+    """
+    Сохраняет результат парсинга. Product - каталог (одна строка на товар)
+    с текущей ценой, цены записываются наблюдениями в PriceHistory.
+    В режиме OBSERVATION_MODE="change" новое наблюдение добавляется только
+    при изменении цены, иначе у текущего продлевается last_seen.
+
+    Весь парсинг записывается одной транзакцией с одним временем и
+    регистрируется запуском ScrapeRun. Возвращает id запуска (None, если
+    сохранять нечего); наблюдения запуска - ScrapeRun.price_history.
+    """
+    if not prices:
+        return None
+    timestamp = datetime.now()
+    change_only = OBSERVATION_MODE == "change"
+    keys = {name: product_key(SCRAPE_STORE, name, None, None) for name in prices}
+    # Перестроение снимка цен, идущее одновременно с записью, не затрёт патч
+    with price_cache.ingest():
+        with db.atomic():
+            products = fetch_products_by_key(keys.values())
+            new_rows = [
+                {
+                    "name": name,
+                    "price": data["price"],
+                    "category": data.get("category", "uncategorized"),
+                    "store": SCRAPE_STORE,
+                    "timestamp": timestamp,
+                }
+                for name, data in prices.items()
+                if keys[name] not in products
+            ]
+            # Цены до этого парсинга; у новых товаров их нет
+            last_prices = current_prices(product.id for product in products.values())
+            for chunk in insert_chunks(new_rows):
+                Product.insert_many(chunk).execute()
+            if new_rows:
+                products.update(
+                    fetch_products_by_key(keys[row["name"]] for row in new_rows)
+                )
+
+            changed = []
+            unchanged = []
+            for name, data in prices.items():
+                product = products[keys[name]]
+                category = data.get("category", "uncategorized")
+                if change_only and last_prices.get(product.id) == data["price"]:
+                    unchanged.append(product.id)
+                    if product.category == category:
+                        continue
+                product.price = data["price"]
+                product.category = category
+                product.timestamp = timestamp
+                changed.append(product)
+            Product.bulk_update(
+                changed,
+                [Product.price, Product.category, Product.timestamp],
+                batch_size=100,
+            )
+
+            unchanged_ids = set(unchanged)
+            history = [
+                (products[keys[name]].id, data["price"])
+                for name, data in prices.items()
+                if products[keys[name]].id not in unchanged_ids
+            ]
+            run = ScrapeRun.create(
+                started_at=timestamp, products=len(prices), observations=len(history)
+            )
+            history_rows = [
+                {
+                    "product": product_id,
+                    "price": price,
+                    "timestamp": timestamp,
+                    "last_seen": timestamp,
+                    "run": run.id,
+                }
+                for product_id, price in history
+            ]
+            for chunk in insert_chunks(history_rows):
+                PriceHistory.insert_many(chunk).execute()
+            touch_observations(unchanged, timestamp)
+            record_latest_prices(
+                [
+                    {
+                        "product": row["product"],
+                        "price": row["price"],
+                        "price_per_unit": None,
+                        "observed_at": timestamp,
+                    }
+                    for row in history_rows
+                ]
+            )
+
+        price_cache.patch(products.values())
+    return run.id
+
+
+def current_prices(product_ids):
+    """
+    Цены текущих наблюдений из LatestPrice: {product_id: price}. Товары
+    без строки LatestPrice считаются изменившимися и получат новое наблюдение.
+
+    Без отката к PriceHistory, как в pit_db.latest_prices: неизменную цену
+    save_prices продлевает через touch_observations по строке LatestPrice,
+    и товар без неё остался бы без текущего наблюдения и строки LatestPrice.
+    """
+    return read_latest_prices(product_ids)
+
+
+def price_at(product_id, moment):
+    """Цена товара в момент moment или None (проба индекса product + timestamp)."""
+    return (
+        PriceHistory.select(PriceHistory.price)
+        .where(
+            (PriceHistory.product == product_id) & (PriceHistory.timestamp <= moment)
         )
+        .order_by(PriceHistory.timestamp.desc(), PriceHistory.id.desc())
+        .limit(1)
+        .scalar()
+    )
 
 
-def get_latest_prices():
-    """Возвращает последние цены каждого продукта."""
-    subquery = Product.select(
-        Product.name, fn.MAX(Product.timestamp).alias("max_time")
-    ).group_by(Product.name)
-
-    latest_prices = {}
-    for row in subquery:
-        latest_record = (
-            Product.select()
-            .where((Product.name == row.name) & (Product.timestamp == row.max_time))
-            .first()
+def price_steps(product_id, start, end):
+    """
+    Восстанавливает цену товара на отрезке [start, end] как ступенчатую
+    функцию: [{"start", "end", "price"}]. Ступень длится до следующего
+    наблюдения, последняя - до last_seen (когда цену видели в последний раз).
+    """
+    history = PriceHistory.select(
+        PriceHistory.price, PriceHistory.timestamp, PriceHistory.last_seen
+    ).where(PriceHistory.product == product_id)
+    # Наблюдение, действовавшее на момент start, и все изменения после него
+    first = (
+        history.where(PriceHistory.timestamp <= start)
+        .order_by(PriceHistory.timestamp.desc(), PriceHistory.id.desc())
+        .limit(1)
+    )
+    rest = history.where(
+        (PriceHistory.timestamp > start) & (PriceHistory.timestamp <= end)
+    ).order_by(PriceHistory.timestamp, PriceHistory.id)
+    rows = list(first.tuples()) + list(rest.tuples())
+
+    steps = []
+    for index, (price, timestamp, last_seen) in enumerate(rows):
+        if index + 1 < len(rows):
+            until = rows[index + 1][1]
+        else:
+            until = last_seen or timestamp
+        steps.append(
+            {"start": max(timestamp, start), "end": min(until, end), "price": price}
         )
-        if latest_record:
-            latest_prices[latest_record.name] = latest_record.price
-    return latest_prices
+    return steps
+
+
+def get_price_snapshot():
+    """
+    Текущая и предыдущая цена каждого товара: {name: (latest, previous)},
+    previous - None для новых товаров. Читается из снимка в памяти
+    (services/snapshot.py), база запрашивается, только если его нет.
+    """
+    return price_cache.get().prices
+
+
+def get_latest_prices():
+    """Возвращает последние цены каждого продукта (текущие цены каталога)."""
+    return {name: latest for name, (latest, _) in get_price_snapshot().items()}
 
 
 def get_previous_prices():
-    """Возвращает предпоследние цены каждого продукта."""
-    previous_prices = {}
-    # Группируем записи по имени
-    grouped = defaultdict(list)
-    for product in Product.select().order_by(Product.name, Product.timestamp.desc()):
-        grouped[product.name].append(product)
-
-    for name, records in grouped.items():
-        if len(records) >= 2:
-            previous_prices[name] = records[1].price  # 2-я по времени
-    return previous_prices
+    """Возвращает цены каждого продукта на предыдущем парсинге."""
+    return {
+        name: previous
+        for name, (_, previous) in get_price_snapshot().items()
+        if previous is not None
+    }
 
 
 def get_subscribers():
@@ -3,13 +3,13 @@
 import os
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from peewee import fn
 
 from models import Product
 from services.history import get_price_history, plot_price_history
+from services.repository import price_snapshot, run_db
 
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -23,36 +23,23 @@ def favicon():
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
-    # Берём последние цены по каждому товару (с самым новым timestamp)
-    subquery = Product.select(
-        Product.name, fn.MAX(Product.timestamp).alias("max_time")
-    ).group_by(Product.name)
-
-    query = (
-        Product.select()
-        .join(
-            subquery,
-            on=(
-                (Product.name == subquery.c.name)
-                & (Product.timestamp == subquery.c.max_time)
-            ),
-        )
-        .order_by(Product.category, Product.name)
-    )
-
-    # Группируем по категориям
-    categories = {}
-    for product in query:
-        categories.setdefault(product.category, []).append(product)
+    # Текущие цены по категориям из снимка в памяти; пока поколение снимка
+    # не изменилось, браузер получает 304 по ETag
+    snapshot = await price_snapshot()
+    etag = f'"prices-{snapshot.version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
 
     return templates.TemplateResponse(
-        "index.html", {"request": request, "categories": categories}
+        "index.html",
+        {"request": request, "categories": snapshot.by_category},
+        headers={"ETag": etag},
     )
 
 
 @app.get("/history/{product_name}", response_class=HTMLResponse)
 async def history(request: Request, product_name: str):
-    history = get_price_history(product_name=product_name, days=7)
+    history = await run_db(get_price_history, product_name=product_name, days=7)
     if not history:
         raise HTTPException(status_code=404, detail="No history found")
 